@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+'''
+One-shot detection of the cloud platform a minion runs on, so that the cloud
+metadata grains return right away on hosts where there is no metadata service
+to wait for.
+
+The probe reads the DMI strings in ``/sys/class/dmi/id`` and, at the same
+time, tries to open a TCP connection to the link-local metadata address
+169.254.169.254. It runs once per minion process and its result is kept in
+the grain cache (see ``_grain_cache.py``), so it also survives restarts.
+
+The detection can be bypassed in the minion config:
+
+.. code-block:: yaml
+
+    cloud_platform: ec2     # or gce, digitalocean, vultr, none
+
+Grain modules import it the same way as the grain cache:
+
+.. code-block:: python
+
+    try:
+        import _cloud_probe
+    except ImportError:
+        from salt.grains import _cloud_probe
+
+    def my_grain():
+        if not _cloud_probe.on_cloud(__opts__, 'ec2'):
+            return {}
+'''
+from __future__ import absolute_import
+
+# Import Python Libs
+import logging
+import os
+import socket
+import threading
+
+try:
+    import _grain_cache
+except ImportError:
+    from salt.grains import _grain_cache
+
+LOG = logging.getLogger(__name__)
+
+SYSFS_ROOT = '/sys'
+METADATA_HOST = '169.254.169.254'
+METADATA_PORT = 80
+METADATA_TIMEOUT = 0.25
+
+DMI_FIELDS = ('sys_vendor', 'product_name', 'product_version',
+              'bios_vendor', 'bios_version', 'board_vendor',
+              'chassis_asset_tag')
+
+# platform -> lowercase strings looked for in the DMI fields
+DMI_MARKERS = (
+    ('ec2', ('amazon',)),
+    ('gce', ('google',)),
+    ('digitalocean', ('digitalocean',)),
+    ('vultr', ('vultr',)),
+)
+
+_LOCK = threading.Lock()
+_RESULT = {}
+
+
+def _read_dmi(root):
+    '''
+    Return the readable DMI fields, lowercased
+    '''
+    dmi = {}
+    for field in DMI_FIELDS:
+        try:
+            with open(os.path.join(root, 'class', 'dmi', 'id', field)) as handle:
+                dmi[field] = handle.read().strip().lower()
+        except (IOError, OSError):
+            continue
+    # Xen based EC2 instances may have no DMI but a hypervisor uuid
+    try:
+        with open(os.path.join(root, 'hypervisor', 'uuid')) as handle:
+            if handle.read().strip().lower().startswith('ec2'):
+                dmi['hypervisor_uuid'] = 'amazon'
+    except (IOError, OSError):
+        pass
+    return dmi
+
+
+def _platform(dmi):
+    for platform, markers in DMI_MARKERS:
+        for value in dmi.values():
+            if any(marker in value for marker in markers):
+                return platform
+    return None
+
+
+def _metadata_reachable(result):
+    try:
+        conn = socket.create_connection((METADATA_HOST, METADATA_PORT),
+                                        METADATA_TIMEOUT)
+        conn.close()
+        result['metadata'] = True
+    except (socket.error, socket.timeout):
+        result['metadata'] = False
+
+
+def _probe():
+    '''
+    Read the DMI fields while the metadata address is being reached
+    '''
+    result = {}
+    thread = threading.Thread(target=_metadata_reachable, args=(result,))
+    thread.daemon = True
+    thread.start()
+    platform = _platform(_read_dmi(SYSFS_ROOT))
+    thread.join(METADATA_TIMEOUT * 2)
+    return {'platform': platform, 'metadata': result.get('metadata', False)}
+
+
+def probe(opts):
+    '''
+    Return a dictionary with the platform detected from DMI (or None) and
+    whether the metadata address answered
+    '''
+    with _LOCK:
+        if not _RESULT:
+            _RESULT.update(_grain_cache.cached(opts, 'cloud_probe', _probe,
+                                               ttl=86400) or {})
+            LOG.debug('Cloud platform probe: %s', _RESULT)
+        return dict(_RESULT)
+
+
+def on_cloud(opts, platform):
+    '''
+    Return whether the metadata grains of the given platform are worth
+    looking up on this host
+    '''
+    forced = (opts or {}).get('cloud_platform')
+    if forced:
+        return forced == platform
+    result = probe(opts)
+    if result.get('platform'):
+        return result['platform'] == platform
+    # Unknown hardware, eg. no DMI in a container: only the metadata service
+    # can tell
+    return bool(result.get('metadata'))
+
+
+def reset(opts):
+    '''
+    Forget the result of the probe, in this process and in the grain cache
+    '''
+    with _LOCK:
+        _RESULT.clear()
+        _grain_cache.invalidate(opts, 'cloud_probe')
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+'''
+File-backed cache for grains that are slow to compute, eg. because they
+need remote lookups (cloud metadata services, external APIs...).
+
+The module name starts with an underscore so that the grains loader does not
+load it as a grain module, grain modules import it instead:
+
+.. code-block:: python
+
+    try:
+        import _grain_cache
+    except ImportError:
+        from salt.grains import _grain_cache
+
+    def my_grain():
+        return _grain_cache.cached(__opts__, 'my_grain', _my_grain, ttl=3600)
+
+Every grain is stored in its own JSON file. A fresh entry is returned without
+calling the grain function. An expired entry is still returned right away
+(stale-while-revalidate) while a background thread refreshes it, unless it is
+older than ``max_stale``. An empty result (eg. "not on this cloud") is kept
+as a negative entry with its own TTL. If the grain function raises, the error
+is logged and the last known value, if any, is returned.
+
+Everything can be tuned in the minion config:
+
+.. code-block:: yaml
+
+    grain_cache:
+      enabled: True
+      dir: /var/cache/salt/minion/grain_cache
+      ttl:
+        ec2_tags: 600
+      negative_ttl: 3600
+      max_stale: 86400
+
+The source (cold, warm, stale, negative) and duration of the last load of
+every grain are available from ``timings()``, and logged at debug level.
+'''
+from __future__ import absolute_import
+
+# Import Python Libs
+import json
+import logging
+import os
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_NEGATIVE_TTL = 3600
+DEFAULT_MAX_STALE = 86400
+
+_LOCK = threading.Lock()
+# Names of the grains being refreshed in the background
+_REFRESHING = set()
+# name -> source and duration of the last load
+_TIMINGS = {}
+
+
+def _config(opts):
+    return (opts or {}).get('grain_cache') or {}
+
+
+def _cache_dir(opts):
+    conf = _config(opts)
+    if conf.get('dir'):
+        return conf['dir']
+    cachedir = (opts or {}).get('cachedir', '/var/cache/salt/minion')
+    return os.path.join(cachedir, 'grain_cache')
+
+
+def _cache_path(opts, name):
+    return os.path.join(_cache_dir(opts), '{0}.json'.format(name))
+
+
+def _is_negative(value):
+    '''
+    An empty result, or a dictionary of empty values, means the grain does
+    not apply to this host
+    '''
+    if isinstance(value, dict):
+        return not any(value.values())
+    return not value
+
+
+def _read(path):
+    try:
+        with open(path) as handle:
+            entry = json.load(handle)
+    except (IOError, OSError, ValueError):
+        return None
+    if not isinstance(entry, dict) or 'time' not in entry:
+        return None
+    return entry
+
+
+def _write(path, entry):
+    tmp = '{0}.{1}.{2}'.format(path, os.getpid(), threading.current_thread().ident)
+    try:
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(tmp, 'w') as handle:
+            json.dump(entry, handle)
+        os.rename(tmp, path)
+    except (IOError, OSError, TypeError, ValueError) as err:
+        LOG.debug('Could not write grain cache %s: %s', path, err)
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+
+def _fetch(path, name, func, key=None):
+    '''
+    Call the grain function and store its result along with key.
+    Returns the new entry, or None when the function failed.
+    '''
+    start = time.time()
+    try:
+        value = func()
+    except Exception as err:
+        LOG.error('Could not load grain %s: %s', name, err)
+        return None
+    now = time.time()
+    entry = {'time': now,
+             'elapsed': now - start,
+             'negative': _is_negative(value),
+             'key': key,
+             'value': value}
+    _write(path, entry)
+    return entry
+
+
+def _refresh(path, name, func, key):
+    try:
+        _fetch(path, name, func, key)
+    finally:
+        with _LOCK:
+            _REFRESHING.discard(name)
+
+
+def _revalidate(path, name, func, key):
+    '''
+    Refresh an entry in a background thread, once at a time per grain
+    '''
+    with _LOCK:
+        if name in _REFRESHING:
+            return
+        _REFRESHING.add(name)
+    thread = threading.Thread(target=_refresh, args=(path, name, func, key),
+                              name='grain_cache-{0}'.format(name))
+    thread.daemon = True
+    thread.start()
+
+
+def _record(name, source, start, entry=None):
+    elapsed = time.time() - start
+    _TIMINGS[name] = {'source': source,
+                      'elapsed': elapsed,
+                      'fetch': entry and entry.get('elapsed')}
+    LOG.debug('Loaded grain %s (%s) in %.3fs', name, source, elapsed)
+
+
+def cached(opts, name, func, ttl=3600, negative_ttl=None, max_stale=None,
+           key=None):
+    '''
+    Return the value of the grain function func, cached under name.
+
+    opts
+        The minion options, usually ``__opts__``
+
+    ttl
+        Seconds a value stays fresh, overridden by ``grain_cache:ttl:<name>``
+
+    negative_ttl
+        Seconds an empty value stays fresh, defaults to
+        ``grain_cache:negative_ttl`` or 3600
+
+    max_stale
+        Seconds after expiry during which a value is still served while it is
+        refreshed in the background, defaults to ``grain_cache:max_stale`` or
+        86400
+
+    key
+        Optional string identifying what the value was computed from (eg. a
+        boot id or a hash of an input file), a cached value computed from
+        another key is never returned
+    '''
+    start = time.time()
+    conf = _config(opts)
+    if not conf.get('enabled', True):
+        try:
+            return func()
+        except Exception as err:
+            LOG.error('Could not load grain %s: %s', name, err)
+            return None
+
+    ttl = (conf.get('ttl') or {}).get(name, ttl)
+    if negative_ttl is None:
+        negative_ttl = conf.get('negative_ttl', DEFAULT_NEGATIVE_TTL)
+    if max_stale is None:
+        max_stale = conf.get('max_stale', DEFAULT_MAX_STALE)
+
+    path = _cache_path(opts, name)
+    entry = _read(path)
+    if entry is not None and key is not None and entry.get('key') != key:
+        entry = None
+    if entry is not None:
+        age = start - entry['time']
+        expiry = negative_ttl if entry.get('negative') else ttl
+        source = 'negative' if entry.get('negative') else 'warm'
+        if 0 <= age < expiry:
+            _record(name, source, start, entry)
+            return entry['value']
+        if 0 <= age < expiry + max_stale:
+            _revalidate(path, name, func, key)
+            _record(name, 'stale', start, entry)
+            return entry['value']
+
+    fresh = _fetch(path, name, func, key)
+    if fresh is None:
+        # Better a value too old than no value at all
+        _record(name, 'error', start)
+        return entry and entry['value']
+    _record(name, 'cold', start, fresh)
+    return fresh['value']
+
+
+def invalidate(opts, name=None):
+    '''
+    Remove the cache entry of one grain, or all of them
+    '''
+    if name is not None:
+        paths = [_cache_path(opts, name)]
+    else:
+        cache_dir = _cache_dir(opts)
+        try:
+            paths = [os.path.join(cache_dir, x)
+                     for x in os.listdir(cache_dir) if x.endswith('.json')]
+        except OSError:
+            paths = []
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def timings():
+    '''
+    Return the source (cold, warm, stale, negative or error) and the duration
+    in seconds of the last load of every cached grain. For cached values,
+    fetch is the duration of the remote lookup that produced them.
+    '''
+    return dict((name, dict(timing)) for name, timing in _TIMINGS.items())
@@ -19,14 +19,27 @@ from __future__ import absolute_import
 # Import Python Libs
 import requests
 
+try:
+    import _cloud_probe
+    import _grain_cache
+except ImportError:
+    from salt.grains import _cloud_probe
+    from salt.grains import _grain_cache
 
-def digitalocean():
-    '''
-    Return DigitalOcean metadata.
-    '''
+
+def _digitalocean():
     do_svr = 'http://169.254.169.254/metadata/v1.json'
-    metadata = requests.get(do_svr)
+    metadata = requests.get(do_svr, timeout=1)
 
     if metadata.status_code == 200:
         return {'digitalocean': metadata.json()}
     return {'digitalocean': []}
+
+
+def digitalocean():
+    '''
+    Return DigitalOcean metadata.
+    '''
+    if not _cloud_probe.on_cloud(__opts__, 'digitalocean'):
+        return {'digitalocean': []}
+    return _grain_cache.cached(__opts__, 'digitalocean', _digitalocean, ttl=3600)
@@ -6,46 +6,140 @@ Author: Erik Günther, J C Lawrence <claw@kanga.nu>, Mark McGuire
 from __future__ import absolute_import
 
 import logging
+import os
 import socket
 import json
+import threading
+from multiprocessing.pool import ThreadPool
 try:
-    from http.client import HTTPConnection, BadStatusLine
+    from http.client import HTTPConnection, BadStatusLine, HTTPException
 except ImportError:
-    from salt.ext.six.moves.http_client import HTTPConnection, BadStatusLine
+    from salt.ext.six.moves.http_client import HTTPConnection, BadStatusLine, HTTPException
+
+try:
+    import _cloud_probe
+except ImportError:
+    from salt.grains import _cloud_probe
 
 
 # Set up logging
 LOG = logging.getLogger(__name__)
 
+AWS_HOST = "169.254.169.254"
+AWS_PORT = 80
+AWS_TIMEOUT = 1
+# Number of metadata leaves fetched concurrently
+WORKERS = 8
+
+# Metadata that cannot change for the lifetime of an instance, kept in the
+# cache file and not fetched again as long as the instance-id matches
+IMMUTABLE_PATHS = ('ami-id', 'ami-launch-index', 'ami-manifest-path',
+                   'block-device-mapping/', 'instance-id', 'placement/',
+                   'services/')
+CACHE_FILE = 'ec2_info.json'
+
+# One keep-alive connection per thread
+_LOCAL = threading.local()
+
+
+class _Response(object):
+    """
+    Fully read response, so that the connection can be reused right away
+    """
+    def __init__(self, status, data):
+        self.status = status
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+def _connection(fresh=False):
+    conn = getattr(_LOCAL, 'conn', None)
+    if conn is None or fresh:
+        if conn is not None:
+            conn.close()
+        conn = HTTPConnection(AWS_HOST, AWS_PORT, timeout=AWS_TIMEOUT)
+        _LOCAL.conn = conn
+        _LOCAL.used = False
+    return conn
+
+
+def _close_connection():
+    conn = getattr(_LOCAL, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _LOCAL.conn = None
+
 
 def _call_aws(url):
     """
     Call AWS via httplib. Require correct path.
     Host: 169.254.169.254
+    The connection of the calling thread is kept alive between calls and
+    reopened once if the metadata service closed it.
+    """
+    conn = _connection()
+    try:
+        conn.request('GET', url)
+        resp = conn.getresponse()
+        data = resp.read()
+    except (HTTPException, socket.error):
+        # Only a reused connection may have been dropped by the server, a
+        # failure on a new one means there is no metadata service at all
+        if not _LOCAL.used:
+            _close_connection()
+            raise
+        conn = _connection(fresh=True)
+        conn.request('GET', url)
+        resp = conn.getresponse()
+        data = resp.read()
+    _LOCAL.used = True
+    if resp.getheader('connection', '').lower() == 'close':
+        _close_connection()
+    return _Response(resp.status, data)
+
+
+def _fetch_leaf(url):
+    return _call_aws(url).read().decode('utf-8')
+
+
+def _fetch_leaves(urls, pool=None):
+    """
+    Fetch the given metadata leaves, concurrently when a pool is given
     """
-    conn = HTTPConnection("169.254.169.254", 80, timeout=1)
-    conn.request('GET', url)
-    return conn.getresponse()
+    if pool is None or len(urls) < 2:
+        return [_fetch_leaf(url) for url in urls]
+    return pool.map(_fetch_leaf, urls)
 
 
-def _get_ec2_hostinfo(path=""):
+def _get_ec2_hostinfo(path="", pool=None, skip=()):
     """
     Recursive function that walks the EC2 metadata available to each minion.
     :param path: URI fragment to append to /latest/meta-data/
+    :param pool: optional thread pool used to fetch sibling leaves concurrently
+    :param skip: entries of the metadata root that are not fetched
     Returns a nested dictionary containing all the EC2 metadata. All keys
     are converted from dash case to snake case.
     """
     resp = _call_aws("/latest/meta-data/{0}".format(path))
     resp_data = resp.read().decode('utf-8').strip()
     d = {}
+    lines = []
     for line in resp_data.split("\n"):
         if path == "public-keys/":
             line = line.split("=")[0] + "/"
         if path == "instance-id/":
             return {'instance-id': line}
+        if not line or (not path and line in skip):
+            continue
+        lines.append(line)
+    leaves = [line for line in lines if line[-1] != "/"]
+    fetched = dict(zip(leaves, _fetch_leaves(
+        ["/latest/meta-data/{0}".format(path + line) for line in leaves], pool)))
+    for line in lines:
         if line[-1] != "/":
-            call_response = _call_aws("/latest/meta-data/{0}".format(path + line))
-            call_response_data = call_response.read().decode('utf-8')
+            call_response_data = fetched[line]
             # avoid setting empty grain
             if call_response_data == '':
                 d[line] = None
@@ -66,7 +160,7 @@ def _get_ec2_hostinfo(path=""):
             else:
                 return line
         else:
-            d[_dash_to_snake_case(line[:-1])] = _get_ec2_hostinfo(path + line)
+            d[_dash_to_snake_case(line[:-1])] = _get_ec2_hostinfo(path + line, pool)
     return d
 
 
@@ -85,6 +179,61 @@ def _snake_caseify_dict(d):
     return nd
 
 
+def _opts():
+    return __opts__ if '__opts__' in globals() else {}
+
+
+def _cache_path():
+    return os.path.join(_opts().get('cachedir', '/var/cache/salt/minion'), CACHE_FILE)
+
+
+def _read_cache(instance_id):
+    """
+    Return the cached immutable metadata of this instance, or None when
+    there is no cache file or it was written by another instance (eg. a
+    minion baked into an AMI)
+    """
+    try:
+        with open(_cache_path()) as handle:
+            cached = json.load(handle)
+    except (IOError, OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get('instance_id') != instance_id:
+        return None
+    return cached
+
+
+def _write_cache(hostinfo):
+    """
+    Persist the immutable part of the metadata
+    """
+    keys = [_dash_to_snake_case(x.rstrip('/')) for x in IMMUTABLE_PATHS]
+    cached = dict((key, hostinfo[key]) for key in keys if key in hostinfo)
+    path = _cache_path()
+    tmp = '{0}.{1}'.format(path, os.getpid())
+    try:
+        with open(tmp, 'w') as handle:
+            json.dump(cached, handle)
+        os.rename(tmp, path)
+    except (IOError, OSError) as err:
+        LOG.debug("Could not write EC2 cache file %s: %s", path, err)
+
+
+def _get_ec2_hostinfo_cached(pool=None):
+    """
+    Walk the EC2 metadata, reusing the immutable part from the cache file
+    """
+    instance_id = _fetch_leaf("/latest/meta-data/instance-id")
+    cached = _read_cache(instance_id)
+    if cached is None:
+        hostinfo = _get_ec2_hostinfo(pool=pool)
+        _write_cache(hostinfo)
+        return hostinfo
+    hostinfo = _get_ec2_hostinfo(pool=pool, skip=IMMUTABLE_PATHS)
+    hostinfo.update(cached)
+    return hostinfo
+
+
 def _get_ec2_additional():
     """
     Recursive call in _get_ec2_hostinfo() does not retrieve some of
@@ -143,16 +292,29 @@ def _get_instance_identity():
     return result
 
 
+def _ec2_info():
+    pool = ThreadPool(WORKERS)
+    try:
+        grains = _get_ec2_additional()
+        grains.update({'user-data': _get_ec2_user_data()})
+        grains.update(_get_ec2_hostinfo_cached(pool))
+        grains['instance_identity'].update(_get_instance_identity())
+        return grains
+    finally:
+        # The connections of the pool threads go away with their threads
+        pool.close()
+        pool.join()
+        _close_connection()
+
+
 def ec2_info():
     """
     Collect all ec2 grains into the 'ec2' key.
     """
+    if not _cloud_probe.on_cloud(_opts(), 'ec2'):
+        return {}
     try:
-        grains = _get_ec2_additional()
-        grains.update({'user-data': _get_ec2_user_data()})
-        grains.update(_get_ec2_hostinfo())
-        grains['instance_identity'].update(_get_instance_identity())
-        return {'ec2': grains}
+        return {'ec2': _ec2_info()}
 
     except BadStatusLine as error:
         LOG.debug(error)
@@ -176,8 +338,13 @@ def ec2_instance_id():
     Set the top-level grain 'instance-id' per the grain expected
     by pillar-ec2.
     """
+    if not _cloud_probe.on_cloud(_opts(), 'ec2'):
+        return {}
     try:
-        instance_id = list(_get_ec2_hostinfo("instance-id/").values())[0]
+        try:
+            instance_id = list(_get_ec2_hostinfo("instance-id/").values())[0]
+        finally:
+            _close_connection()
         return {'instance-id': instance_id}
 
     except BadStatusLine as error:
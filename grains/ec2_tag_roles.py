@@ -22,8 +22,16 @@ try:
 except ImportError:
     pass
 
+try:
+    import _cloud_probe
+except ImportError:
+    from salt.grains import _cloud_probe
+
 
 def ec2_roles():
+    if not _cloud_probe.on_cloud(__opts__, 'ec2'):
+        return {}
+
     # Get meta-data from instance
     metadata = get_instance_metadata()
 
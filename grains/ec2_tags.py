@@ -54,6 +54,13 @@ from salt.utils.versions import StrictVersion
 import boto.ec2
 import boto.utils
 
+try:
+    import _cloud_probe
+    import _grain_cache
+except ImportError:
+    from salt.grains import _cloud_probe
+    from salt.grains import _grain_cache
+
 log = logging.getLogger(__name__)
 
 AWS_CREDENTIALS = {
@@ -91,7 +98,7 @@ def _get_credentials():
     return creds
 
 
-def ec2_tags():
+def _ec2_tags():
     boto_version = StrictVersion(boto.__version__)
     required_boto_version = StrictVersion('2.8.0')
     if boto_version < required_boto_version:
@@ -106,26 +113,19 @@ def ec2_tags():
     instance_id, region = _get_instance_info()
     credentials = _get_credentials()
 
-    # Connect to EC2 and parse the Roles tags for this instance
-    try:
-        conn = boto.ec2.connect_to_region(
-            region,
-            aws_access_key_id=credentials['access_key'],
-            aws_secret_access_key=credentials['secret_key'],
-        )
-    except Exception as e:
-        log.error("Could not get AWS connection: %s", e)
-        return None
+    # Connect to EC2 and parse the Roles tags for this instance. Errors are
+    # raised so that they are not cached as "not an EC2 instance"
+    conn = boto.ec2.connect_to_region(
+        region,
+        aws_access_key_id=credentials['access_key'],
+        aws_secret_access_key=credentials['secret_key'],
+    )
 
     ec2_tags = {}
-    try:
-        tags = conn.get_all_tags(filters={'resource-type': 'instance',
-                                          'resource-id': instance_id})
-        for tag in tags:
-            ec2_tags[tag.name] = tag.value
-    except Exception as e:
-        log.error("Couldn't retrieve instance tags: %s", e)
-        return None
+    tags = conn.get_all_tags(filters={'resource-type': 'instance',
+                                      'resource-id': instance_id})
+    for tag in tags:
+        ec2_tags[tag.name] = tag.value
 
     ret = dict(ec2_tags=ec2_tags)
 
@@ -134,3 +134,9 @@ def ec2_tags():
         ret['ec2_roles'] = ec2_tags['Roles'].split(',')
 
     return ret
+
+
+def ec2_tags():
+    if not _cloud_probe.on_cloud(__opts__, 'ec2'):
+        return None
+    return _grain_cache.cached(__opts__, 'ec2_tags', _ec2_tags, ttl=600)
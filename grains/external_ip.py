@@ -28,18 +28,20 @@ except ImportError:
 # Import salt libs
 from salt.utils.validate.net import ipv4_addr as _ipv4_addr
 
+try:
+    import _grain_cache
+except ImportError:
+    from salt.grains import _grain_cache
 
-def ext_ip():
-    '''
-    Return the external IP address
-    '''
+
+def _ext_ip():
     check_ips = ('http://ipecho.net/plain',
                  'http://v4.ident.me')
 
     for url in check_ips:
         try:
             with contextlib.closing(urllib2.urlopen(url, timeout=3)) as req:
-                ip_ = req.read().strip()
+                ip_ = req.read().decode('utf-8').strip()
                 if not _ipv4_addr(ip_):
                     continue
             return {'external_ip': ip_}
@@ -50,3 +52,11 @@ def ext_ip():
 
     # Return an empty value as a last resort
     return {'external_ip': []}
+
+
+def ext_ip():
+    '''
+    Return the external IP address
+    '''
+    return _grain_cache.cached(__opts__, 'external_ip', _ext_ip, ttl=300,
+                               negative_ttl=300)
@@ -1,4 +1,26 @@
 # -*- coding: utf-8 -*-
+'''
+Return facter facts as grains, prefixed with ``facter_``.
+
+Running facter loads the puppet libraries and computes every fact, which
+takes seconds, so the facts are cached (see _grain_cache.py). This can be
+tuned in the minion config:
+
+.. code-block:: yaml
+
+    facter:
+      # only compute these facts, all of them by default
+      facts:
+        - osfamily
+        - memorysize
+      # load the puppet libraries, for puppet specific facts
+      puppet: True
+      # seconds the cached facts are used without running facter
+      ttl: 3600
+      # once expired, keep serving the cached facts while facter runs in
+      # the background
+      background_refresh: True
+'''
 from __future__ import absolute_import
 
 import salt.utils
@@ -9,6 +31,11 @@ import logging
 import json
 from salt.ext import six
 
+try:
+    import _grain_cache
+except ImportError:
+    from salt.grains import _grain_cache
+
 log = logging.getLogger(__name__)
 
 __salt__ = {
@@ -16,6 +43,12 @@ __salt__ = {
     'cmd.run_all': salt.modules.cmdmod._run_all_quiet
 }
 
+DEFAULT_TTL = 3600
+
+
+def _opts():
+    return __opts__ if '__opts__' in globals() else {}
+
 
 def _check_facter():
     '''
@@ -24,29 +57,58 @@ def _check_facter():
     salt.utils.check_or_die('facter')
 
 
-def facter():
+def _facter_cmd(facts=None, puppet=True):
     '''
-    Return facter facts as grains.
+    Return the facter command line computing the given facts.
     '''
-    _check_facter()
+    # -p: load puppet libraries, for puppet specific facts
+    # -j: return json data
+    cmd = ['facter']
+    if puppet:
+        cmd.append('-p')
+    cmd.append('-j')
+    cmd.extend(facts or [])
+    return ' '.join(cmd)
 
-    grains = {}
+
+def _run_facter(facts=None, puppet=True):
+    '''
+    Run facter and return its facts as grains. Failures are raised so that
+    they do not end up in the cache, _grain_cache.cached logs them and
+    facter() returns the last cached facts or {}, whether the cache is
+    enabled or not.
+    '''
     try:
-        # -p: load puppet libraries, for puppet specific facts
-        # -j: return json data
-        output = __salt__['cmd.run']('facter -p -j')
-        try:
-            facts = json.loads(output)
-        except (KeyError, ValueError):
-            log.critical('Failed to load json facter data')
-            return {}
-        for key, value in six.iteritems(facts):
-            # Prefix fact names with 'facter_', so it doesn't
-            # conflict with existing or future grain names.
-            grain = 'facter_{0}'.format(key)
-            grains[grain] = value
-        return grains
+        output = __salt__['cmd.run'](_facter_cmd(facts, puppet))
     except OSError:
         log.critical('Failed to run facter')
-        return {}
-    return {}
+        raise
+    try:
+        facts = json.loads(output)
+    except (KeyError, ValueError):
+        log.critical('Failed to load json facter data')
+        raise
+    grains = {}
+    for key, value in six.iteritems(facts):
+        # Prefix fact names with 'facter_', so it doesn't
+        # conflict with existing or future grain names.
+        grain = 'facter_{0}'.format(key)
+        grains[grain] = value
+    return grains
+
+
+def facter():
+    '''
+    Return facter facts as grains.
+    '''
+    _check_facter()
+
+    conf = _opts().get('facter') or {}
+    facts = sorted(conf.get('facts') or [])
+    puppet = conf.get('puppet', True)
+    return _grain_cache.cached(
+        _opts(), 'facter', lambda: _run_facter(facts, puppet),
+        ttl=conf.get('ttl', DEFAULT_TTL),
+        max_stale=None if conf.get('background_refresh', True) else 0,
+        # facts cached for another selection are not used
+        key=_facter_cmd(facts, puppet)) or {}
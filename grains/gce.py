@@ -14,22 +14,25 @@ from socket import gaierror
 import json
 import re
 
+try:
+    import _cloud_probe
+    import _grain_cache
+except ImportError:
+    from salt.grains import _cloud_probe
+    from salt.grains import _grain_cache
+
 
 def _metadata_request(path):
-    http = HTTPConnection('metadata')
+    http = HTTPConnection('metadata', timeout=1)
     http.request('GET',
                  path,
                  ' ',
                  {'X-Google-Metadata-Request': 'True'})
     rsp = http.getresponse().read()
-    return rsp
+    return rsp.decode('utf-8')
 
 
-def gce_ext_ip():
-    """
-    Fetch the public IP address for this instance from Google's metadata
-    servers.
-    """
+def _gce_ext_ip():
     try:
         rsp = _metadata_request(
             '/computeMetadata/v1/instance/network-interfaces/0/access-configs/0/external-ip'
@@ -39,6 +42,34 @@ def gce_ext_ip():
         return {}
 
 
+def _gce_tags():
+    try:
+        rsp = _metadata_request('/computeMetadata/v1/instance/tags')
+        tags = json.loads(rsp)
+        return {'tags': tags, 'roles': tags}
+    except gaierror:
+        return {}
+
+
+def _gce_zone():
+    try:
+        rsp = _metadata_request('computeMetadata/v1/instance/zone')
+        zone = re.search('/([^/]+)$', rsp).groups()[0]
+        return {'zone': zone}
+    except gaierror:
+        return {}
+
+
+def gce_ext_ip():
+    """
+    Fetch the public IP address for this instance from Google's metadata
+    servers.
+    """
+    if not _cloud_probe.on_cloud(__opts__, 'gce'):
+        return {}
+    return _grain_cache.cached(__opts__, 'gce_ext_ip', _gce_ext_ip, ttl=600)
+
+
 def gce_tags():
     """
     Fetch the instance's tags from Google's metadata servers.
@@ -46,21 +77,15 @@ def gce_tags():
     It fills in tags and roles in the dictionary to allow interoperation with
     formulas that key off of the roles grain.
     """
-    try:
-        rsp = _metadata_request('/computeMetadata/v1/instance/tags')
-        tags = json.loads(rsp)
-        return {'tags': tags, 'roles': tags}
-    except gaierror:
+    if not _cloud_probe.on_cloud(__opts__, 'gce'):
         return {}
+    return _grain_cache.cached(__opts__, 'gce_tags', _gce_tags, ttl=600)
 
 
 def gce_zone():
     """
     Fetch the instance's zone.
     """
-    try:
-        rsp = _metadata_request('computeMetadata/v1/instance/zone')
-        zone = re.search('/([^/]+)$', rsp).groups()[0]
-        return {'zone': zone}
-    except gaierror:
+    if not _cloud_probe.on_cloud(__opts__, 'gce'):
         return {}
+    return _grain_cache.cached(__opts__, 'gce_zone', _gce_zone, ttl=86400)
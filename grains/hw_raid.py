@@ -1,14 +1,22 @@
 # -*- coding: utf-8 -*-
 """
     Return grains information about available hardware RAID controllers.
+
+    Controllers are found in sysfs, without running lspci. modinfo is only
+    run once per driver, for the module details sysfs does not have, and the
+    result is cached until the next reboot (see _grain_cache.py).
 """
 from __future__ import absolute_import
 
-import subprocess
-import re
+import os
 import platform
 import logging
-from salt.ext.six.moves import zip
+import subprocess
+
+try:
+    import _grain_cache
+except ImportError:
+    from salt.grains import _grain_cache
 
 
 __author__ = "Ivan Adam Vari"
@@ -17,27 +25,83 @@ __license__ = "Apache License, Version 2.0"
 
 log = logging.getLogger(__name__)
 
+SYSFS_ROOT = '/sys'
+BOOT_ID = '/proc/sys/kernel/random/boot_id'
+MODINFO = 'modinfo'
+PCI_IDS = ('/usr/share/hwdata/pci.ids', '/usr/share/misc/pci.ids',
+           '/usr/share/pci.ids')
 
-def _kmod_name(slot_id):
+# PCI classes of RAID bus and Serial Attached SCSI controllers
+RAID_CLASSES = ('0104', '0107')
+STORAGE_CLASS = '01'
+
+
+def _read(path):
     """
-        Return kernel module name used by detected controller. Takes one parameter,
-        returns string.
+        Return the stripped content of a sysfs attribute, or None.
 
-        @slot_id:         (string) pci slot id as returned by lspci
+        @path:            (string) path of the attribute
     """
 
     try:
-        cmd = 'lspci -s {0} -k'.format(slot_id)
+        with open(path) as handle:
+            return handle.read().strip()
+
+    except (IOError, OSError):
+        return None
+
 
-        kmod = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE).communicate()[0]
+def _hex_id(value):
+    """
+        Turn a sysfs id (0x1000) into the lspci notation (1000).
+    """
 
-        regex = re.compile(r'Kernel\sdriver\sin\suse:\s+(.*)\n')
-        match = regex.search(kmod)
+    if value and value.startswith('0x'):
+        return value[2:]
+    return value
 
-        return match.group(1)
 
-    except OSError:
-        pass
+def _pci_names(wanted):
+    """
+        Return vendor, device and subsystem names from pci.ids. Takes one
+        parameter, returns dict. Only the wanted ids are kept.
+
+        @wanted:          (set) vendor ids, (vendor, device) and
+                          (vendor, device, subvendor, subdevice) tuples
+    """
+
+    names = {}
+    for path in PCI_IDS:
+        try:
+            handle = open(path)
+        except (IOError, OSError):
+            continue
+
+        with handle:
+            vendor = device = None
+            for line in handle:
+                if not line.strip() or line.startswith('#'):
+                    continue
+                if line.startswith('C '):
+                    # device classes come after all the vendors
+                    break
+                if not line.startswith('\t'):
+                    vendor, _, name = line.strip().partition('  ')
+                    device = None
+                    if vendor in wanted:
+                        names[vendor] = name
+                elif not line.startswith('\t\t'):
+                    device, _, name = line.strip().partition('  ')
+                    if (vendor, device) in wanted:
+                        names[(vendor, device)] = name
+                else:
+                    ids, _, name = line.strip().partition('  ')
+                    key = (vendor, device) + tuple(ids.split())
+                    if key in wanted:
+                        names[key] = name
+        break
+
+    return names
 
 
 def _kmod_info(module):
@@ -45,68 +109,121 @@ def _kmod_info(module):
         Return kernel module details used by detected controller. Takes one parameter,
         returns dict.
 
-        @module:           (string) kernel module name as lspci returns
+        @module:           (string) kernel module name as found in sysfs
     """
 
     kmod_info = {}
+    for field in ['version', 'srcversion']:
+        value = _read(os.path.join(SYSFS_ROOT, 'module', module, field))
+        if value:
+            kmod_info['driver_' + field] = value
 
+    # sysfs has no filename, description or author
     try:
-        cmd = 'modinfo {0}'.format(module)
+        modinfo = subprocess.Popen([MODINFO, module], stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, universal_newlines=True)
+        for line in modinfo.communicate()[0].splitlines():
+            field, _, value = line.partition(':')
+            if field in ('filename', 'description', 'author'):
+                kmod_info['driver_' + field] = value.strip()
+    except OSError:
+        pass
 
-        _ = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE)
+    if not kmod_info:
+        log.debug('Unable to fetch kernel module data')
 
-        for line in _.stdout.readlines():
-            for field in ['filename', 'version', 'description', 'author']:
-                if line.startswith(field):
-                    kmod_info.update({'driver_' + field: line.strip().split(' ', 1)[1].strip()})
+    return kmod_info
 
-        if kmod_info:
-            return kmod_info
 
-        else:
-            log.debug('Unable to fetch kernel module data')
+def _controllers():
+    """
+        Return the RAID controllers found in sysfs, takes no parameters,
+        returns list of dicts.
+    """
 
+    devices_dir = os.path.join(SYSFS_ROOT, 'bus', 'pci', 'devices')
+    try:
+        slots = sorted(os.listdir(devices_dir))
     except OSError:
-        pass
+        log.debug('No PCI devices in {0}'.format(devices_dir))
+        return []
+
+    found = []
+    for slot in slots:
+        path = os.path.join(devices_dir, slot)
+        pci_class = _hex_id(_read(os.path.join(path, 'class')))
+        if not pci_class or not pci_class.startswith(STORAGE_CLASS):
+            continue
+
+        ids = dict((attr, _hex_id(_read(os.path.join(path, attr))))
+                   for attr in ('vendor', 'device', 'revision',
+                                'subsystem_vendor', 'subsystem_device'))
+        driver = os.path.join(path, 'driver')
+        ids['driver'] = ids['module'] = None
+        if os.path.islink(driver):
+            ids['driver'] = ids['module'] = os.path.basename(os.path.realpath(driver))
+            module = os.path.join(driver, 'module')
+            if os.path.islink(module):
+                ids['module'] = os.path.basename(os.path.realpath(module))
+        # lspci shows slots without the default 0000 domain
+        ids['slot'] = slot[5:] if slot.startswith('0000:') else slot
+        ids['class'] = pci_class[:4]
+        found.append(ids)
+
+    # Storage controllers whose class is not RAID are kept when their name
+    # says so, as lspci -m | grep RAID would
+    wanted = set()
+    for ids in found:
+        vendor, device = ids['vendor'], ids['device']
+        wanted.update([vendor, (vendor, device),
+                       (vendor, device, ids['subsystem_vendor'], ids['subsystem_device'])])
+    names = _pci_names(wanted) if found else {}
+
+    kmods = {}
+    controllers = []
+    for ids in found:
+        vendor, device = ids['vendor'], ids['device']
+        device_name = names.get((vendor, device), device)
+        if ids['class'] not in RAID_CLASSES and 'RAID' not in device_name:
+            continue
+
+        pci_data = {
+            'slot': ids['slot'],
+            'class': 'Serial Attached SCSI controller' if ids['class'] == '0107' else 'RAID bus controller',
+            'vendor': names.get(vendor, vendor),
+            'device': device_name,
+            'rev': ids['revision'],
+            'subsystem_vendor': names.get(ids['subsystem_vendor'], ids['subsystem_vendor']),
+            'subsystem': names.get((vendor, device, ids['subsystem_vendor'], ids['subsystem_device']),
+                                   ids['subsystem_device']),
+            'driver': ids['driver'],
+        }
+        if ids['driver']:
+            if ids['module'] not in kmods:
+                kmods[ids['module']] = _kmod_info(ids['module'])
+            pci_data.update(kmods[ids['module']])
+        else:
+            log.debug('No RAID driver found for {0}'.format(ids['slot']))
+        controllers.append(pci_data)
+
+    return controllers
 
 
 def raid_info():
     """
         Return RAID info, takes no parameters, returns dict.
-    """
 
-    field_names = ['slot', 'class', 'vendor', 'device', 'rev', 'subsystem_vendor', 'subsystem', 'driver']
-    field_values = []
+        raidcontroller holds the last controller, raidcontrollers all of them.
+    """
 
-    if platform.system() == 'Linux':
-        try:
-            hwinfo = subprocess.Popen('lspci -m'.split(), stdout=subprocess.PIPE)
-
-            for line in hwinfo.stdout.readlines():
-                if re.search('RAID|Serial Attached SCSI', line):
-                    # sanitize the output and load it into a list
-                    raw_fields = line.strip().split('"')
-                    fields = [field for field in raw_fields if not (field == ' ' or field == '')]
-                    field_values = [string.strip().rstrip() for string in fields]
-                    # append kmod name to data based on fetched slot id
-                    field_values.append(_kmod_name(field_values[0]))
-
-            pci_data = dict(zip(field_names, field_values))
-
-            # for detected cards append kernel module info
-            if pci_data:
-                try:
-                    pci_data.update(_kmod_info(pci_data['driver']))
-                    return {'raidcontroller': pci_data}
-
-                except KeyError:
-                    log.debug('No RAID driver found')
-                    return {'raidcontroller': pci_data}
-            else:
-                log.debug('No RAID controllers detected')
-
-        except OSError:
-            pass
-
-    else:
+    if platform.system() != 'Linux':
         log.debug('Not supported OS "{0}"'.format(platform.system()))
+        return
+
+    controllers = _grain_cache.cached(__opts__, 'hw_raid', _controllers,
+                                      ttl=86400 * 365, key=_read(BOOT_ID))
+    if not controllers:
+        log.debug('No RAID controllers detected')
+        return
+
+    return {'raidcontroller': controllers[-1], 'raidcontrollers': controllers}
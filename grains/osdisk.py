@@ -1,15 +1,186 @@
 # -*- coding:utf-8 -*-
+'''
+Disk usage of the mounted filesystems, in gigabytes.
+
+On Linux, pseudo and container filesystems are skipped, a filesystem mounted
+several times (bind mounts) is only reported once, and a mount point whose
+statvfs call hangs (eg. an unreachable NFS server) is skipped after a
+timeout, then left out of the next runs until that call returns. The result
+is cached (see _grain_cache.py) until the mount table changes or the TTL
+expires. This can be tuned in the minion config:
+
+.. code-block:: yaml
+
+    osdisk:
+      exclude_fstypes: [proc, sysfs, tmpfs, overlay]
+      timeout: 2
+      workers: 8
+      ttl: 300
+'''
 from __future__ import absolute_import
 
+import hashlib
+import logging
 import os
 import platform
+import re
+import threading
+import time
 import salt.utils
+from salt.ext import six
+from salt.ext.six.moves import queue
 
 try:
     import wmi
 except ImportError:
     pass
 
+try:
+    import _grain_cache
+except ImportError:
+    from salt.grains import _grain_cache
+
+log = logging.getLogger(__name__)
+
+MOUNTINFO = '/proc/self/mountinfo'
+
+EXCLUDE_FSTYPES = (
+    'autofs', 'binfmt_misc', 'bpf', 'cgroup', 'cgroup2', 'configfs',
+    'debugfs', 'devpts', 'devtmpfs', 'efivarfs', 'fusectl', 'hugetlbfs',
+    'mqueue', 'nsfs', 'overlay', 'proc', 'pstore', 'ramfs', 'rpc_pipefs',
+    'securityfs', 'selinuxfs', 'squashfs', 'sysfs', 'tmpfs', 'tracefs',
+)
+DEFAULT_TIMEOUT = 2
+DEFAULT_WORKERS = 8
+DEFAULT_TTL = 300
+
+# Mount points whose statvfs call timed out and has not returned yet, with
+# the time it started. Their worker thread is still stuck in the kernel, they
+# are not stat'ed again until it comes back.
+_STUCK = {}
+_STUCK_LOCK = threading.Lock()
+
+
+def _config():
+    return (__opts__ if '__opts__' in globals() else {}).get('osdisk') or {}
+
+
+def _unescape(path):
+    '''
+    Mount points are octal-escaped in /proc (eg. a space is \\040)
+    '''
+    return re.sub(r'\\([0-7]{3})', lambda match: six.unichr(int(match.group(1), 8)), path)
+
+
+def _mounts(content, exclude_fstypes):
+    '''
+    Return the mount points of /proc/self/mountinfo worth a statvfs call,
+    one per device id. The mount of the root of a filesystem is preferred
+    over bind mounts of its subdirectories.
+    '''
+    devices = {}
+    order = []
+    for line in content.splitlines():
+        fields = line.split()
+        try:
+            sep = fields.index('-')
+            dev_id, root, mount_point, fstype = fields[2], fields[3], fields[4], fields[sep + 1]
+        except (ValueError, IndexError):
+            continue
+        if fstype in exclude_fstypes:
+            continue
+        if dev_id not in devices:
+            order.append(dev_id)
+        elif devices[dev_id][0] == '/' or root != '/':
+            continue
+        devices[dev_id] = (root, _unescape(mount_point))
+    return [devices[dev_id][1] for dev_id in order]
+
+
+def _statvfs_all(mount_points, workers, timeout):
+    '''
+    Call statvfs on the mount points from a few worker threads. A mount point
+    whose call lasts more than timeout seconds is given up on, and its stuck
+    worker replaced so that the other mount points still get served. Mount
+    points with a worker still stuck from a previous call are skipped.
+    '''
+    with _STUCK_LOCK:
+        stuck = dict((x, _STUCK[x]) for x in mount_points if x in _STUCK)
+    for mount_point, since in six.iteritems(stuck):
+        log.debug('Skipping %s, statvfs on it has been hanging for %.0fs',
+                  mount_point, time.time() - since)
+    mount_points = [x for x in mount_points if x not in stuck]
+
+    pending = queue.Queue()
+    for mount_point in mount_points:
+        pending.put(mount_point)
+    done = queue.Queue()
+    running = {}
+
+    def worker():
+        while True:
+            try:
+                mount_point = pending.get_nowait()
+            except queue.Empty:
+                return
+            with _STUCK_LOCK:
+                running[mount_point] = time.time()
+            try:
+                stat = os.statvfs(mount_point)
+            except OSError as exc:
+                log.debug('Could not stat %s: %s', mount_point, exc)
+                stat = None
+            with _STUCK_LOCK:
+                del running[mount_point]
+                _STUCK.pop(mount_point, None)
+            done.put((mount_point, stat))
+
+    def spawn():
+        thread = threading.Thread(target=worker, name='osdisk-statvfs')
+        thread.daemon = True
+        thread.start()
+
+    for _ in range(min(workers, len(mount_points))):
+        spawn()
+
+    stats = {}
+    remaining = set(mount_points)
+    while remaining:
+        try:
+            mount_point, stat = done.get(timeout=min(timeout, 0.1))
+            remaining.discard(mount_point)
+            stats[mount_point] = stat
+            continue
+        except queue.Empty:
+            pass
+        now = time.time()
+        with _STUCK_LOCK:
+            for mount_point in list(remaining):
+                if mount_point in running and now - running[mount_point] > timeout:
+                    log.warning('statvfs on %s timed out after %ss, skipping it',
+                                mount_point, timeout)
+                    _STUCK[mount_point] = running[mount_point]
+                    remaining.discard(mount_point)
+                    spawn()
+    return stats
+
+
+def _linux_osdisk(content):
+    conf = _config()
+    exclude_fstypes = set(conf.get('exclude_fstypes', EXCLUDE_FSTYPES))
+    mount_points = _mounts(content, exclude_fstypes)
+    stats = _statvfs_all(mount_points,
+                         int(conf.get('workers', DEFAULT_WORKERS)),
+                         float(conf.get('timeout', DEFAULT_TIMEOUT)))
+    osdisk = {}
+    for caption in mount_points:
+        disk = stats.get(caption)
+        if disk and disk.f_blocks:
+            available = disk.f_bsize * disk.f_bavail
+            used = disk.f_bsize * (disk.f_blocks - disk.f_bavail)
+            osdisk[caption] = {'available': int(round(available/1.073741824e9)), 'used': int(round(used/1.073741824e9))}
+    return osdisk
+
 
 def get_osdisk_stats():
     '''
@@ -29,14 +200,13 @@ def get_osdisk_stats():
                 caption = disk.Caption
                 grains['osdisk'][caption] = {'available': round(available/1.073741824e9), 'used': round(used/1.073741824e9)}
     elif platform.system() == 'Linux':
-        with salt.utils.fopen('/proc/mounts', 'r') as f:
-            mounts = [line.split()[1] for line in f.readlines()]
-        for caption in mounts:
-            disk = os.statvfs(caption)
-            if disk.f_blocks:
-                available = disk.f_bsize * disk.f_bavail
-                used = disk.f_bsize * (disk.f_blocks - disk.f_bavail)
-                grains['osdisk'][caption] = {'available': int(round(available/1.073741824e9)), 'used': int(round(used/1.073741824e9))}
+        with salt.utils.fopen(MOUNTINFO, 'rb') as f:
+            raw = f.read()
+        content = raw.decode('utf-8', 'replace')
+        key = hashlib.sha1(raw).hexdigest()
+        grains['osdisk'] = _grain_cache.cached(
+            __opts__, 'osdisk', lambda: _linux_osdisk(content),
+            ttl=_config().get('ttl', DEFAULT_TTL), key=key) or {}
     return grains
 
     #  print information in bytes
@@ -20,34 +20,51 @@ from __future__ import absolute_import
 import logging
 import requests
 
+try:
+    import _cloud_probe
+    import _grain_cache
+except ImportError:
+    from salt.grains import _cloud_probe
+    from salt.grains import _grain_cache
+
 LOG = logging.getLogger(__name__)
 
 MD_BASE_URI = "http://169.254.169.254/current/meta-data/"
 __virtualname__ = "vultr"
 
 
-def __virtual__():
-    '''
-    We should only load if this is actually a vultr instance
-    '''
+def _is_vultr():
     try:
-        ret = requests.get(MD_BASE_URI + 'mac')
-        if ret.content.find(":") <= 0:
-            return False
-        return __virtualname__
+        ret = requests.get(MD_BASE_URI + 'mac', timeout=1)
+        return ret.text.find(":") > 0
     except Exception as e:
         return False
 
 
-def vultr():
+def __virtual__():
     '''
-    Return Vultr metadata.
+    We should only load if this is actually a vultr instance
     '''
+    if not _cloud_probe.on_cloud(__opts__, 'vultr'):
+        return False
+    if not _grain_cache.cached(__opts__, 'vultr_virtual', _is_vultr, ttl=86400):
+        return False
+    return __virtualname__
+
+
+def _vultr():
     vultr = {}
     with requests.Session() as sess:
         for i in ['mac', 'instance-id', 'local-ipv4', 'public-ipv4', 'SUBID',
                   'ipv6-addr', 'ipv6-prefix']:
             LOG.debug('Making request to: %s%s', MD_BASE_URI, i)
-            vultr[i] = sess.get(MD_BASE_URI + i).content
+            vultr[i] = sess.get(MD_BASE_URI + i, timeout=1).text
 
     return {'vultr': vultr}
+
+
+def vultr():
+    '''
+    Return Vultr metadata.
+    '''
+    return _grain_cache.cached(__opts__, 'vultr', _vultr, ttl=3600)
@@ -23,7 +23,17 @@ Removing links:
 
   salt_contrib/link_contrib.py /srv/salt --uninstall
 
+Updating links after pulling salt-contrib (only new, removed or moved
+modules are touched):
+
+  salt_contrib/link_contrib.py /srv/salt --refresh
+
+The links created are recorded in a manifest in the target
+(``.salt-contrib-links.json``), so that uninstall and refresh do not
+have to walk the whole target tree.
+
 '''
+import json
 import os
 import logging
 import sys
@@ -37,6 +47,8 @@ base_folders = ('grains', 'modules', 'renderers', 'runners', 'states')
 
 unsafe_modules = ('ansible', 'drizzle')
 
+manifest_name = '.salt-contrib-links.json'
+
 
 def get_files(target, exclude, folders=base_folders):
     '''
@@ -94,10 +106,37 @@ def link(source, dest):
     return False
 
 
-def install(target, opts):
+def read_manifest(target):
     '''
-    Link files in current directory to another environment
-    for testing / deployment.
+    Returns the links recorded in the target, as a dict of paths relative to
+    the target to the sources they point to, or None without a manifest
+    '''
+    try:
+        with open(os.path.join(target, manifest_name)) as f:
+            return json.load(f)['links']
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def write_manifest(target, links):
+    '''
+    Atomically replaces the manifest, removes it when there are no links left
+    '''
+    path = os.path.join(target, manifest_name)
+    if not links:
+        if os.path.exists(path):
+            os.unlink(path)
+        return
+    tmp = '{0}.{1}'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump({'source': current_dir, 'links': links}, f, indent=1, sort_keys=True)
+    os.rename(tmp, path)
+
+
+def plan(target, opts):
+    '''
+    Returns the links an install should create, as a dict of paths relative
+    to the target to their sources
     '''
     # figure out what type of install to do
     if os.path.exists(os.path.join(target, 'top.sls')):
@@ -112,48 +151,113 @@ def install(target, opts):
     exclude = unsafe_modules + tuple(opts.exclude)
     logger.info("Excluding {0}".format(', '.join(exclude)))
 
+    links = {}
     # python modules
-    count = 0
     for source in get_files(target, exclude):
         if active:
-            dest = os.path.join(target, '_{0}'.format(source))
+            dest = '_{0}'.format(source)
         else:
-            dest = os.path.join(target, 'salt', source)
+            dest = os.path.join('salt', source)
+        links[dest] = os.path.join(current_dir, source)
+
+    if active is False:
+        # add the tests as well
+        for source in get_files(target, exclude, ('tests',)):
+            links[source] = os.path.join(current_dir, source)
+
+    return links
+
+
+def unlink(dest, source=None):
+    '''
+    Removes a link and its bytecode. When source is given, the link is only
+    removed if it still points to it.
+    '''
+    logger.debug("Unlinking {0}".format(dest))
+    if not os.path.islink(dest):
+        logger.warning("Not a link anymore, leaving it: {0}".format(dest))
+        return False
+    if source is not None and os.readlink(dest) != source:
+        logger.warning("Link changed since install, leaving it: {0}".format(dest))
+        return False
+    os.unlink(dest)
+
+    # get rid of bytecode
+    if os.path.exists(dest + "c"):
+        os.unlink(dest + "c")
+    return True
 
-        if link(os.path.join(current_dir, source), dest):
+
+def install(target, opts):
+    '''
+    Link files in current directory to another environment
+    for testing / deployment.
+    '''
+    links = read_manifest(target) or {}
+
+    count = 0
+    for dest, source in plan(target, opts).items():
+        if link(source, os.path.join(target, dest)):
             count += 1
+        links[dest] = source
 
+    write_manifest(target, links)
     sys.stderr.write("Linked {0} items\n".format(count))
 
-    if active is False:
-        # add the tests as well
-        count = 0
-        for source in get_files(target, exclude, ('tests',)):
-            dest = os.path.join(target, source)
 
-            if link(os.path.join(current_dir, source), dest):
-                count += 1
+def refresh(target, opts):
+    '''
+    Applies the difference between the links recorded in the manifest and the
+    modules currently in salt-contrib: new modules are linked, links to
+    removed or excluded modules are removed and moved modules relinked.
+    Links that did not change are not touched.
+    '''
+    links = read_manifest(target)
+    if links is None:
+        logger.info("No manifest in {0}, doing a full refresh".format(target))
+        uninstall(target, opts)
+        install(target, opts)
+        return
+
+    wanted = plan(target, opts)
+    removed = linked = 0
+    for dest in sorted(set(links) - set(wanted)):
+        if unlink(os.path.join(target, dest), links[dest]):
+            removed += 1
+        del links[dest]
+    for dest, source in sorted(wanted.items()):
+        if links.get(dest) == source:
+            continue
+        if link(source, os.path.join(target, dest)):
+            linked += 1
+        links[dest] = source
 
-        sys.stderr.write("Linked {0} test items\n".format(count))
+    write_manifest(target, links)
+    sys.stderr.write("Linked {0} items, unlinked {1} items\n".format(linked, removed))
 
 
 def uninstall(target, opts):
     '''
-    Finds files in target path linked to the current directory and removes them.
+    Removes the links recorded in the manifest of the target path. Without a
+    manifest (an install by an older version), finds files in target path
+    linked to the current directory and removes them.
     '''
     count = 0
 
+    links = read_manifest(target)
+    if links is not None:
+        for dest, source in sorted(links.items()):
+            if unlink(os.path.join(target, dest), source):
+                count += 1
+        write_manifest(target, {})
+        sys.stderr.write("Unlinked {0} items\n".format(count))
+        return
+
     for dirname, dirnames, filenames in os.walk(target):
         for filename in ["{0}/{1}".format(dirname, f) for f in filenames]:
             real = os.path.realpath(filename)
             if real.startswith(current_dir):
-                logger.debug("Unlinking {0}".format(filename))
-                os.unlink(filename)
-
-                # get rid of bytecode
-                if os.path.exists(filename + "c"):
-                    os.unlink(filename + "c")
-
+                unlink(filename)
                 count += 1
 
     sys.stderr.write("Unlinked {0} items\n".format(count))
@@ -165,20 +269,19 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('path', help='Path to target, either a salt repo or an sls base')
     parser.add_argument('-u', '--uninstall', action='store_true', help='Remove symlinks from the environment')
-    parser.add_argument('-r', '--refresh', action='store_true', help='Remove and re-apply links')
+    parser.add_argument('-r', '--refresh', action='store_true', help='Apply the changes since the last install')
     parser.add_argument('-x', '--exclude', nargs='*', default=[], help='Exclude specific python modules')
 
     options = parser.parse_args()
 
     path = os.path.realpath(options.path)
 
-    if options.refresh or options.uninstall:
-        uninstall(path, options)
-
     if options.uninstall:
-        return
-
-    install(path, options)
+        uninstall(path, options)
+    elif options.refresh:
+        refresh(path, options)
+    else:
+        install(path, options)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+'''
+Bounded thread pool shared by the execution modules which issue many
+independent, slow calls at once (remote API requests, volume creation...).
+
+The module name starts with an underscore so that the loader does not load
+it as an execution module, execution modules import it instead:
+
+.. code-block:: python
+
+    try:
+        import _pool
+    except ImportError:
+        from salt.modules import _pool
+
+    for job, error in _pool.run(_create, jobs, workers):
+        ...
+'''
+
+# Import python libs
+from __future__ import absolute_import
+from multiprocessing.pool import ThreadPool
+
+
+def run(func, jobs, workers):
+    '''
+    Call ``func`` on every job using at most ``workers`` threads. Returns a
+    list of ``(job, error)`` tuples in the order of the jobs, error being None
+    for successful calls and the exception message otherwise.
+    '''
+    if not jobs:
+        return []
+
+    def _call(job):
+        try:
+            func(job)
+        except Exception as exc:  # pylint: disable=broad-except
+            return job, str(exc)
+        return job, None
+
+    pool = ThreadPool(max(1, min(int(workers), len(jobs))))
+    try:
+        return pool.map(_call, jobs)
+    finally:
+        pool.close()
+        pool.join()
@@ -100,9 +100,12 @@ _______
     - :py:func:`login<salt.modules.dockerio.login>`
     - :py:func:`push<salt.modules.dockerio.push>`
     - :py:func:`pull<salt.modules.dockerio.pull>`
+    - :py:func:`push_many<salt.modules.dockerio.push_many>`
+    - :py:func:`pull_many<salt.modules.dockerio.pull_many>`
 - Docker Management
     - :py:func:`version<salt.modules.dockerio.version>`
     - :py:func:`info<salt.modules.dockerio.info>`
+    - :py:func:`benchmark<salt.modules.dockerio.benchmark>`
 - Image Management
     - :py:func:`search<salt.modules.dockerio.search>`
     - :py:func:`inspect_image<salt.modules.dockerio.inspect_image>`
@@ -158,14 +161,19 @@ from __future__ import absolute_import
 __docformat__ = 'restructuredtext en'
 
 # Import Python libs
+import collections
 import datetime
+import functools
 import json
 import logging
 import os
 import re
+import threading
+import time
 import traceback
 import shutil
 import types
+from multiprocessing.pool import ThreadPool
 
 # Import Salt libs
 from salt.modules import cmdmod
@@ -1571,44 +1579,182 @@ def inspect_image(image):
     return status
 
 
+# Layer statuses meaning the layer is on the host
+_LAYER_DONE_STATES = ('Download complete', 'Already exists', 'Pull complete')
+# Messages without a layer id kept from a log (the last ones, errors come last)
+_LOG_MAX_MESSAGES = 100
+_LOG_WHITESPACE = re.compile(r'\s*')
+# Characters of an incomplete object kept while waiting for the next chunks
+_LOG_MAX_PENDING = 1024 * 1024
+
+
+def _iter_log_objects(chunks):
+    '''
+    Yield the JSON objects of a docker progress log as soon as they are
+    complete. chunks is the whole log as a string, or an iterable of the
+    string or bytes chunks streamed by docker-py (``stream=True``), which do
+    not have to end on object boundaries. Text outside of the objects, and
+    malformed objects, are skipped.
+    '''
+    if isinstance(chunks, (six.string_types, bytes)):
+        chunks = [chunks]
+    decoder = json.JSONDecoder()
+    buf = ''
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = chunk.decode('utf-8', 'replace')
+        buf += chunk
+        pos = 0
+        while True:
+            pos = _LOG_WHITESPACE.match(buf, pos).end()
+            if pos == len(buf):
+                break
+            if buf[pos] != '{':
+                start = buf.find('{', pos)
+                if start == -1:
+                    pos = len(buf)
+                    break
+                pos = start
+            try:
+                obj, pos = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # Docker ends every object with a newline, which JSON strings
+                # cannot hold: an object followed by one is malformed (or a
+                # stray brace in some text), an object without one is
+                # incomplete and waits for the next chunk.
+                if buf.find('\n', pos) == -1 and len(buf) - pos <= _LOG_MAX_PENDING:
+                    break
+                log.debug('Skipping malformed docker log: {0!r}'.format(buf[pos:pos + 200]))
+                pos += 1
+                continue
+            yield obj
+        # only the incomplete object is kept, so the buffer stays small
+        buf = buf[pos:]
+    if buf.strip():
+        log.debug('Ignoring incomplete docker log: {0!r}'.format(buf[:200]))
+
+
+class _ImageLogs(object):
+    '''
+    Keeps what matters from a docker pull/push/import progress log: the last
+    message of every layer, and the last messages without a layer id (eg.
+    errors, digest, status of the repository). Its memory use does not grow
+    with the number of progress updates.
+    '''
+    def __init__(self, listener=None):
+        self._count = 0
+        self._layers = {}
+        self._messages = collections.deque(maxlen=_LOG_MAX_MESSAGES)
+        # last layer seen reaching one of _LAYER_DONE_STATES
+        self.last_done = None
+        # called with every layer progress message
+        self.listener = listener
+
+    def add(self, message):
+        self._count += 1
+        if isinstance(message, dict) and message.get('id'):
+            self._layers[message['id']] = (self._count, message)
+            if message.get('status') in _LAYER_DONE_STATES:
+                self.last_done = message['id']
+            if self.listener is not None and 'progressDetail' in message:
+                self.listener(message)
+        else:
+            self._messages.append((self._count, message))
+
+    def feed(self, chunks):
+        for message in _iter_log_objects(chunks):
+            self.add(message)
+        return self
+
+    def logs(self):
+        '''
+        The kept messages, most recent first
+        '''
+        kept = list(self._layers.values()) + list(self._messages)
+        kept.sort(key=lambda item: item[0], reverse=True)
+        return [message for _, message in kept]
+
+    def text(self):
+        '''
+        The kept messages as a log string, oldest first
+        '''
+        return '\n'.join(json.dumps(message) for message in reversed(self.logs()))
+
+
 def _parse_image_multilogs_string(ret):
     '''
     Parse image log strings into grokable data
+
+    ret is the log as a string, or the chunks streamed by docker-py. Returns
+    the last message of every layer and the last other messages, most recent
+    first, and the infos of the image of the last layer that made it to the
+    host.
+    '''
+    image_logs = _ImageLogs().feed(ret)
+    infos = None
+    if image_logs.last_done:
+        infos = _get_image_infos(image_logs.last_done)
+    return image_logs.logs(), infos
+
+
+def _synthetic_pull_log(layers, updates):
+    '''
+    Build the progress log of a pull of the given number of layers, each
+    one reporting the given number of download and extraction updates
+    '''
+    messages = [{'status': 'Pulling from library/bench', 'id': 'latest'}]
+    ids = ['{0:012x}'.format(0xbe9c4000 + num) for num in range(layers)]
+    messages.extend({'status': 'Pulling fs layer', 'progressDetail': {}, 'id': id_}
+                    for id_ in ids)
+    total = 32 * 1024 * 1024
+    for phase in ('Downloading', 'Extracting'):
+        for step in range(1, updates + 1):
+            for id_ in ids:
+                current = total * step // updates
+                messages.append({'status': phase,
+                                 'progressDetail': {'current': current, 'total': total},
+                                 'progress': '[{0}>{1}] {2}/{3}'.format(
+                                     '=' * (50 * step // updates),
+                                     ' ' * (50 - 50 * step // updates),
+                                     _sizeof_fmt(current), _sizeof_fmt(total)),
+                                 'id': id_})
+        done = 'Download complete' if phase == 'Downloading' else 'Pull complete'
+        messages.extend({'status': done, 'progressDetail': {}, 'id': id_} for id_ in ids)
+    messages.append({'status': 'Digest: sha256:' + '0' * 64})
+    messages.append({'status': 'Status: Downloaded newer image for library/bench:latest'})
+    return ''.join(json.dumps(message) + '\r\n' for message in messages)
+
+
+def benchmark(layers=50, updates=100, chunk_size=4096, iterations=3):
+    '''
+    Measure the progress log parser on a synthetic pull log of the given
+    number of layers, each one reporting the given number of download and
+    extraction updates, streamed in chunks of chunk_size bytes.
+
+    Returns the size of the log in bytes, the number of messages it holds and
+    kept by the parser, and the best time taken to parse it in seconds.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' docker.benchmark 50
     '''
-    image_logs, infos = [], None
-    if ret and ret.strip().startswith('{') and ret.strip().endswith('}'):
-        pushd = 0
-        buf = ''
-        for char in ret:
-            buf += char
-            if char == '{':
-                pushd += 1
-            if char == '}':
-                pushd -= 1
-            if pushd == 0:
-                try:
-                    buf = json.loads(buf)
-                except Exception:
-                    pass
-                else:
-                    image_logs.append(buf)
-                buf = ''
-        image_logs.reverse()
-
-        # Valid statest when pulling an image from the docker registry
-        valid_states = [
-            'Download complete',
-            'Already exists',
-        ]
-
-        # search last layer grabbed
-        for ilog in image_logs:
-            if isinstance(ilog, dict):
-                if ilog.get('status') in valid_states and ilog.get('id'):
-                    infos = _get_image_infos(ilog['id'])
-                    break
+    chunk_size = int(chunk_size)
+    log_ = _synthetic_pull_log(int(layers), int(updates))
+    chunks = [log_[pos:pos + chunk_size] for pos in range(0, len(log_), chunk_size)]
 
-    return image_logs, infos
+    timings = []
+    for _ in range(int(iterations)):
+        start = time.time()
+        image_logs = _ImageLogs().feed(iter(chunks))
+        kept = image_logs.logs()
+        timings.append(time.time() - start)
+    return {'bytes': len(log_),
+            'messages': log_.count('\r\n'),
+            'kept': len(kept),
+            'seconds': min(timings),
+            'mb_per_sec': len(log_) / min(timings) / 1024 / 1024}
 
 
 def _pull_assemble_error_status(status, ret, logs):
@@ -1670,7 +1816,14 @@ def pull(repo, tag=None, insecure_registry=False):
 
         salt '*' docker.pull <repository> [tag]
     '''
-    client = _get_client()
+    return _pull(_get_client(), repo, tag, insecure_registry, _ImageLogs())
+
+
+def _pull(client, repo, tag, insecure_registry, logs):
+    '''
+    Pull an image with the given client, feeding its progress log to the
+    given _ImageLogs
+    '''
     status = base_status.copy()
     try:
         kwargs = {'tag': tag}
@@ -1680,21 +1833,24 @@ def pull(repo, tag=None, insecure_registry=False):
                                        oper='>=',
                                        ver2='0.5.0'):
             kwargs['insecure_registry'] = insecure_registry
-        ret = client.pull(repo, **kwargs)
-        if ret:
-            image_logs, infos = _parse_image_multilogs_string(ret)
+        # The progress log is parsed while it is streamed, only the last
+        # message of every layer is kept
+        logs.feed(client.pull(repo, stream=True, **kwargs))
+        image_logs = logs.logs()
+        if image_logs:
+            infos = logs.last_done and _get_image_infos(logs.last_done)
             if infos and infos.get('Id', None):
                 repotag = repo
                 if tag:
                     repotag = '{0}:{1}'.format(repo, tag)
                 _valid(status,
-                       out=image_logs if image_logs else ret,
+                       out=image_logs,
                        id_=infos['Id'],
                        comment='Image {0} was pulled ({1})'.format(
                            repotag, infos['Id']))
 
             else:
-                _pull_assemble_error_status(status, ret, image_logs)
+                _pull_assemble_error_status(status, logs.text(), image_logs)
         else:
             _invalid(status)
     except Exception:
@@ -1768,7 +1924,14 @@ def push(repo, tag=None, quiet=False, insecure_registry=False):
 
         salt '*' docker.push <repository> [tag] [quiet=True|False]
     '''
-    client = _get_client()
+    return _push(_get_client(), repo, tag, quiet, insecure_registry, _ImageLogs())
+
+
+def _push(client, repo, tag, quiet, insecure_registry, logs):
+    '''
+    Push an image with the given client, feeding its progress log to the
+    given _ImageLogs
+    '''
     status = base_status.copy()
     registry, repo_name = docker.auth.resolve_repository_name(repo)
     try:
@@ -1779,9 +1942,10 @@ def push(repo, tag=None, quiet=False, insecure_registry=False):
                                        oper='>=',
                                        ver2='0.5.0'):
             kwargs['insecure_registry'] = insecure_registry
-        ret = client.push(repo, **kwargs)
+        logs.feed(client.push(repo, stream=True, **kwargs))
+        ret = logs.text()
         if ret:
-            image_logs, infos = _parse_image_multilogs_string(ret)
+            image_logs = logs.logs()
             if image_logs:
                 repotag = repo_name
                 if tag:
@@ -1790,11 +1954,15 @@ def push(repo, tag=None, quiet=False, insecure_registry=False):
                     status['out'] = image_logs
                 else:
                     status['out'] = None
-                laststatus = image_logs[2].get('status', None)
-                if laststatus and (
+                statuses = [ilog.get('status') or '' for ilog in image_logs
+                            if isinstance(ilog, dict)]
+                errors = [ilog for ilog in image_logs
+                          if isinstance(ilog, dict) and 'errorDetail' in ilog]
+                if not errors and any(
                     ('already pushed' in laststatus)
                     or ('Pushing tags for rev' in laststatus)
                     or ('Pushing tag for rev' in laststatus)
+                    for laststatus in statuses
                 ):
                     status['status'] = True
                     status['id'] = _get_image_infos(repo)['Id']
@@ -1812,6 +1980,185 @@ def push(repo, tag=None, quiet=False, insecure_registry=False):
     return status
 
 
+class _LayersProgress(object):
+    '''
+    Progress of the layers of several images pulled or pushed at the same
+    time. A layer shared by several images is counted once.
+    '''
+    def __init__(self, log_interval=5):
+        self._lock = threading.Lock()
+        self._layers = {}
+        self._log_interval = log_interval
+        self._logged = time.time()
+
+    def update(self, image, message):
+        detail = message.get('progressDetail') or {}
+        with self._lock:
+            layer = self._layers.setdefault(message['id'], {
+                'status': None, 'current': 0, 'total': 0, 'images': set()})
+            layer['images'].add(image)
+            layer['status'] = message.get('status')
+            # Only the transfer is measured, not the extraction
+            if layer['status'] in ('Downloading', 'Pushing') and detail.get('total'):
+                layer['current'] = detail.get('current', 0)
+                layer['total'] = detail['total']
+            elif layer['status'] in _LAYER_DONE_STATES + ('Pushed',):
+                layer['current'] = layer['total']
+            if time.time() - self._logged > self._log_interval:
+                self._logged = time.time()
+                summary = self._summary()
+                log.info('{0} of {1} transferred, {2} layers'.format(
+                    _sizeof_fmt(summary['current']), _sizeof_fmt(summary['total']),
+                    len(self._layers)))
+
+    def _summary(self):
+        return {'current': sum(x['current'] for x in self._layers.values()),
+                'total': sum(x['total'] for x in self._layers.values()),
+                'shared_layers': len([x for x in self._layers.values()
+                                      if len(x['images']) > 1])}
+
+    def summary(self):
+        '''
+        Bytes transferred and to transfer, and the state of every layer
+        '''
+        with self._lock:
+            ret = self._summary()
+            ret['layers'] = dict(
+                (id_, dict(layer, images=sorted(layer['images'])))
+                for id_, layer in six.iteritems(self._layers))
+        return ret
+
+
+def _split_images(images):
+    '''
+    Turn a list of "repo[:tag]" strings or {repo: tag} dicts, or a
+    comma-separated string of "repo[:tag]", into a list of (repo, tag)
+    '''
+    if isinstance(images, six.string_types):
+        images = images.split(',')
+    ret = []
+    for image in images:
+        if isinstance(image, dict):
+            ret.extend(six.iteritems(image))
+            continue
+        repo, sep, tag = image.strip().rpartition(':')
+        # a colon followed by a path is a registry port, not a tag
+        if not sep or '/' in tag:
+            repo, tag = image.strip(), None
+        ret.append((repo, tag))
+    return ret
+
+
+def _many(images, workers, func):
+    '''
+    Run func(client, repo, tag, logs) for every image, from at most workers
+    threads each with its own client. Returns the status of every image and
+    the aggregated progress of their layers.
+    '''
+    images = _split_images(images)
+    progress = _LayersProgress()
+    local = threading.local()
+
+    def job(image):
+        repo, tag = image
+        name = '{0}:{1}'.format(repo, tag) if tag else repo
+        try:
+            if not hasattr(local, 'client'):
+                local.client = _get_client()
+            logs = _ImageLogs(listener=functools.partial(progress.update, name))
+            return name, func(local.client, repo, tag, logs)
+        except Exception:
+            return name, _invalid(base_status.copy(), id_=repo, out=traceback.format_exc())
+
+    results = {}
+    if images:
+        pool = ThreadPool(max(1, min(int(workers), len(images))))
+        try:
+            for name, image_status in pool.imap_unordered(job, images):
+                results[name] = image_status
+        finally:
+            pool.close()
+            pool.join()
+    return results, progress.summary()
+
+
+def _many_status(action, results, progress):
+    status = base_status.copy()
+    failed = sorted(name for name, image_status in six.iteritems(results)
+                    if not image_status['status'])
+    out = {'images': results, 'progress': progress}
+    if failed:
+        return _invalid(status, out=out,
+                        comment='Could not {0}: {1}'.format(action, ', '.join(failed)))
+    return _valid(status, out=out,
+                  comment='{0} images {1}ed'.format(len(results), action))
+
+
+def pull_many(images, workers=4, insecure_registry=False):
+    '''
+    Pulls several images at the same time, from at most ``workers`` parallel
+    pulls. See documentation at top of this page to configure authenticated
+    access
+
+    images
+        list of ``repository[:tag]`` or ``{repository: tag}``, or
+        comma-separated string of ``repository[:tag]``
+
+    workers
+        maximum number of images pulled at the same time
+
+    insecure_registry
+        set as ``True`` to use insecure (non HTTPS) registries. Default is
+        ``False``
+
+    The status of every image is in ``out:images``, and the progress of all
+    the layers in ``out:progress``: bytes downloaded and to download, layers
+    shared by several images being counted once.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' docker.pull_many ubuntu:14.04,redis,corp/app:1.2 workers=8
+    '''
+    def func(client, repo, tag, logs):
+        return _pull(client, repo, tag, insecure_registry, logs)
+    results, progress = _many(images, workers, func)
+    return _many_status('pull', results, progress)
+
+
+def push_many(images, workers=4, quiet=False, insecure_registry=False):
+    '''
+    Pushes several images at the same time, from at most ``workers``
+    parallel pushes. See documentation at top of this page to configure
+    authenticated access
+
+    images
+        list of ``repository[:tag]`` or ``{repository: tag}``, or
+        comma-separated string of ``repository[:tag]``
+
+    workers
+        maximum number of images pushed at the same time
+
+    quiet
+        set as ``True`` to quiet the output of every push
+
+    insecure_registry
+        set as ``True`` to use insecure (non HTTPS) registries. Default is
+        ``False``
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' docker.push_many corp/app:1.2,corp/worker:1.2
+    '''
+    def func(client, repo, tag, logs):
+        return _push(client, repo, tag, quiet, insecure_registry, logs)
+    results, progress = _many(images, workers, func)
+    return _many_status('push', results, progress)
+
+
 def _run_wrapper(status, container, func, cmd, *args, **kwargs):
     '''
     Wrapper to a cmdmod function
@@ -16,15 +16,25 @@ Example::
 
 Configuration file can also be included such as::
     drizzle.default_file: '/etc/drizzle/config.cnf'
+
+Connections are pooled per process and per DSN, and checked with a ping
+before being reused. Rows of a SELECT are fetched in batches, and at most
+drizzle.max_rows rows are returned (0 for no limit)::
+    drizzle.pool_size: 4
+    drizzle.fetch_size: 1000
+    drizzle.max_rows: 10000
 '''
 
 # Importing the required libraries
 from __future__ import absolute_import
+import contextlib
+import csv
+import logging
 import re
+import threading
+import time
 import salt.utils
 from salt.ext import six
-from salt.ext.six.moves import range
-from salt.ext.six.moves import zip
 
 try:
     import MySQLdb
@@ -46,7 +56,26 @@ __outputter__ = {
     'table_find': 'yaml',
     'query': 'txt'
 }
-__opts__ = __salt__['test.get_opts']()
+log = logging.getLogger(__name__)
+
+# DSN tuple -> idle connections
+_POOL = {}
+_POOL_LOCK = threading.Lock()
+
+# Quoted strings and identifiers, comments and statement separators. The
+# quoted alternatives match one character per step, so that an unterminated
+# quote fails in linear time, and is then matched alone by the last
+# alternative.
+_SQL_TOKENS = re.compile(r'''
+    '(?:[^'\\]|\\.|'')*'
+  | "(?:[^"\\]|\\.|"")*"
+  | `(?:[^`]|``)*`
+  | --(?=\s|$)[^\n]*
+  | \#[^\n]*
+  | /\*.*?\*/
+  | ;
+  | ['"`]|/\*
+''', re.S | re.X)
 
 
 # Check for loading the module
@@ -90,6 +119,126 @@ def _connect(**dsn):
     return drizzle_db
 
 
+def _dsn_key(**dsn):
+    '''
+    Return the DSN as a hashable pool key, with the defaults filled in
+    '''
+    parameter = ['host', 'user', 'passwd', 'db', 'port']
+    return tuple((param, dsn.get(param, __opts__.get('drizzle.{0}'.format(param))))
+                 for param in parameter)
+
+
+def _acquire(key):
+    '''
+    Take a healthy idle connection of the pool, or open a new one
+    '''
+    while True:
+        with _POOL_LOCK:
+            idle = _POOL.get(key)
+            drizzle_db = idle.pop() if idle else None
+        if drizzle_db is None:
+            return _connect(**dict(key))
+        try:
+            drizzle_db.ping()
+            return drizzle_db
+        except MySQLdb.Error:
+            log.debug('Dropping a dead pooled Drizzle connection')
+            _close(drizzle_db)
+
+
+def _release(key, drizzle_db):
+    '''
+    Give a connection back to the pool, or close it if the pool is full
+    '''
+    size = int(__opts__.get('drizzle.pool_size', 4))
+    with _POOL_LOCK:
+        idle = _POOL.setdefault(key, [])
+        if len(idle) < size:
+            idle.append(drizzle_db)
+            return
+    _close(drizzle_db)
+
+
+def _close(drizzle_db):
+    try:
+        drizzle_db.close()
+    except MySQLdb.Error:
+        pass
+
+
+@contextlib.contextmanager
+def _connection(**dsn):
+    '''
+    Context manager lending a pooled connection. The connection is closed
+    instead of being pooled again when an error escapes.
+    '''
+    key = _dsn_key(**dsn)
+    drizzle_db = _acquire(key)
+    try:
+        yield drizzle_db
+    except Exception:
+        _close(drizzle_db)
+        raise
+    _release(key, drizzle_db)
+
+
+def _split_statements(text):
+    '''
+    Split SQL text into statements on the semicolons that are outside of
+    quoted strings, quoted identifiers and comments. Comments are removed,
+    except the /*! ... */ ones MySQL executes. Raises ValueError on a quote
+    or a comment that is not closed.
+    '''
+    statements = []
+    current = []
+    pos = 0
+    for match in _SQL_TOKENS.finditer(text):
+        current.append(text[pos:match.start()])
+        pos = match.end()
+        token = match.group()
+        if token in ('\'', '"', '`', '/*'):
+            raise ValueError('Unterminated {0} at position {1}'.format(
+                'comment' if token == '/*' else 'quoted string', match.start()))
+        if token == ';':
+            statements.append(''.join(current).strip())
+            current = []
+        elif token[0] in '-#' or (token.startswith('/*') and not token.startswith('/*!')):
+            current.append(' ')
+        else:
+            current.append(token)
+    current.append(text[pos:])
+    statements.append(''.join(current).strip())
+    return [statement for statement in statements if statement]
+
+
+def _fetch_rows(cursor, fetch_size, max_rows=0, writer=None):
+    '''
+    Fetch the rows of a cursor in batches of fetch_size rows. They are
+    written with writer (a csv writer) if given, otherwise at most max_rows
+    (0 for no limit) of them are returned and the others are read and
+    dropped, so that the connection can run further statements.
+    Returns a tuple of the rows, the row count and whether rows were left
+    out.
+    '''
+    rows = []
+    count = 0
+    while True:
+        batch = cursor.fetchmany(fetch_size)
+        if not batch:
+            return rows, count, False
+        if writer is not None:
+            writer.writerows(batch)
+            count += len(batch)
+            continue
+        if max_rows and count + len(batch) > max_rows:
+            rows.extend(list(row) for row in batch[:max_rows - count])
+            while cursor.fetchmany(fetch_size):
+                pass
+            return rows, max_rows, True
+        rows.extend(list(row) for row in batch)
+        count += len(batch)
+
+
 # Server functions
 def status():
     '''
@@ -103,17 +252,15 @@ def status():
 
     # Initializing the required variables
     ret_val = {}
-    drizzle_db = _connect()
-    cursor = drizzle_db.cursor()
+    with _connection() as drizzle_db:
+        cursor = drizzle_db.cursor()
 
-    # Fetching status
-    cursor.execute('SHOW STATUS')
-    for iter in range(cursor.rowcount):
-        status = cursor.fetchone()
-        ret_val[status[0]] = status[1]
+        # Fetching status
+        cursor.execute('SHOW STATUS')
+        for status in cursor.fetchall():
+            ret_val[status[0]] = status[1]
 
-    cursor.close()
-    drizzle_db.close()
+        cursor.close()
     return ret_val
 
 
@@ -127,15 +274,14 @@ def version():
         salt '*' drizzle.version
     '''
 
-    drizzle_db = _connect()
-    cursor = drizzle_db.cursor(MySQLdb.cursors.DictCursor)
+    with _connection() as drizzle_db:
+        cursor = drizzle_db.cursor(MySQLdb.cursors.DictCursor)
 
-    # Fetching version
-    cursor.execute('SELECT VERSION()')
-    version = cursor.fetchone()
+        # Fetching version
+        cursor.execute('SELECT VERSION()')
+        version = cursor.fetchone()
 
-    cursor.close()
-    drizzle_db.close()
+        cursor.close()
     return version
 
 
@@ -152,17 +298,15 @@ def schemas():
 
     # Initializing the required variables
     ret_val = {}
-    drizzle_db = _connect()
-    cursor = drizzle_db.cursor()
+    with _connection() as drizzle_db:
+        cursor = drizzle_db.cursor()
 
-    # Retriving the list of schemas
-    cursor.execute('SHOW SCHEMAS')
-    for iter, count in zip(list(range(cursor.rowcount)), list(range(1, cursor.rowcount+1))):
-        schema = cursor.fetchone()
-        ret_val[count] = schema[0]
+        # Retriving the list of schemas
+        cursor.execute('SHOW SCHEMAS')
+        for count, schema in enumerate(cursor.fetchall(), 1):
+            ret_val[count] = schema[0]
 
-    cursor.close()
-    drizzle_db.close()
+        cursor.close()
     return ret_val
 
 
@@ -176,15 +320,16 @@ def schema_exists(schema):
         salt '*' drizzle.schema_exists
     '''
 
-    drizzle_db = _connect()
-    cursor = drizzle_db.cursor()
+    with _connection() as drizzle_db:
+        cursor = drizzle_db.cursor()
 
-    # Checking for existance
-    cursor.execute('SHOW SCHEMAS LIKE "{0}"'.format(schema))
-    cursor.fetchall()
-    if cursor.rowcount == 1:
-        return True
-    return False
+        # Checking for existance
+        cursor.execute('SHOW SCHEMAS LIKE "{0}"'.format(schema))
+        cursor.fetchall()
+        exists = cursor.rowcount == 1
+
+        cursor.close()
+    return exists
 
 
 def schema_create(schema):
@@ -197,17 +342,17 @@ def schema_create(schema):
         salt '*' drizzle.schema_create schema_name
     '''
 
-    drizzle_db = _connect()
-    cursor = drizzle_db.cursor()
+    with _connection() as drizzle_db:
+        cursor = drizzle_db.cursor()
 
-    # Creating schema
-    try:
-        cursor.execute('CREATE SCHEMA {0}'.format(schema))
-    except MySQLdb.ProgrammingError:
-        return 'Schema already exists'
+        # Creating schema
+        try:
+            cursor.execute('CREATE SCHEMA {0}'.format(schema))
+        except MySQLdb.ProgrammingError:
+            return 'Schema already exists'
+        finally:
+            cursor.close()
 
-    cursor.close()
-    drizzle_db.close()
     return True
 
 
@@ -221,17 +366,17 @@ def schema_drop(schema):
         salt '*' drizzle.schema_drop schema_name
     '''
 
-    drizzle_db = _connect()
-    cursor = drizzle_db.cursor()
+    with _connection() as drizzle_db:
+        cursor = drizzle_db.cursor()
 
-    # Dropping schema
-    try:
-        cursor.execute('DROP SCHEMA {0}'.format(schema))
-    except MySQLdb.OperationalError:
-        return 'Schema does not exist'
+        # Dropping schema
+        try:
+            cursor.execute('DROP SCHEMA {0}'.format(schema))
+        except MySQLdb.OperationalError:
+            return 'Schema does not exist'
+        finally:
+            cursor.close()
 
-    cursor.close()
-    drizzle_db.close()
     return True
 
 
@@ -247,21 +392,20 @@ def tables(schema):
 
     # Initializing the required variables
     ret_val = {}
-    drizzle_db = _connect()
-    cursor = drizzle_db.cursor()
+    with _connection() as drizzle_db:
+        cursor = drizzle_db.cursor()
 
-    # Fetching tables
-    try:
-        cursor.execute('SHOW TABLES IN {0}'.format(schema))
-    except MySQLdb.OperationalError:
-        return 'Unknown Schema'
+        # Fetching tables
+        try:
+            cursor.execute('SHOW TABLES IN {0}'.format(schema))
+        except MySQLdb.OperationalError:
+            cursor.close()
+            return 'Unknown Schema'
 
-    for iter, count in zip(list(range(cursor.rowcount)), list(range(1, cursor.rowcount+1))):
-        table = cursor.fetchone()
-        ret_val[count] = table[0]
+        for count, table in enumerate(cursor.fetchall(), 1):
+            ret_val[count] = table[0]
 
-    cursor.close()
-    drizzle_db.close()
+        cursor.close()
     return ret_val
 
 
@@ -278,10 +422,8 @@ def table_find(table_to_find):
     # Initializing the required variables
     ret_val = {}
     count = 1
-    drizzle_db = _connect()
-    cursor = drizzle_db.cursor()
 
-    # Finding the schema
+    # Finding the schema, every call below reuses the pooled connection
     schema = schemas()
     for schema_iter in six.iterkeys(schema):
         table = tables(schema[schema_iter])
@@ -290,8 +432,6 @@ def table_find(table_to_find):
                 ret_val[count] = schema[schema_iter]
                 count = count+1
 
-    cursor.close()
-    drizzle_db.close()
     return ret_val
 
 
@@ -307,19 +447,16 @@ def plugins():
 
     # Initializing the required variables
     ret_val = {}
-    count = 1
-    drizzle_db = _connect()
-    cursor = drizzle_db.cursor()
-
-    # Fetching the plugins
-    query = 'SELECT PLUGIN_NAME FROM DATA_DICTIONARY.PLUGINS WHERE IS_ACTIVE LIKE "YES"'
-    cursor.execute(query)
-    for iter, count in zip(list(range(cursor.rowcount)), list(range(1, cursor.rowcount+1))):
-        table = cursor.fetchone()
-        ret_val[count] = table[0]
-
-    cursor.close()
-    drizzle_db.close()
+    with _connection() as drizzle_db:
+        cursor = drizzle_db.cursor()
+
+        # Fetching the plugins
+        query = 'SELECT PLUGIN_NAME FROM DATA_DICTIONARY.PLUGINS WHERE IS_ACTIVE LIKE "YES"'
+        cursor.execute(query)
+        for count, table in enumerate(cursor.fetchall(), 1):
+            ret_val[count] = table[0]
+
+        cursor.close()
     return ret_val
 
 # TODO: Needs to add plugin_add() and plugin_remove() methods.
@@ -329,68 +466,121 @@ def plugins():
 
 
 # Query functions
-def query(schema, query):
+def query(schema, query, args=None, transaction=True, fetch_size=None,
+          max_rows=None, out_file=None):
     '''
     Query method is used to issue any query to the database.
-    This method also supports multiple queries.
+    This method also supports multiple queries, separated by semicolons
+    outside of quoted strings and comments.
+
+    The statements run in one transaction, rolled back if one of them fails,
+    unless transaction=False. Statements that commit implicitly (CREATE,
+    DROP, ALTER...) end the transaction early. Every result has the time
+    spent on its statement, in seconds.
+
+    With args, a list of parameter lists (or dicts), the query must be a
+    single statement with %s (or %(name)s) placeholders, run once per
+    parameter list with executemany, eg. for bulk inserts.
+
+    The rows of a SELECT are returned as a list under rows, along with the
+    columns and the number of rows. They are fetched in batches of
+    fetch_size rows (drizzle.fetch_size, 1000 by default) from an unbuffered
+    cursor, and at most max_rows (drizzle.max_rows, 10000 by default, 0 for
+    no limit) are returned, truncated being set when rows were left out.
+    With out_file, the rows are written to that file as tab separated
+    values instead, without limit, the rows of every SELECT of the query
+    following those of the previous one.
 
     CLI Example::
 
         salt '*' drizzle.query test_db 'select * from test_table'
+        salt '*' drizzle.query test_db 'select * from test_table' max_rows=100
+        salt '*' drizzle.query test_db 'select * from test_table' out_file=/tmp/test_table.tsv
         salt '*' drizzle.query test_db 'insert into test_table values (1,"test1")'
+        salt '*' drizzle.query test_db 'insert into test_table values (%s, %s)' args='[[1, "a"], [2, "b"]]'
     '''
 
     # Initializing the required variables
     ret_val = {}
-    result = {}
-    drizzle_db = _connect()
-    cursor = drizzle_db.cursor()
-    columns = ()
-    rows = ()
-    tuples = {}
-    queries = []
-    _entry = True
+    if fetch_size is None:
+        fetch_size = __opts__.get('drizzle.fetch_size', 1000)
+    if max_rows is None:
+        max_rows = __opts__.get('drizzle.max_rows', 10000)
+    fetch_size = max(1, int(fetch_size))
+    max_rows = int(max_rows)
 
     # Support for mutilple queries
-    queries = query.split(";")
-
-    # Using the schema
     try:
-        cursor.execute('USE {0}'.format(schema))
-    except MySQLdb.Error:
-        return 'check your schema'
-
-    # Issuing the queries
-    for issue in queries:
+        queries = _split_statements(query)
+    except ValueError as exc:
+        log.error('Error in SQL query {0!r}: {1}'.format(query, exc))
+        return 'Error in your SQL statement: {0}'.format(exc)
+    if args is not None and len(queries) != 1:
+        return 'args need a single SQL statement'
+
+    with _connection() as drizzle_db:
+        # Rows are read as they come instead of being buffered client side
+        cursor = drizzle_db.cursor(MySQLdb.cursors.SSCursor)
+
+        # Using the schema
         try:
-            rows_affected = cursor.execute(issue)
+            cursor.execute('USE {0}'.format(schema))
         except MySQLdb.Error:
-            return 'Error in your SQL statement'
+            cursor.close()
+            return 'check your schema'
 
-        # Checking whether the query is a SELECT
-        if re.search(r'\s*select', issue) is None:
-            result['Rows affected:'] = rows_affected
-            ret_val[issue.lower()] = result
-            result = {}
-            continue
-
-        # Fetching the column names
-        if _entry:
-            attributes = cursor.description
-            for column_names in attributes:
-                columns += (column_names[0],)
-            _entry = False
-        result['columns'] = columns
-
-        # Fetching the tuples
-        count = 1
-        for iter in range(cursor.rowcount):
-            row = cursor.fetchone()
-            result['row{0}'.format(count)] = row
-            count += 1
-        result['Rows selected:'] = count-1
-        ret_val[issue.lower()] = result
-        result = {}
+        if transaction:
+            drizzle_db.autocommit(False)
+        handle = writer = None
+        try:
+            if out_file:
+                handle = salt.utils.fopen(out_file, 'w')
+                writer = csv.writer(handle, delimiter='\t', lineterminator='\n')
+
+            # Issuing the queries
+            for issue in queries:
+                result = {}
+                start = time.time()
+                try:
+                    if args is not None:
+                        rows_affected = cursor.executemany(issue, args)
+                    else:
+                        rows_affected = cursor.execute(issue)
+                except MySQLdb.Error as exc:
+                    if transaction:
+                        drizzle_db.rollback()
+                    log.error('Error in SQL statement {0!r}: {1}'.format(issue, exc))
+                    return 'Error in your SQL statement'
+
+                # Only statements returning rows have a description
+                if cursor.description is None:
+                    result['Rows affected:'] = rows_affected
+                else:
+                    # Fetching the column names
+                    result['columns'] = tuple(column[0] for column in cursor.description)
+
+                    # Fetching the tuples
+                    rows, count, truncated = _fetch_rows(cursor, fetch_size, max_rows, writer)
+                    if out_file:
+                        result['file'] = out_file
+                    else:
+                        result['rows'] = rows
+                    if truncated:
+                        log.warning('Query returned more than {0} rows, truncated'.format(max_rows))
+                        result['truncated'] = True
+                    result['Rows selected:'] = count
+
+                result['Execution time:'] = time.time() - start
+                ret_val[issue.lower()] = result
+
+            if transaction:
+                drizzle_db.commit()
+        finally:
+            if handle is not None:
+                handle.close()
+            if transaction:
+                drizzle_db.autocommit(True)
+            cursor.close()
 
     return ret_val
 
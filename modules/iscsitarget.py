@@ -28,9 +28,22 @@ ToDo::
 
 # System Imports
 import logging
+import os
+import tempfile
+
+# Import Salt libs
+from salt.exceptions import CommandExecutionError
+
+try:
+    import _pool
+except ImportError:
+    from salt.modules import _pool
 
 log = logging.getLogger(__name__)
 
+VOLUME_PROC = '/proc/net/iet/volume'
+SESSION_PROC = '/proc/net/iet/session'
+
 
 # Helper functions
 
@@ -49,37 +62,137 @@ def _is_ietd_running():
     return True
 
 
+def _parse_fields(line):
+    '''
+    Parse a line of key:value fields. The path field is last and may
+    contain spaces.
+    '''
+    line, sep, path = line.strip().partition('path:')
+    fields = dict(x__.split(':', 1) for x__ in line.split() if ':' in x__)
+    if sep:
+        fields['path'] = path.rstrip()
+    for key in ('tid', 'lun', 'state', 'cid'):
+        if key in fields and fields[key].isdigit():
+            fields[key] = int(fields[key])
+    return fields
+
+
+def _parse_volumes(text):
+    '''
+    Parse /proc/net/iet/volume in a single pass. Returns a dict with the
+    targets indexed by tid, each with its iqn and its luns indexed by lun,
+    and the tids indexed by iqn.
+    '''
+    targets = {}
+    by_iqn = {}
+    target = None
+    for line in text.splitlines():
+        if line.startswith('tid:'):
+            fields = _parse_fields(line)
+            target = {'tid': fields['tid'], 'iqn': fields.get('name', ''), 'luns': {}}
+            targets[target['tid']] = target
+            by_iqn[target['iqn']] = target['tid']
+        elif target is not None and line.strip().startswith('lun:'):
+            fields = _parse_fields(line)
+            target['luns'][fields['lun']] = fields
+    return {'targets': targets, 'by_iqn': by_iqn}
+
+
+def _parse_sessions(text):
+    '''
+    Parse /proc/net/iet/session in a single pass. Returns the targets
+    indexed by tid, each with its iqn and its sessions, each session with
+    its connections.
+    '''
+    targets = {}
+    target = session = None
+    for line in text.splitlines():
+        stripped = line.strip()
+        if line.startswith('tid:'):
+            fields = _parse_fields(line)
+            target = {'tid': fields['tid'], 'iqn': fields.get('name', ''), 'sessions': []}
+            targets[target['tid']] = target
+        elif target is not None and stripped.startswith('sid:'):
+            session = _parse_fields(line)
+            session['connections'] = []
+            target['sessions'].append(session)
+        elif session is not None and stripped.startswith('cid:'):
+            session['connections'].append(_parse_fields(line))
+    return targets
+
+
+def _volumes(refresh=False):
+    '''
+    Return the parsed /proc/net/iet/volume, read once per job. Functions
+    changing targets or LUNs keep it up to date.
+    '''
+    if refresh or 'iscsitarget.volumes' not in __context__:
+        with open(VOLUME_PROC) as fd_:
+            __context__['iscsitarget.volumes'] = _parse_volumes(fd_.read())
+    return __context__['iscsitarget.volumes']
+
+
+def _volumes_add_target(tid, fiqn):
+    '''
+    Record a new target in the cached volume model
+    '''
+    if 'iscsitarget.volumes' in __context__:
+        model = __context__['iscsitarget.volumes']
+        model['targets'][tid] = {'tid': tid, 'iqn': fiqn, 'luns': {}}
+        model['by_iqn'][fiqn] = tid
+
+
+def _volumes_delete_target(tid):
+    '''
+    Remove a target from the cached volume model
+    '''
+    if 'iscsitarget.volumes' in __context__:
+        model = __context__['iscsitarget.volumes']
+        target = model['targets'].pop(tid, None)
+        if target is not None:
+            model['by_iqn'].pop(target['iqn'], None)
+
+
+def _volumes_add_lun(tid, lun, path, iotype='blockio'):
+    '''
+    Record a new LUN in the cached volume model
+    '''
+    target = __context__.get('iscsitarget.volumes', {}).get('targets', {}).get(tid)
+    if target is not None:
+        target['luns'][int(lun)] = {'lun': int(lun), 'iotype': iotype, 'path': path}
+
+
+def _volumes_delete_lun(tid, lun):
+    '''
+    Remove a LUN from the cached volume model
+    '''
+    target = __context__.get('iscsitarget.volumes', {}).get('targets', {}).get(tid)
+    if target is not None:
+        target['luns'].pop(int(lun), None)
+
+
 def _get_new_tid():
     '''
     Get a new Target ID, and make sure it is not in use
     '''
-    tid = 1
-    with open('/proc/net/iet/volume') as fd_:
-        tids = [int(x__.split(' ')[0].split(':')[-1]) for x__ in fd_.readlines() if 'tid:' in x__]
+    tids = _volumes()['targets']
 
-        # Get a new ID based on the max
-        # We avoid deleted TIDs as a stale iSCSI client may pick it up
-        # If you have lots of TIDs and need to reuse deleted ones you may
-        # want to alter this
-        if tids:
-            tid = max(tids) + 1
-
-    return tid
+    # Get a new ID based on the max
+    # We avoid deleted TIDs as a stale iSCSI client may pick it up
+    # If you have lots of TIDs and need to reuse deleted ones you may
+    # want to alter this
+    if tids:
+        return max(tids) + 1
+    return 1
 
 
 def _get_tid_from_iqn(iqn):
     '''
     Get a target ID using a full IQN
     '''
-    ret = 0
-    with open('/proc/net/iet/volume') as fd_:
-        lines = fd_.readlines()
-        for x__ in lines:
-            if iqn in x__:
-                ret = int(x__.split(' ')[0].split(':')[-1])
-                break
-        else:
-            log.error('Error: (proc/net/iet/volume) {0} not found'.format(iqn))
+    ret = _volumes()['by_iqn'].get(iqn, 0)
+    if not ret:
+        log.error('Error: (proc/net/iet/volume) {0} not found'.format(iqn))
 
     return ret
 
@@ -88,17 +201,12 @@ def _get_volumes(iqn):
     '''
     Get all volumes associated with target
     '''
-    with open('/proc/net/iet/volume') as fd_:
-        lines = fd_.read()
-        if iqn not in lines:
-            return []
-        config = lines.split(iqn)[-1]
-        config = config.split('tid:')[0].split('\n')[1:-1]
-        paths = []
-        for x__ in config:
-            paths.append(x__.split('path:')[-1].rstrip())
-
-    return paths
+    model = _volumes()
+    tid = model['by_iqn'].get(iqn)
+    if tid is None:
+        return []
+    luns = model['targets'][tid]['luns']
+    return [luns[x__]['path'] for x__ in sorted(luns)]
 
 
 def _get_params(kwargs):
@@ -134,6 +242,55 @@ def _rewrite_config(cf_, lines):
     cf_.truncate()
 
 
+def _replace_config(config, lines):
+    '''
+    Atomically replace the configuration file, so that ietd never reads a
+    partially written one
+    '''
+    dir_ = os.path.dirname(os.path.abspath(config))
+    fd_, tmp = tempfile.mkstemp(prefix='.ietd.conf.', dir=dir_)
+    try:
+        with os.fdopen(fd_, 'w') as tf_:
+            tf_.write(''.join(lines))
+            tf_.flush()
+            os.fsync(tf_.fileno())
+        if os.path.exists(config):
+            os.chmod(tmp, os.stat(config).st_mode & 0o7777)
+        os.rename(tmp, config)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+def _find_target(clines, fiqn):
+    '''
+    Return the index of the Target line of an IQN in the config lines, or
+    None. IQNs are compared whole, not as prefixes.
+    '''
+    for x__, line in enumerate(clines):
+        words = line.split()
+        if words and words[0] == 'Target' and fiqn in words[1:]:
+            return x__
+    return None
+
+
+def _lines_add_lun(clines, fiqn, lun, path, iotype='blockio'):
+    '''
+    Add a LUN to a Target in the config lines. If the Target does not exist
+    create config for it.
+    '''
+    nlun = '\tLun {0} PATH={1},Type={2}\n'.format(lun, path, iotype)
+    t__ = _find_target(clines, fiqn)
+    if t__ is not None:
+        t__ += 1
+        while t__ < len(clines) and clines[t__].lstrip().startswith('Lun'):
+            t__ += 1
+        clines.insert(t__, nlun)
+    else:
+        clines.append('Target {0}\n'.format(fiqn))
+        clines.append(nlun)
+
+
 def _config_add_target(config, tid, fiqn):
     '''
     Add a target to the config file
@@ -148,12 +305,10 @@ def _config_delete_target(config, fiqn):
     '''
     with open(config, 'r+') as fd_:
         clines = fd_.readlines()
-        tgts = [x__ for x__ in range(len(clines)) if clines[x__].lstrip().startswith('Target')]
         # Find the Target
-        tgt = [x__ for x__ in tgts if fiqn in clines[x__]]
-        if tgt:
+        t__ = _find_target(clines, fiqn)
+        if t__ is not None:
             # Delete the whole target
-            t__ = tgt[0]
             while True:
                 del clines[t__]
                 # Delete until the end, or until the next Target definition
@@ -215,23 +370,9 @@ def _config_add_lun(config, fiqn, lun, vg_, name, iotype='blockio'):
     Add a LUN to a Target in the config file. If the Target does not exist
     create config for it.
     '''
-    nlun = '\tLun {0} PATH=/dev/{1}/{2},Type={3}\n'.format(lun, vg_, name, iotype)
-
     with open(config, 'r+') as fd_:
         clines = fd_.readlines()
-        tgts = [x__ for x__ in range(len(clines)) if clines[x__].lstrip().startswith('Target')]
-
-        # find the target
-        tgt = [x__ for x__ in tgts if fiqn in clines[x__]]
-        if tgt:
-            t__ = tgt[0] + 1
-            while t__ < len(clines) and clines[t__].lstrip().startswith('Lun'):
-                t__ += 1
-            clines.insert(t__, nlun)
-        else:
-            clines.append('Target {0}\n'.format(fiqn))
-            clines.append(nlun)
-
+        _lines_add_lun(clines, fiqn, lun, '/dev/{0}/{1}'.format(vg_, name), iotype)
         _rewrite_config(fd_, clines)
 
 
@@ -254,14 +395,13 @@ def _config_delete_lun(config, fiqn, lun, rtarget=False):
     '''
     with open(config, 'r+') as fd_:
         clines = fd_.readlines()
-        tgts = [x__ for x__ in range(len(clines)) if clines[x__].lstrip().startswith('Target')]
         # Find the Target
-        tgt = [x__ for x__ in tgts if fiqn in clines[x__]]
-        if tgt:
+        t__ = _find_target(clines, fiqn)
+        if t__ is not None:
             # Delete just the LUN
-            t__ = tgt[0] + 1
+            t__ += 1
             while t__ < len(clines) and clines[t__].lstrip().startswith('Lun'):
-                if 'Lun {0}'.format(lun) in clines[t__]:
+                if clines[t__].split()[1:2] == [str(lun)]:
                     del clines[t__]
                 else:
                     t__ += 1
@@ -331,6 +471,8 @@ def add_target(name, **kwargs):
             )
         }
 
+    _volumes_add_target(tid, fiqn)
+
     # Add target to config
     _config_add_target(config, tid, fiqn)
 
@@ -393,6 +535,7 @@ def delete_target(name, **kwargs):
         return {
             'Error': 'ietadm({0}) Could not delete target {1}'.format(out, fiqn)
         }
+    _volumes_delete_target(tid)
 
     # Remove the configuration
     _config_delete_target(config, fiqn)
@@ -443,9 +586,10 @@ def add_lun(name, lun, size, **kwargs):
         return {
             'Error': 'Could not add lun {0} to target {1}'.format(lun, tid)
         }
+    _volumes_add_lun(tid, lun, path)
 
     # Update config file
-    _config_add_lun(config, fiqn, lun, vg_, name)
+    _config_add_lun(config, fiqn, lun, vg_, vn_)
 
     return {'Success': 'Added lun {0} to {1}'.format(lun, vg_)}
 
@@ -484,6 +628,7 @@ def delete_lun(name, lun, **kwargs):
         return {
             'Error': 'Could not delete lun {0} from target {1}'.format(lun, tid)
         }
+    _volumes_delete_lun(tid, lun)
 
     # Update config file
     _config_delete_lun(config, fiqn, lun)
@@ -497,29 +642,161 @@ def delete_lun(name, lun, **kwargs):
     return True
 
 
-def list_volumes():
+def _batch_jobs(targets, iqn_base, vg_):
+    '''
+    Turn target specs into a list of new target IQNs and a list of LUN jobs
+    '''
+    model = _volumes()
+    new_targets = []
+    jobs = []
+    for spec in targets:
+        if not isinstance(spec, dict):
+            spec = {'name': spec}
+        name = spec['name']
+        fiqn = '{0}:{1}'.format(iqn_base, name)
+        if fiqn not in model['by_iqn'] and fiqn not in new_targets:
+            new_targets.append(fiqn)
+        existing = model['targets'].get(model['by_iqn'].get(fiqn), {}).get('luns', {})
+
+        luns = spec.get('luns') or []
+        if isinstance(luns, dict):
+            luns = [{'lun': lun, 'size': size} for lun, size in sorted(luns.items())]
+        for lun in luns:
+            if int(lun['lun']) in existing:
+                log.debug('LUN {0} of {1} already exists'.format(lun['lun'], fiqn))
+                continue
+            vn_ = '{0}_{1}'.format(name, lun['lun'])
+            jobs.append({'fiqn': fiqn,
+                         'lun': lun['lun'],
+                         'size': lun['size'],
+                         'iotype': lun.get('iotype', 'blockio'),
+                         'vn': vn_,
+                         'path': '/dev/{0}/{1}'.format(vg_, vn_)})
+    return new_targets, jobs
+
+
+def add_batch(targets, workers=4, **kwargs):
+    '''
+    Add many targets and LUNs at once. Missing targets are created, then
+    the logical volumes of the new LUNs are created concurrently, attached
+    to their targets, and the config file is rewritten once, atomically.
+    Targets and LUNs that already exist are left alone. A LUN whose volume
+    cannot be attached has its volume removed.
+
+    targets
+      List of target specs, each a dict with the name of the target (minus
+      the IQN base) and its luns, a list of dicts with lun, size and
+      optionally iotype, or a dict mapping LUNs to sizes (required)
+
+    workers
+      Number of logical volumes created at the same time (optional)
+
+    Like add_target and add_lun, iqn_base, volgroup and config can be
+    overridden (optional)
+
+    Returns the created targets and LUNs, and the errors.
+
+    CLI Example::
+
+        salt \* iscsitarget.add_batch '[{name: db, luns: {0: 10G, 1: 20G}}, {name: web, luns: {0: 5G}}]'
     '''
-    Get iSCSI Target volume information
+    # Check that ietd is running
+    if not _is_ietd_running():
+        return {'Error': '(ietd) ietd not active'}
+
+    iqn_base, vg_, config, opts = _get_params(kwargs)
+    new_targets, jobs = _batch_jobs(targets, iqn_base, vg_)
+    ret = {'targets': [], 'luns': {}, 'errors': []}
+    clines = []
+    if os.path.exists(config):
+        with open(config) as fd_:
+            clines = fd_.readlines()
+
+    # Create the iscsi targets
+    tid = _get_new_tid()
+    for fiqn in new_targets:
+        cmd = 'ietadm --op new --tid {0} --params Name={1}'.format(tid, fiqn)
+        out = __salt__['cmd.retcode'](cmd)
+        if out:
+            ret['errors'].append(
+                'ietadm({0}) Could not create iSCSI Target {1}'.format(out, fiqn))
+            continue
+        _volumes_add_target(tid, fiqn)
+        clines.append('Target {0} {1}\n'.format(tid, fiqn))
+        ret['targets'].append(fiqn)
+        tid += 1
+
+    # Create the logical volumes of the LUNs whose target exists
+    by_iqn = _volumes()['by_iqn']
+    jobs = [job for job in jobs if job['fiqn'] in by_iqn]
+
+    def _create(job):
+        if not _create_vol(job['vn'], job['size'], vg_):
+            raise CommandExecutionError(
+                'Could not create volume {0} in {1}'.format(job['vn'], vg_))
+
+    created = []
+    for job, error in _pool.run(_create, jobs, workers):
+        if error:
+            ret['errors'].append(error)
+        else:
+            created.append(job)
+
+    # Attach them, ietadm is quick and serialized by the kernel anyway
+    for job in created:
+        tid = by_iqn[job['fiqn']]
+        if not _add_lun(tid, job['lun'], job['path'], job['iotype']):
+            ret['errors'].append(
+                'Could not add lun {0} to target {1}'.format(job['lun'], tid))
+            _delete_vol(job['vn'], vg_)
+            continue
+        _volumes_add_lun(tid, job['lun'], job['path'], job['iotype'])
+        _lines_add_lun(clines, job['fiqn'], job['lun'], job['path'], job['iotype'])
+        ret['luns'].setdefault(job['fiqn'], []).append(job['lun'])
+
+    if ret['targets'] or ret['luns']:
+        _replace_config(config, clines)
+
+    return ret
+
+
+def list_volumes(raw=False):
+    '''
+    Get iSCSI Target volume information, indexed by target ID. Each target
+    has its IQN and its LUNs indexed by LUN.
+
+    raw
+      Return the content of /proc/net/iet/volume instead (optional)
 
     CLI Example::
 
         salt \* iscsitarget.list_volumes
+
+        salt \* iscsitarget.list_volumes raw=True
     '''
-    # Directly return the contents of the kernel params
-    # TODO: Parse the output and make it machine readable
-    with open('/proc/net/iet/volume') as fd_:
-        return fd_.read()
+    if raw:
+        with open(VOLUME_PROC) as fd_:
+            return fd_.read()
+    return _volumes(refresh=True)['targets']
 
 
-def list_sessions():
+def list_sessions(raw=False):
     '''
-    Get iSCSI Target session information
+    Get iSCSI Target session information, indexed by target ID. Each target
+    has its IQN and its sessions, each session its initiator and its
+    connections.
+
+    raw
+      Return the content of /proc/net/iet/session instead (optional)
 
     CLI Example::
 
         salt \* iscsitarget.list_sessions
+
+        salt \* iscsitarget.list_sessions raw=True
     '''
-    # Directly return the content of the kernel params
-    # TODO: Parse the output and make it readable
-    with open('/proc/net/iet/session') as fd_:
-        return fd_.read()
+    with open(SESSION_PROC) as fd_:
+        text = fd_.read()
+    if raw:
+        return text
+    return _parse_sessions(text)
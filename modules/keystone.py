@@ -17,10 +17,28 @@ Module for handling openstack keystone calls.
 
         keystone.token: 'ADMIN'
         keystone.endpoint: 'http://127.0.0.1:35357/v2.0'
+
+    Authenticated clients are cached per process and reused until their token
+    is about to expire. Name to id lookups for users, roles and tenants are
+    served from per-process indexes, which are kept up to date by the create
+    and delete functions of this module and otherwise expire after
+    ``keystone.cache_ttl`` seconds (defaults to 60)::
+
+        keystone.cache_ttl: 60
 '''
 
-# Import third party libs
+# Import python libs
 from __future__ import absolute_import
+import threading
+import time
+
+# Import salt libs
+try:
+    import _pool
+except ImportError:
+    from salt.modules import _pool
+
+# Import third party libs
 HAS_KEYSTONE = False
 try:
     from keystoneclient.v2_0 import client
@@ -43,11 +61,21 @@ def __virtual__():
 __opts__ = {}
 
 
-def auth():
-    '''
-    Set up keystone credentials.
+# Authenticated clients, keyed by the credentials used to create them
+_CLIENTS = {}
+# Name to id indexes, keyed by (credentials, collection)
+_INDEXES = {}
+_CACHE_LOCK = threading.RLock()
 
-    Only intended to be used within Keystone-enabled modules.
+# Refresh tokens this many seconds before they actually expire
+_TOKEN_STALE_DURATION = 30
+_DEFAULT_CACHE_TTL = 60
+
+
+def _auth_kwargs():
+    '''
+    Return the keyword arguments used to create a keystone client, as read
+    from the minion config or pillar.
     '''
     user = __salt__['config.option']('keystone.user')
     password = __salt__['config.option']('keystone.password')
@@ -72,7 +100,158 @@ def auth():
             'auth_url': auth_url,
             'insecure': insecure,
         }
-    return client.Client(**kwargs)
+    return kwargs
+
+
+def _cache_key():
+    return tuple(sorted(_auth_kwargs().items()))
+
+
+def _cache_ttl():
+    ttl = __salt__['config.option']('keystone.cache_ttl')
+    if ttl is None or ttl == '':
+        return _DEFAULT_CACHE_TTL
+    return float(ttl)
+
+
+def _token_expired(kstone):
+    '''
+    Return True if the token held by the passed client is about to expire.
+    Clients using a static admin token never expire.
+    '''
+    auth_ref = getattr(kstone, 'auth_ref', None)
+    if auth_ref is None or not hasattr(auth_ref, 'will_expire_soon'):
+        return False
+    return auth_ref.will_expire_soon(stale_duration=_TOKEN_STALE_DURATION)
+
+
+def auth(refresh=False):
+    '''
+    Set up keystone credentials.
+
+    The authenticated client is cached for the lifetime of the minion process
+    and reused by every function of this module, a new token is only
+    requested when the cached one is about to expire or ``refresh`` is True.
+
+    Only intended to be used within Keystone-enabled modules.
+    '''
+    key = _cache_key()
+    with _CACHE_LOCK:
+        kstone = _CLIENTS.get(key)
+        if refresh or kstone is None or _token_expired(kstone):
+            kstone = client.Client(**dict(key))
+            _CLIENTS[key] = kstone
+        return kstone
+
+
+def _index(kstone, collection, refresh=False):
+    '''
+    Return the name to id index of the passed collection (``users``, ``roles``
+    or ``tenants``), listing the collection only if the cached index is
+    missing, older than ``keystone.cache_ttl`` or ``refresh`` is True.
+    '''
+    key = (_cache_key(), collection)
+    with _CACHE_LOCK:
+        cached = _INDEXES.get(key)
+        if refresh or cached is None or \
+                time.time() - cached[0] > _cache_ttl():
+            index = {}
+            for item in getattr(kstone, collection).list():
+                index[item.name] = item.id
+            cached = (time.time(), index)
+            _INDEXES[key] = cached
+        return cached[1]
+
+
+def _index_store(collection, items):
+    '''
+    Replace the cached index of the collection with the passed items, which
+    must be a complete listing of the collection
+    '''
+    index = {}
+    for item in items:
+        index[item.name] = item.id
+    with _CACHE_LOCK:
+        _INDEXES[(_cache_key(), collection)] = (time.time(), index)
+
+
+def _resolve_id(kstone, collection, name, refresh=False):
+    '''
+    Return the id of the named item of the passed collection, or None. An
+    unknown name is not looked up again before the index expires, the create
+    functions of this module record the items they add.
+    '''
+    return _index(kstone, collection, refresh).get(name)
+
+
+def _call_resolved(kstone, func, *lookups):
+    '''
+    Call ``func`` with the ids of the passed ``(collection, name, id)``
+    lookups. A name is resolved through the cached index of its collection,
+    ``id`` being used when no name is passed or the name is unknown.
+
+    If keystone reports that an item no longer exists while an id came from
+    the cached indexes, eg. because it was deleted or recreated outside of
+    this module, the named collections are listed again and ``func`` is
+    called once more with the fresh ids.
+    '''
+    for refresh in (False, True):
+        ids = []
+        cached = False
+        for collection, name, id in lookups:  # pylint: disable-msg=C0103
+            resolved = name and _resolve_id(kstone, collection, name, refresh)
+            cached = cached or bool(resolved)
+            ids.append(resolved or id)
+        try:
+            return func(*ids)
+        except NotFound:
+            if refresh or not cached:
+                raise
+
+
+def _index_add(collection, name, id):  # pylint: disable-msg=C0103
+    '''
+    Record a newly created item in the collection index, if it is cached
+    '''
+    with _CACHE_LOCK:
+        cached = _INDEXES.get((_cache_key(), collection))
+        if cached is not None:
+            cached[1][name] = id
+
+
+def _index_remove(collection, id):  # pylint: disable-msg=C0103
+    '''
+    Forget a deleted item in the collection index, if it is cached
+    '''
+    with _CACHE_LOCK:
+        cached = _INDEXES.get((_cache_key(), collection))
+        if cached is not None:
+            for name in [x for x, y in cached[1].items() if y == id]:
+                del cached[1][name]
+
+
+def _index_invalidate(collection=None):
+    '''
+    Drop the cached index of the passed collection, or all of them
+    '''
+    with _CACHE_LOCK:
+        for key in list(_INDEXES):
+            if collection is None or key[1] == collection:
+                del _INDEXES[key]
+
+
+def clear_cache():
+    '''
+    Drop the cached keystone clients and name indexes of this minion process
+
+    CLI Example::
+
+        salt '*' keystone.clear_cache
+    '''
+    with _CACHE_LOCK:
+        _CLIENTS.clear()
+        _INDEXES.clear()
+    return True
 
 
 def ec2_credentials_get(id=None,       # pylint: disable-msg=C0103
@@ -88,24 +267,22 @@ def ec2_credentials_get(id=None,       # pylint: disable-msg=C0103
         salt '*' keystone.ec2_credentials_get name=nova access=722787eb540849158668370dc627ec5f
     '''
     kstone = auth()
-    ret = {}
-    if name:
-        for user in kstone.users.list():
-            if user.name == name:
-                id = user.id  # pylint: disable-msg=C0103
-                continue
-    if not id:
-        return {'Error': 'Unable to resolve user id'}
-    if not access:
-        return {'Error': 'Access key is required'}
-    ec2_credentials = kstone.ec2.get(user_id=id, access=access)
-    ret[ec2_credentials.user_id] = {
-        'user_id': ec2_credentials.user_id,
-        'tenant': ec2_credentials.tenant_id,
-        'access': ec2_credentials.access,
-        'secret': ec2_credentials.secret,
-    }
-    return ret
+
+    def _get(user_id):
+        ret = {}
+        if not user_id:
+            return {'Error': 'Unable to resolve user id'}
+        if not access:
+            return {'Error': 'Access key is required'}
+        ec2_credentials = kstone.ec2.get(user_id=user_id, access=access)
+        ret[ec2_credentials.user_id] = {
+            'user_id': ec2_credentials.user_id,
+            'tenant': ec2_credentials.tenant_id,
+            'access': ec2_credentials.access,
+            'secret': ec2_credentials.secret,
+        }
+        return ret
+    return _call_resolved(kstone, _get, ('users', name, id))
 
 
 def ec2_credentials_list(id=None, name=None):  # pylint: disable-msg=C0103
@@ -119,22 +296,20 @@ def ec2_credentials_list(id=None, name=None):  # pylint: disable-msg=C0103
         salt '*' keystone.ec2_credentials_list name=jack
     '''
     kstone = auth()
-    ret = {}
-    if name:
-        for user in kstone.users.list():
-            if user.name == name:
-                id = user.id  # pylint: disable-msg=C0103
-                continue
-    if not id:
-        return {'Error': 'Unable to resolve user id'}
-    for ec2_credential in kstone.ec2.list(id):
-        ret[ec2_credential.user_id] = {
-            'user_id': ec2_credential.user_id,
-            'tenant_id': ec2_credential.tenant_id,
-            'access': ec2_credential.access,
-            'secret': ec2_credential.secret,
-        }
-    return ret
+
+    def _list(user_id):
+        ret = {}
+        if not user_id:
+            return {'Error': 'Unable to resolve user id'}
+        for ec2_credential in kstone.ec2.list(user_id):
+            ret[ec2_credential.user_id] = {
+                'user_id': ec2_credential.user_id,
+                'tenant_id': ec2_credential.tenant_id,
+                'access': ec2_credential.access,
+                'secret': ec2_credential.secret,
+            }
+        return ret
+    return _call_resolved(kstone, _list, ('users', name, id))
 
 
 def endpoint_get(service):
@@ -182,20 +357,18 @@ def role_get(id=None, name=None):  # pylint: disable-msg=C0103
         salt '*' keystone.role_get name=nova
     '''
     kstone = auth()
-    ret = {}
-    if name:
-        for role in kstone.roles.list():
-            if role.name == name:
-                id = role.id  # pylint: disable-msg=C0103
-                continue
-    if not id:
-        return {'Error': 'Unable to resolve role id'}
-    role = kstone.roles.get(id)
-    ret[role.name] = {
-        'id': role.id,
-        'name': role.name,
-    }
-    return ret
+
+    def _get(role_id):
+        ret = {}
+        if not role_id:
+            return {'Error': 'Unable to resolve role id'}
+        role = kstone.roles.get(role_id)
+        ret[role.name] = {
+            'id': role.id,
+            'name': role.name,
+        }
+        return ret
+    return _call_resolved(kstone, _get, ('roles', name, id))
 
 
 def role_create(name):
@@ -211,6 +384,7 @@ def role_create(name):
     item = kstone.roles.create(
         name=name,
     )
+    _index_add('roles', item.name, item.id)
     return role_get(item.id)
 
 
@@ -225,18 +399,17 @@ def role_delete(id=None, name=None):  # pylint: disable-msg=C0103
         salt '*' keystone.role_delete name=nova
     '''
     kstone = auth()
-    if name:
-        for role in kstone.roles.list():
-            if role.name == name:
-                id = role.id  # pylint: disable-msg=C0103
-                continue
-    if not id:
-        return {'Error': 'Unable to resolve tenant id'}
-    kstone.roles.delete(id)
-    ret = 'Role ID {0} deleted'.format(id)
-    if name:
-        ret += ' ({0})'.format(name)
-    return ret
+
+    def _delete(role_id):
+        if not role_id:
+            return {'Error': 'Unable to resolve tenant id'}
+        kstone.roles.delete(role_id)
+        _index_remove('roles', role_id)
+        ret = 'Role ID {0} deleted'.format(role_id)
+        if name:
+            ret += ' ({0})'.format(name)
+        return ret
+    return _call_resolved(kstone, _delete, ('roles', name, id))
 
 
 def role_list():
@@ -273,7 +446,7 @@ def service_get(id=None, name=None):  # pylint: disable-msg=C0103
         for service in kstone.services.list():
             if service.name == name:
                 id = service.id  # pylint: disable-msg=C0103
-                continue
+                break
     if not id:
         return {'Error': 'Unable to resolve service id'}
     service = kstone.services.get(id)
@@ -317,22 +490,20 @@ def tenant_get(id=None, name=None):  # pylint: disable-msg=C0103
         salt '*' keystone.tenant_get name=nova
     '''
     kstone = auth()
-    ret = {}
-    if name:
-        for tenant in kstone.tenants.list():
-            if tenant.name == name:
-                id = tenant.id  # pylint: disable-msg=C0103
-                continue
-    if not id:
-        return {'Error': 'Unable to resolve tenant id'}
-    tenant = kstone.tenants.get(id)
-    ret[tenant.name] = {
-        'id': tenant.id,
-        'name': tenant.name,
-        'description': tenant.description,
-        'enabled': tenant.enabled,
-    }
-    return ret
+
+    def _get(tenant_id):
+        ret = {}
+        if not tenant_id:
+            return {'Error': 'Unable to resolve tenant id'}
+        tenant = kstone.tenants.get(tenant_id)
+        ret[tenant.name] = {
+            'id': tenant.id,
+            'name': tenant.name,
+            'description': tenant.description,
+            'enabled': tenant.enabled,
+        }
+        return ret
+    return _call_resolved(kstone, _get, ('tenants', name, id))
 
 
 def tenant_create(name, description=None, enabled=True):
@@ -350,6 +521,7 @@ def tenant_create(name, description=None, enabled=True):
         description=description,
         enabled=enabled,
     )
+    _index_add('tenants', item.name, item.id)
     return tenant_get(item.id)
 
 
@@ -364,18 +536,17 @@ def tenant_delete(id=None, name=None):  # pylint: disable-msg=C0103
         salt '*' keystone.tenant_delete name=nova
     '''
     kstone = auth()
-    if name:
-        for tenant in kstone.tenants.list():
-            if tenant.name == name:
-                id = tenant.id  # pylint: disable-msg=C0103
-                continue
-    if not id:
-        return {'Error': 'Unable to resolve tenant id'}
-    kstone.tenants.delete(id)
-    ret = 'Tenant ID {0} deleted'.format(id)
-    if name:
-        ret += ' ({0})'.format(name)
-    return ret
+
+    def _delete(tenant_id):
+        if not tenant_id:
+            return {'Error': 'Unable to resolve tenant id'}
+        kstone.tenants.delete(tenant_id)
+        _index_remove('tenants', tenant_id)
+        ret = 'Tenant ID {0} deleted'.format(tenant_id)
+        if name:
+            ret += ' ({0})'.format(name)
+        return ret
+    return _call_resolved(kstone, _delete, ('tenants', name, id))
 
 
 def tenant_list():
@@ -430,7 +601,7 @@ def user_list():
         ret[user.name] = {
             'id': user.id,
             'name': user.name,
-            'email': user.email,
+            'email': getattr(user, 'email', None),
             'enabled': user.enabled,
             'tenant_id': user.tenantId,
         }
@@ -448,23 +619,21 @@ def user_get(id=None, name=None):  # pylint: disable-msg=C0103
         salt '*' keystone.user_get name=nova
     '''
     kstone = auth()
-    ret = {}
-    if name:
-        for user in kstone.users.list():
-            if user.name == name:
-                id = user.id  # pylint: disable-msg=C0103
-                continue
-    if not id:
-        return {'Error': 'Unable to resolve user id'}
-    user = kstone.users.get(id)
-    ret[user.name] = {
-        'id': user.id,
-        'name': user.name,
-        'email': user.email,
-        'enabled': user.enabled,
-        'tenant_id': user.tenantId,
-    }
-    return ret
+
+    def _get(user_id):
+        ret = {}
+        if not user_id:
+            return {'Error': 'Unable to resolve user id'}
+        user = kstone.users.get(user_id)
+        ret[user.name] = {
+            'id': user.id,
+            'name': user.name,
+            'email': getattr(user, 'email', None),
+            'enabled': user.enabled,
+            'tenant_id': user.tenantId,
+        }
+        return ret
+    return _call_resolved(kstone, _get, ('users', name, id))
 
 
 def user_create(name, password, email, tenant_id=None, enabled=True):
@@ -483,6 +652,7 @@ def user_create(name, password, email, tenant_id=None, enabled=True):
         tenant_id=tenant_id,
         enabled=enabled,
     )
+    _index_add('users', item.name, item.id)
     return user_get(item.id)
 
 
@@ -497,18 +667,17 @@ def user_delete(id=None, name=None):  # pylint: disable-msg=C0103
         salt '*' keystone.user_delete name=nova
     '''
     kstone = auth()
-    if name:
-        for user in kstone.users.list():
-            if user.name == name:
-                id = user.id  # pylint: disable-msg=C0103
-                continue
-    if not id:
-        return {'Error': 'Unable to resolve user id'}
-    kstone.users.delete(id)
-    ret = 'User ID {0} deleted'.format(id)
-    if name:
-        ret += ' ({0})'.format(name)
-    return ret
+
+    def _delete(user_id):
+        if not user_id:
+            return {'Error': 'Unable to resolve user id'}
+        kstone.users.delete(user_id)
+        _index_remove('users', user_id)
+        ret = 'User ID {0} deleted'.format(user_id)
+        if name:
+            ret += ' ({0})'.format(name)
+        return ret
+    return _call_resolved(kstone, _delete, ('users', name, id))
 
 
 def user_update(id=None,        # pylint: disable-msg=C0103
@@ -529,6 +698,10 @@ def user_update(id=None,        # pylint: disable-msg=C0103
     if not id:
         return {'Error': 'Unable to resolve user id'}
     kstone.users.update(user=id, name=name, email=email, enabled=enabled)
+    if name:
+        # The user may have been renamed
+        _index_remove('users', id)
+        _index_add('users', name, id)
     ret = 'Info updated for user ID {0}'.format(id)
     return ret
 
@@ -546,18 +719,16 @@ def user_password_update(id=None,         # pylint: disable-msg=C0103
         salt '*' keystone.user_delete name=nova pasword=12345
     '''
     kstone = auth()
-    if name:
-        for user in kstone.users.list():
-            if user.name == name:
-                id = user.id  # pylint: disable-msg=C0103
-                continue
-    if not id:
-        return {'Error': 'Unable to resolve user id'}
-    kstone.users.update_password(user=id, password=password)
-    ret = 'Password updated for user ID {0}'.format(id)
-    if name:
-        ret += ' ({0})'.format(name)
-    return ret
+
+    def _update(user_id):
+        if not user_id:
+            return {'Error': 'Unable to resolve user id'}
+        kstone.users.update_password(user=user_id, password=password)
+        ret = 'Password updated for user ID {0}'.format(user_id)
+        if name:
+            ret += ' ({0})'.format(name)
+        return ret
+    return _call_resolved(kstone, _update, ('users', name, id))
 
 
 def user_role_list(user_id=None,
@@ -575,20 +746,11 @@ def user_role_list(user_id=None,
         salt '*' keystone.user_role_list user_name=admin tenant_name=admin
     '''
     kstone = auth()
-    ret = {}
-    if user_name:
-        for user in kstone.users.list():
-            if user.name == user_name:
-                user_id = user.id
-                continue
-    if tenant_name:
-        for tenant in kstone.tenants.list():
-            if tenant.name == tenant_name:
-                tenant_id = tenant.id
-                continue
-    if not user_id and not tenant_id:
-        return {'Error': 'Unable to resolve user or tenant id'}
-    try:
+
+    def _list(user_id, tenant_id):
+        ret = {}
+        if not user_id and not tenant_id:
+            return {'Error': 'Unable to resolve user or tenant id'}
         for role in kstone.roles.roles_for_user(user=user_id, tenant=tenant_id):
             ret[role.name] = {
                 'id': role.id,
@@ -596,6 +758,11 @@ def user_role_list(user_id=None,
                 'user_id': user_id,
                 'tenant_id': tenant_id,
             }
+        return ret
+    try:
+        return _call_resolved(kstone, _list,
+                              ('users', user_name, user_id),
+                              ('tenants', tenant_name, tenant_id))
     except NotFound:
         return {}
 
@@ -618,26 +785,16 @@ def user_role_add(user_id=None,
         salt '*' keystone.user_role_add user_name=admin role_name=admin tenant_name=admin
     '''
     kstone = auth()
-    ret = {}
-    if user_name:
-        for user in kstone.users.list():
-            if user.name == user_name:
-                user_id = user.id
-                continue
-    if role_name:
-        for role in kstone.roles.list():
-            if role.name == role_name:
-                role_id = role.id
-                continue
-    if tenant_name:
-        for tenant in kstone.tenants.list():
-            if tenant.name == tenant_name:
-                tenant_id = tenant.id
-                continue
-    if not user_id and not tenant_id and not role_id:
-        return {'Error': 'Unable to resolve user, role or tenant id'}
-    item = kstone.roles.add_user_role(user_id, role_id, tenant_id)
-    return user_role_list(user_id=user_id, tenant_id=tenant_id)
+
+    def _add(user_id, role_id, tenant_id):
+        if not user_id and not tenant_id and not role_id:
+            return {'Error': 'Unable to resolve user, role or tenant id'}
+        kstone.roles.add_user_role(user_id, role_id, tenant_id)
+        return user_role_list(user_id=user_id, tenant_id=tenant_id)
+    return _call_resolved(kstone, _add,
+                          ('users', user_name, user_id),
+                          ('roles', role_name, role_id),
+                          ('tenants', tenant_name, tenant_id))
 
 
 def user_role_remove(user_id=None,
@@ -658,34 +815,216 @@ def user_role_remove(user_id=None,
         salt '*' keystone.user_role_remove user_name=admin role_name=admin tenant_name=admin
     '''
     kstone = auth()
-    ret = {}
-    if user_name:
-        for user in kstone.users.list():
-            if user.name == user_name:
-                user_id = user.id
-                continue
-    if role_name:
-        for role in kstone.roles.list():
-            if role.name == role_name:
-                role_id = role.id
+
+    def _remove(user_id, role_id, tenant_id):
+        if not user_id and not tenant_id and not role_id:
+            return {'Error': 'Unable to resolve user, role or tenant id'}
+        kstone.roles.remove_user_role(user_id, role_id, tenant_id)
+        ret = 'User Role {0} '.format(role_id)
+        if role_name:
+            ret += '({0} '.format(role_name)
+        ret += 'deleted for User {0} '.format(user_id)
+        if user_name:
+            ret += '({0}) '.format(user_name)
+        ret += 'on {0}'.format(tenant_id)
+        if tenant_name:
+            ret += '({0}) '.format(tenant_name)
+        return ret
+    return _call_resolved(kstone, _remove,
+                          ('users', user_name, user_id),
+                          ('roles', role_name, role_id),
+                          ('tenants', tenant_name, tenant_id))
+
+
+def reconcile(tenants=None,
+              users=None,
+              roles=None,
+              user_roles=None,
+              prune=False,
+              workers=8,
+              test=False):
+    '''
+    Bring tenants, users, roles and user role assignments in line with the
+    passed desired state in one pass. Each collection is listed once, the
+    differences are computed locally and the resulting creates, updates and
+    deletes are issued concurrently by at most ``workers`` threads.
+
+    tenants
+        List of tenant names, or dict of tenant names to a dict with the
+        optional ``description`` and ``enabled`` keys
+    users
+        Dict of user names to a dict with the ``password``, ``email``,
+        ``tenant`` (name) and ``enabled`` keys
+    roles
+        List of role names
+    user_roles
+        List of dicts with the ``user``, ``role`` and ``tenant`` names
+    prune
+        Also delete tenants, users and roles which are not part of the
+        desired state, as well as the role assignments of the desired users
+        on the desired tenants which are not listed in ``user_roles``.
+        Collections which are not passed at all are never pruned.
+    test
+        Only report what would be changed
+
+    Returns a dict with the ``created``, ``updated`` and ``deleted`` items
+    per collection, and a list of ``errors``.
+
+    CLI Example::
+
+        salt '*' keystone.reconcile tenants='[admin, demo]' roles='[admin, Member]'
+    '''
+    kstone = auth()
+    ret = {'created': {}, 'updated': {}, 'deleted': {}, 'errors': []}
+
+    def _record(section, collection, results):
+        for job, error in results:
+            if error is None:
+                ret[section].setdefault(collection, []).append(job[0])
+            else:
+                ret['errors'].append(
+                    'Unable to reconcile {0} {1}: {2}'.format(
+                        collection, job[0], error))
+
+    def _apply(section, collection, func, jobs):
+        if test:
+            _record(section, collection, [(x, None) for x in jobs])
+        else:
+            _record(section, collection, _pool.run(func, jobs, workers))
+
+    if isinstance(tenants, (list, tuple)):
+        tenants = dict((x, {}) for x in tenants)
+
+    current = {}
+    for collection in ('tenants', 'users', 'roles'):
+        items = getattr(kstone, collection).list()
+        _index_store(collection, items)
+        current[collection] = dict((x.name, x) for x in items)
+
+    # Tenants and roles first, users and assignments refer to them
+    if tenants is not None:
+        _apply('created', 'tenants', lambda job: kstone.tenants.create(
+            tenant_name=job[0],
+            description=job[1].get('description'),
+            enabled=job[1].get('enabled', True),
+        ), [(x, y or {}) for x, y in sorted(tenants.items())
+            if x not in current['tenants']])
+    if roles is not None:
+        _apply('created', 'roles', lambda job: kstone.roles.create(
+            name=job[0],
+        ), [(x,) for x in sorted(roles) if x not in current['roles']])
+
+    if ret['created'] and not test:
+        for collection in ('tenants', 'roles'):
+            items = getattr(kstone, collection).list()
+            _index_store(collection, items)
+            current[collection] = dict((x.name, x) for x in items)
+
+    def _tenant_id(name):
+        if name in current['tenants']:
+            return current['tenants'][name].id
+        return None
+
+    if users is not None:
+        _apply('created', 'users', lambda job: kstone.users.create(
+            name=job[0],
+            password=job[1].get('password'),
+            email=job[1].get('email'),
+            tenant_id=_tenant_id(job[1].get('tenant')),
+            enabled=job[1].get('enabled', True),
+        ), [(x, y or {}) for x, y in sorted(users.items())
+            if x not in current['users']])
+
+        updates = []
+        for name, desired in sorted(users.items()):
+            user = current['users'].get(name)
+            if user is None:
                 continue
-    if tenant_name:
-        for tenant in kstone.tenants.list():
-            if tenant.name == tenant_name:
-                tenant_id = tenant.id
+            desired = desired or {}
+            if ('email' in desired
+                    and getattr(user, 'email', None) != desired['email']) or \
+                    ('enabled' in desired
+                     and user.enabled != desired['enabled']):
+                updates.append((name, user.id, desired))
+        _apply('updated', 'users', lambda job: kstone.users.update(
+            user=job[1],
+            name=job[0],
+            email=job[2].get('email'),
+            enabled=job[2].get('enabled'),
+        ), updates)
+
+        if ret['created'].get('users') and not test:
+            items = kstone.users.list()
+            _index_store('users', items)
+            current['users'] = dict((x.name, x) for x in items)
+
+    if user_roles is not None:
+        desired = set(
+            (x['user'], x['role'], x['tenant']) for x in user_roles
+        )
+        pairs = set((x[0], x[2]) for x in desired)
+        if prune and users is not None and tenants is not None:
+            pairs.update((x, y) for x in users for y in tenants)
+
+        # Only pairs whose user and tenant both exist can have assignments
+        lookups = [(x, y) for x, y in sorted(pairs)
+                   if x in current['users'] and y in current['tenants']]
+        assigned = {}
+
+        def _list_roles(job):
+            assigned[job] = set(
+                x.name for x in kstone.roles.roles_for_user(
+                    user=current['users'][job[0]].id,
+                    tenant=current['tenants'][job[1]].id,
+                )
+            )
+        failed = set()
+        for job, error in _pool.run(_list_roles, lookups, workers):
+            if error is not None:
+                # Without the current roles of the pair nothing can be
+                # added or pruned safely
+                failed.add(job)
+                ret['errors'].append(
+                    'Unable to list the roles of user {0} on tenant {1}: '
+                    '{2}'.format(job[0], job[1], error))
+        desired = set(x for x in desired if (x[0], x[2]) not in failed)
+
+        def _role_id(name):
+            if name in current['roles']:
+                return current['roles'][name].id
+            return None
+
+        existing = set(
+            (x[0], y, x[1]) for x, z in assigned.items() for y in z
+        )
+        _apply('created', 'user_roles', lambda job: kstone.roles.add_user_role(
+            current['users'][job[0][0]].id,
+            _role_id(job[0][1]),
+            current['tenants'][job[0][2]].id,
+        ), [(x,) for x in sorted(desired - existing)])
+        if prune:
+            _apply('deleted', 'user_roles',
+                   lambda job: kstone.roles.remove_user_role(
+                       current['users'][job[0][0]].id,
+                       _role_id(job[0][1]),
+                       current['tenants'][job[0][2]].id,
+                   ), [(x,) for x in sorted(existing - desired)])
+
+    if prune:
+        # Delete users before the tenants and roles they may refer to
+        for collection, wanted in (('users', users),
+                                   ('tenants', tenants),
+                                   ('roles', roles)):
+            if wanted is None:
                 continue
-    if not user_id and not tenant_id and not role_id:
-        return {'Error': 'Unable to resolve user, role or tenant id'}
-    kstone.roles.remove_user_role(user_id, role_id, tenant_id)
-    ret = 'User Role {0} '.format(role_id)
-    if role_name:
-        ret += '({0} '.format(role_name)
-    ret += 'deleted for User {0} '.format(user_id)
-    if user_name:
-        ret += '({0}) '.format(user_name)
-    ret += 'on {0}'.format(tenant_id)
-    if tenant_name:
-        ret += '({0}) '.format(tenant_name)
+            manager = getattr(kstone, collection)
+            _apply('deleted', collection,
+                   lambda job, manager=manager: manager.delete(job[1]),
+                   [(x, y.id) for x, y in sorted(current[collection].items())
+                    if x not in wanted])
+
+    if not test:
+        _index_invalidate()
     return ret
 
 
@@ -1,9 +1,37 @@
 # -*- coding: utf-8 -*-
 """
 Module to gather network configuration from Linux hosts
+
+Information is gathered by parsing the output of the ``ip`` command. Links,
+addresses and neighbours can instead be read directly from the kernel over a
+NETLINK_ROUTE socket, which is much faster on hosts with many interfaces or
+neighbours. The netlink backend returns the same structures, and falls back to
+``ip`` if the socket can not be used. It is enabled in the minion config::
+
+    netconfig.backend: netlink
+
+netconfig.all, and the per-interface functions called with ``cached=True``,
+answer from a snapshot of all links, addresses and neighbours which is taken
+once and reused for ``netconfig.snapshot_ttl`` seconds (5 by default)::
+
+    netconfig.snapshot_ttl: 5
 """
 
+import binascii
+import logging
 import re
+import socket
+import struct
+import time
+
+log = logging.getLogger(__name__)
+
+__func_alias__ = {
+    'all_': 'all'
+}
+
+# Seconds during which a snapshot taken by snapshot() is reused
+DEFAULT_SNAPSHOT_TTL = 5
 
 
 def __virtual__():
@@ -59,6 +87,7 @@ NEIGH_MATCHER = re.compile(r"""
       \ lladdr\ (?P<lladdr> [^ ]+)
     )?
     \           (?P<state> [A-Z]+)?
+    \ *
     $
     """, re.X | re.M)
 
@@ -191,18 +220,360 @@ def _structured_neigh_output(output):
     return res
 
 
-def links():
+# Netlink constants, see linux/netlink.h, linux/rtnetlink.h, linux/if_link.h,
+# linux/if_addr.h and linux/neighbour.h
+NETLINK_ROUTE = 0
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+RTM_NEWLINK = 16
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_GETADDR = 22
+RTM_NEWNEIGH = 28
+RTM_GETNEIGH = 30
+
+IFLA_ADDRESS = 1
+IFLA_BROADCAST = 2
+IFLA_IFNAME = 3
+IFLA_MTU = 4
+IFLA_LINK = 5
+IFLA_QDISC = 6
+IFLA_MASTER = 10
+IFLA_TXQLEN = 13
+IFLA_OPERSTATE = 16
+IFLA_LINKMODE = 17
+IFLA_GROUP = 27
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+IFA_BROADCAST = 4
+IFA_CACHEINFO = 6
+
+NDA_DST = 1
+NDA_LLADDR = 2
+
+NLMSG_HDR = struct.Struct('=IHHII')    # len, type, flags, seq, pid
+RTATTR_HDR = struct.Struct('=HH')      # len, type
+RTGENMSG = struct.Struct('=B3x')       # family
+IFINFOMSG = struct.Struct('=BxHiII')   # family, type, index, flags, change
+IFADDRMSG = struct.Struct('=BBBBI')    # family, prefixlen, flags, scope, index
+NDMSG = struct.Struct('=BxxxiHBB')     # family, ifindex, state, flags, type
+IFA_CACHEINFO_STRUCT = struct.Struct('=IIII')  # prefered, valid, cstamp, tstamp
+
+# Interface flags in the order "ip link" prints them
+IFF_RUNNING = 0x40
+IFF_UP = 0x1
+LINK_FLAGS = (
+    (0x8, 'LOOPBACK'),
+    (0x2, 'BROADCAST'),
+    (0x10, 'POINTOPOINT'),
+    (0x1000, 'MULTICAST'),
+    (0x80, 'NOARP'),
+    (0x200, 'ALLMULTI'),
+    (0x100, 'PROMISC'),
+    (0x400, 'MASTER'),
+    (0x800, 'SLAVE'),
+    (0x4, 'DEBUG'),
+    (0x8000, 'DYNAMIC'),
+    (0x4000, 'AUTOMEDIA'),
+    (0x2000, 'PORTSEL'),
+    (0x20, 'NOTRAILERS'),
+    (0x1, 'UP'),
+    (0x10000, 'LOWER_UP'),
+    (0x20000, 'DORMANT'),
+    (0x40000, 'ECHO'),
+)
+
+LINK_TYPES = {
+    1: 'ether',
+    24: 'ieee1394',
+    32: 'infiniband',
+    512: 'ppp',
+    768: 'ipip',
+    769: 'tunnel6',
+    772: 'loopback',
+    776: 'sit',
+    778: 'gre',
+    823: 'gre6',
+    65534: 'none',
+}
+
+OPERSTATES = ('UNKNOWN', 'NOTPRESENT', 'DOWN', 'LOWERLAYERDOWN',
+              'TESTING', 'DORMANT', 'UP')
+LINKMODES = ('DEFAULT', 'DORMANT')
+
+SCOPES = {0: 'global', 200: 'site', 253: 'link', 254: 'host', 255: 'nowhere'}
+
+NUD_STATES = (
+    (0x01, 'INCOMPLETE'),
+    (0x02, 'REACHABLE'),
+    (0x04, 'STALE'),
+    (0x08, 'DELAY'),
+    (0x10, 'PROBE'),
+    (0x20, 'FAILED'),
+    (0x40, 'NOARP'),
+    (0x80, 'PERMANENT'),
+)
+NUD_NOARP = 0x40
+# "ip neigh show" skips NOARP and NONE entries, "nud all" shows everything
+NUD_DEFAULT_FILTER = 0xFF & ~NUD_NOARP
+NUD_ALL_FILTER = 0x1FF
+
+
+def _use_netlink(backend):
+    """
+    PRIVATE METHOD
+    Tell whether the netlink backend should be used
+    """
+    if backend is None:
+        backend = __salt__['config.option']('netconfig.backend')
+    return backend == 'netlink' and hasattr(socket, 'AF_NETLINK')
+
+
+def _netlink_dump(msg_type):
+    """
+    PRIVATE METHOD
+    Send a NETLINK_ROUTE dump request and return the raw answer
+    """
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    try:
+        sock.bind((0, 0))
+        body = RTGENMSG.pack(socket.AF_UNSPEC)
+        seq = int(time.time())
+        sock.send(NLMSG_HDR.pack(NLMSG_HDR.size + len(body), msg_type,
+                                 NLM_F_REQUEST | NLM_F_DUMP, seq, 0) + body)
+        chunks = []
+        while True:
+            data = sock.recv(1 << 20)
+            chunks.append(data)
+            done = False
+            for nl_type, _ in _netlink_messages(data):
+                if nl_type == NLMSG_DONE:
+                    done = True
+                elif nl_type == NLMSG_ERROR:
+                    raise socket.error('netlink dump {0} failed'.format(msg_type))
+            if done:
+                return b''.join(chunks)
+    finally:
+        sock.close()
+
+
+def _netlink_messages(data):
+    """
+    PRIVATE METHOD
+    Iterate over the (type, payload) of the netlink messages in a buffer
+    """
+    offset = 0
+    end = len(data)
+    while offset + NLMSG_HDR.size <= end:
+        length, nl_type = NLMSG_HDR.unpack_from(data, offset)[:2]
+        if length < NLMSG_HDR.size or offset + length > end:
+            break
+        yield nl_type, data[offset + NLMSG_HDR.size:offset + length]
+        offset += (length + 3) & ~3
+
+
+def _netlink_attrs(data, offset):
+    """
+    PRIVATE METHOD
+    Return a dictionary mapping attribute types to their raw payload
+    """
+    attrs = {}
+    end = len(data)
+    while offset + RTATTR_HDR.size <= end:
+        length, attr_type = RTATTR_HDR.unpack_from(data, offset)
+        # A truncated attribute ends the list rather than yielding a short value
+        if length < RTATTR_HDR.size or offset + length > end:
+            break
+        attrs[attr_type & 0x3fff] = data[offset + RTATTR_HDR.size:offset + length]
+        offset += (length + 3) & ~3
+    return attrs
+
+
+def _nl_string(value):
+    return value.split(b'\0', 1)[0].decode('utf-8', 'replace')
+
+
+def _nl_uint(value):
+    return struct.unpack('=I', value[:4])[0]
+
+
+_MAC = struct.Struct('6B')
+
+
+def _nl_lladdr(value):
+    if len(value) == 6:
+        return '%02x:%02x:%02x:%02x:%02x:%02x' % _MAC.unpack(value)
+    hexed = binascii.hexlify(value).decode('ascii')
+    return ':'.join([hexed[x:x + 2] for x in range(0, len(hexed), 2)])
+
+
+def _netlink_links(data):
+    """
+    PRIVATE METHOD
+    Turns a RTM_GETLINK dump into the structure returned by links(), and a
+    dictionary mapping interface indexes to names
+    """
+    parsed = []
+    names = {}
+    for nl_type, payload in _netlink_messages(data):
+        if nl_type != RTM_NEWLINK:
+            continue
+        link_type, index, flags = IFINFOMSG.unpack_from(payload)[1:4]
+        attrs = _netlink_attrs(payload, IFINFOMSG.size)
+        if IFLA_IFNAME not in attrs:
+            continue
+        names[index] = _nl_string(attrs[IFLA_IFNAME])
+        parsed.append((index, link_type, flags, attrs))
+
+    res = {}
+    for index, link_type, flags, attrs in parsed:
+        # Same restriction as LINK_MATCHER, which needs both addresses
+        if IFLA_ADDRESS not in attrs or IFLA_BROADCAST not in attrs:
+            continue
+        name = names[index]
+        if IFLA_LINK in attrs:
+            parent = _nl_uint(attrs[IFLA_LINK])
+            if parent and parent != index:
+                name += '@' + names.get(parent, 'if{0}'.format(parent))
+
+        flag_names = [y for x, y in LINK_FLAGS if flags & x]
+        if flags & IFF_UP and not flags & IFF_RUNNING:
+            flag_names.insert(0, 'NO-CARRIER')
+
+        settings = {}
+        if IFLA_MTU in attrs:
+            settings['mtu'] = _nl_uint(attrs[IFLA_MTU])
+        if IFLA_QDISC in attrs:
+            settings['qdisc'] = _nl_string(attrs[IFLA_QDISC])
+        if IFLA_MASTER in attrs:
+            master = _nl_uint(attrs[IFLA_MASTER])
+            settings['master'] = names.get(master, master)
+        if IFLA_OPERSTATE in attrs:
+            state = bytearray(attrs[IFLA_OPERSTATE])[0]
+            settings['state'] = OPERSTATES[state] if state < len(OPERSTATES) else state
+        if IFLA_LINKMODE in attrs:
+            mode = bytearray(attrs[IFLA_LINKMODE])[0]
+            settings['mode'] = LINKMODES[mode] if mode < len(LINKMODES) else mode
+        if IFLA_GROUP in attrs:
+            group = _nl_uint(attrs[IFLA_GROUP])
+            settings['group'] = group if group else 'default'
+        if IFLA_TXQLEN in attrs and _nl_uint(attrs[IFLA_TXQLEN]):
+            settings['qlen'] = _nl_uint(attrs[IFLA_TXQLEN])
+
+        infos = {
+            'num':   index,
+            'flags': flag_names,
+            'link':  LINK_TYPES.get(link_type, '[{0}]'.format(link_type)),
+            'addr':  _nl_lladdr(attrs[IFLA_ADDRESS]),
+            'brd':   _nl_lladdr(attrs[IFLA_BROADCAST])}
+        if settings:
+            infos['settings'] = settings
+        res[name] = infos
+
+    return res, names
+
+
+def _lifetime(seconds):
+    return 'forever' if seconds == 0xFFFFFFFF else '{0}sec'.format(seconds)
+
+
+def _netlink_addresses(data, names):
+    """
+    PRIVATE METHOD
+    Turns a RTM_GETADDR dump into the structure returned by addresses()
+    """
+    res = {}
+    for nl_type, payload in _netlink_messages(data):
+        if nl_type != RTM_NEWADDR:
+            continue
+        family, prefixlen, _, scope, index = IFADDRMSG.unpack_from(payload)
+        if family not in (socket.AF_INET, socket.AF_INET6):
+            continue
+        attrs = _netlink_attrs(payload, IFADDRMSG.size)
+        address = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+        if address is None:
+            continue
+
+        infos = {
+            'addr':  '{0}/{1}'.format(socket.inet_ntop(family, address), prefixlen),
+            'type':  'inet' if family == socket.AF_INET else 'inet6',
+            'scope': SCOPES.get(scope, scope),
+        }
+        if IFA_BROADCAST in attrs:
+            infos['brd'] = socket.inet_ntop(family, attrs[IFA_BROADCAST])
+        if family == socket.AF_INET and IFA_LABEL in attrs:
+            infos['alias'] = _nl_string(attrs[IFA_LABEL])
+        if IFA_CACHEINFO in attrs:
+            preferred, valid = IFA_CACHEINFO_STRUCT.unpack_from(attrs[IFA_CACHEINFO])[:2]
+            infos['settings'] = {'valid_lft': _lifetime(valid),
+                                 'preferred_lft': _lifetime(preferred)}
+
+        res.setdefault(names.get(index, 'if{0}'.format(index)), []).append(infos)
+
+    return res
+
+
+def _netlink_neighbours(data, names, nud_filter=NUD_DEFAULT_FILTER):
+    """
+    PRIVATE METHOD
+    Turns a RTM_GETNEIGH dump into the structure returned by neighbours()
+    """
+    res = {}
+    state_names = {}
+    families = (socket.AF_INET, socket.AF_INET6)
+    for nl_type, payload in _netlink_messages(data):
+        if nl_type != RTM_NEWNEIGH:
+            continue
+        family, index, state = NDMSG.unpack_from(payload)[:3]
+        if not (state & nud_filter or (not state and nud_filter & 0x100)):
+            continue
+        attrs = _netlink_attrs(payload, NDMSG.size)
+        if NDA_DST not in attrs or family not in families:
+            continue
+
+        if state not in state_names:
+            state_names[state] = ' '.join([y for x, y in NUD_STATES if state & x]) or 'NONE'
+        infos = {'state': state_names[state]}
+        if NDA_LLADDR in attrs:
+            infos['lladdr'] = _nl_lladdr(attrs[NDA_LLADDR])
+        if index not in names:
+            names[index] = 'if{0}'.format(index)
+        res[(socket.inet_ntop(family, attrs[NDA_DST]), names[index])] = infos
+
+    return res
+
+
+def _netlink_names():
+    """
+    PRIVATE METHOD
+    Return a dictionary mapping interface indexes to names
+    """
+    return _netlink_links(_netlink_dump(RTM_GETLINK))[1]
+
+
+def links(backend=None):
     """
     Return information about all network links on the system
     """
+    if _use_netlink(backend):
+        try:
+            return _netlink_links(_netlink_dump(RTM_GETLINK))[0]
+        except (socket.error, OSError) as exc:
+            log.debug('netlink backend failed, falling back to ip: {0}'.format(exc))
     output = __salt__['cmd.run']('ip -o link show')
     return _structured_links_output(output)
 
 
-def link(name):
+def link(name, cached=False):
     """
     Return information about a given network link on the system
     """
+    if cached:
+        return snapshot()['by_name'].get(name, {}).get('link')
     output = __salt__['cmd.run']('ip -o link show {0}'.format(name))
     match = LINK_MATCHER.match(output)
     if match:
@@ -218,17 +589,24 @@ def addresses_with_options(options):
     return _structured_addresses_output(output)
 
 
-def addresses():
+def addresses(backend=None):
     """
     Return information about addresses for all network links on the system
     """
+    if _use_netlink(backend):
+        try:
+            return _netlink_addresses(_netlink_dump(RTM_GETADDR), _netlink_names())
+        except (socket.error, OSError) as exc:
+            log.debug('netlink backend failed, falling back to ip: {0}'.format(exc))
     return addresses_with_options('')
 
 
-def addresses_for(name):
+def addresses_for(name, cached=False):
     """
     Return information about addresses for a given network link on the system
     """
+    if cached:
+        return snapshot()['by_name'].get(name, {}).get('addresses')
     parsed = addresses_with_options('dev {0}'.format(name))
     if parsed.has_key(name):
         return parsed[name]
@@ -243,26 +621,171 @@ def neighbours_with_options(options):
     return _structured_neigh_output(output)
 
 
-def neighbours():
+def neighbours(backend=None):
     """
     Return information about all known neighbours
     """
+    if _use_netlink(backend):
+        try:
+            return _netlink_neighbours(_netlink_dump(RTM_GETNEIGH), _netlink_names())
+        except (socket.error, OSError) as exc:
+            log.debug('netlink backend failed, falling back to ip: {0}'.format(exc))
     return neighbours_with_options('')
 
 
-def neighbours_for(name):
+def neighbours_for(name, cached=False):
     """
     Return information about neighbours for a given network link on the system
     """
+    if cached:
+        return snapshot()['by_name'].get(name, {}).get('neighbours', {})
     return neighbours_with_options('dev {0}'.format(name))
 
 
-def all_neighbours():
+def all_neighbours(backend=None):
     """
     Return information about all attempted neighboors, including failed ones
     """
+    if _use_netlink(backend):
+        try:
+            return _netlink_neighbours(_netlink_dump(RTM_GETNEIGH), _netlink_names(),
+                                       NUD_ALL_FILTER)
+        except (socket.error, OSError) as exc:
+            log.debug('netlink backend failed, falling back to ip: {0}'.format(exc))
     return neighbours_with_options('nud all')
 
+
+def _snapshot_data(backend):
+    """
+    PRIVATE METHOD
+    Gather all links, addresses and neighbours, with a single dump or ip run
+    for each of them
+    """
+    if _use_netlink(backend):
+        try:
+            all_links, names = _netlink_links(_netlink_dump(RTM_GETLINK))
+            return (all_links,
+                    _netlink_addresses(_netlink_dump(RTM_GETADDR), names),
+                    _netlink_neighbours(_netlink_dump(RTM_GETNEIGH), names))
+        except (socket.error, OSError) as exc:
+            log.debug('netlink backend failed, falling back to ip: {0}'.format(exc))
+    return (links(backend='ip'),
+            addresses(backend='ip'),
+            neighbours(backend='ip'))
+
+
+def snapshot(ttl=None, backend=None):
+    """
+    Return all links, addresses and neighbours of the system, along with a
+    per-interface index of them under the ``by_name`` key. The snapshot is
+    kept for ttl seconds, which defaults to the netconfig.snapshot_ttl option,
+    and reused by later calls and by the per-interface functions called with
+    cached=True
+    """
+    if ttl is None:
+        ttl = __salt__['config.option']('netconfig.snapshot_ttl')
+        if ttl is None or ttl == '':
+            ttl = DEFAULT_SNAPSHOT_TTL
+    cached = __context__.get('netconfig.snapshot')
+    if cached and time.time() - cached[0] <= float(ttl):
+        return cached[1]
+
+    all_links, all_addresses, all_neighbours = _snapshot_data(backend)
+    by_name = {}
+    for name, infos in all_links.items():
+        # Stacked links are named after their parent, eg "eth0.10@eth0"
+        by_name.setdefault(name.split('@', 1)[0], {})['link'] = (name, infos)
+    for name, infos in all_addresses.items():
+        by_name.setdefault(name, {})['addresses'] = infos
+    for identifier, infos in all_neighbours.items():
+        by_name.setdefault(identifier[1], {}).setdefault('neighbours', {})[identifier] = infos
+
+    data = {'links': all_links,
+            'addresses': all_addresses,
+            'neighbours': all_neighbours,
+            'by_name': by_name}
+    __context__['netconfig.snapshot'] = (time.time(), data)
+    return data
+
+
+def all_(name=None, ttl=None):
+    """
+    Return the link, addresses and neighbours of every network link on the
+    system, or of the named one, from a single snapshot
+    eg netconfig.all eth0.10
+    """
+    by_name = snapshot(ttl)['by_name']
+    if name is not None:
+        return by_name.get(name)
+    return by_name
+
+
+def _nl_pack_attr(attr_type, value):
+    """
+    PRIVATE METHOD
+    Pack a netlink attribute, used to build synthetic dumps
+    """
+    length = RTATTR_HDR.size + len(value)
+    return RTATTR_HDR.pack(length, attr_type) + value + b'\0' * (-length % 4)
+
+
+def _nl_pack_msg(nl_type, body):
+    """
+    PRIVATE METHOD
+    Pack a netlink message, used to build synthetic dumps
+    """
+    return NLMSG_HDR.pack(NLMSG_HDR.size + len(body), nl_type, 0, 0, 0) + body
+
+
+def benchmark(neighbour_count=10000, iterations=3):
+    """
+    Compare the ip output parser and the netlink backend, eg
+    netconfig.benchmark 10000
+
+    ``parse`` holds the best time taken by each parser, in seconds, to parse
+    the same synthetic dump of the given number of neighbours. ``live`` holds
+    the best time taken by each backend to return the actual neighbours of
+    this host, including running ip or querying the kernel.
+    """
+    neighbour_count = int(neighbour_count)
+    names = {2: 'eth0'}
+    lines = []
+    messages = []
+    for num in range(neighbour_count):
+        addr = struct.pack('!I', 0x0a000000 + num)
+        lladdr = struct.pack('!HI', 0x5254, num)
+        lines.append('{0} dev eth0 lladdr {1} REACHABLE'.format(
+            socket.inet_ntop(socket.AF_INET, addr), _nl_lladdr(lladdr)))
+        messages.append(_nl_pack_msg(RTM_NEWNEIGH, NDMSG.pack(socket.AF_INET, 2, 0x02, 0, 1) +
+                                     _nl_pack_attr(NDA_DST, addr) +
+                                     _nl_pack_attr(NDA_LLADDR, lladdr)))
+    output = '\n'.join(lines)
+    data = b''.join(messages)
+
+    def _best(func, *args):
+        timings = []
+        for _ in range(int(iterations)):
+            start = time.time()
+            result = func(*args)
+            timings.append(time.time() - start)
+        return min(timings), result
+
+    ip_time, ip_result = _best(_structured_neigh_output, output)
+    netlink_time, netlink_result = _best(_netlink_neighbours, data, names)
+    ret = {'neighbours': neighbour_count,
+           'parse': {'ip': ip_time,
+                     'netlink': netlink_time,
+                     'match': ip_result == netlink_result}}
+
+    if hasattr(socket, 'AF_NETLINK'):
+        ip_time, ip_result = _best(neighbours_with_options, '')
+        netlink_time, netlink_result = _best(
+            lambda: _netlink_neighbours(_netlink_dump(RTM_GETNEIGH), _netlink_names()))
+        ret['live'] = {'ip': ip_time,
+                       'netlink': netlink_time,
+                       'neighbours': len(netlink_result)}
+    return ret
+
 # TODO: brctl show
 # TODO: ip maddr show
 # TODO: ifenslave -a (not sure how parseable this is)
@@ -1,9 +1,37 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import absolute_import
-from salt.ext.six.moves import range
+import time
+from array import array
+from salt.ext import six
+from salt.ext.six.moves import range, zip
 __virtualname__ = 'netconfig'
 
+NETSTAT_FILES = ('/proc/net/netstat', '/proc/net/snmp')
+
+# Counters are kept as unsigned 64 bits integers, the few signed values
+# (eg Tcp.MaxConn = -1) are stored in two's complement
+_UNSIGNED = 1 << 64
+_SIGNED_MAX = 1 << 63
+_WRAP_32 = 1 << 32
+try:
+    _TYPECODE = array('Q').typecode
+except ValueError:
+    # Python 2 has no 'Q', its 'L' is 64 bits wide on 64 bits Linux
+    _TYPECODE = 'L'
+
+# Values of /proc/net/snmp which are not counters: they go down as well as
+# up, so a decrease is neither a wrap nor a reset
+_GAUGES = frozenset((
+    'Ip.Forwarding', 'Ip.DefaultTTL',
+    'Tcp.RtoAlgorithm', 'Tcp.RtoMin', 'Tcp.RtoMax', 'Tcp.MaxConn', 'Tcp.CurrEstab',
+))
+
+# (header line, wanted headers) -> list of (position, "Prefix.Header")
+_HEADER_INDEX = {}
+# counters filter -> (timestamp, names, array of values)
+_SAMPLES = {}
+
 
 def __virtual__():
     """
@@ -12,26 +40,173 @@ def __virtual__():
     return 'netstat' if __grains__['kernel'] == 'Linux' else False
 
 
-def s():
+def _counter_filter(counters):
+    """
+    PRIVATE METHOD
+    Turns a list of "Prefix" or "Prefix.Header" strings into a dictionary
+    mapping prefixes to the set of wanted headers, or None for all of them
+    """
+    if not counters:
+        return None
+    if isinstance(counters, six.string_types):
+        counters = counters.split(',')
+    wanted = {}
+    for counter in counters:
+        prefix, _, header = counter.strip().partition('.')
+        if not header:
+            wanted[prefix] = None
+        elif wanted.get(prefix, set()) is not None:
+            wanted.setdefault(prefix, set()).add(header)
+    return wanted
+
+
+def _header_index(header_line, wanted):
+    """
+    PRIVATE METHOD
+    Return the positions and names of the wanted counters of a header line
+    """
+    key = (header_line, wanted and frozenset(wanted))
+    if key not in _HEADER_INDEX:
+        prefix, _, headers = header_line.partition(': ')
+        _HEADER_INDEX[key] = [
+            (pos, '{0}.{1}'.format(prefix, header))
+            for pos, header in enumerate(headers.split())
+            if wanted is None or header in wanted
+        ]
+    return _HEADER_INDEX[key]
+
+
+def _read_counters(wanted=None):
+    """
+    PRIVATE METHOD
+    Return a tuple of "Prefix.Header" names and an array of their values.
+    Only the lines of the wanted prefixes are split and converted.
+    """
+    names = []
+    values = array(_TYPECODE)
+    for path in NETSTAT_FILES:
+        with open(path) as handle:
+            lines = handle.read().splitlines()
+        for pos in range(0, len(lines) - 1, 2):
+            header_line = lines[pos]
+            prefix = header_line.partition(':')[0]
+            if wanted is not None and prefix not in wanted:
+                continue
+            index = _header_index(header_line, wanted and wanted[prefix])
+            if not index:
+                continue
+            items = lines[pos + 1].partition(': ')[2].split()
+            for item_pos, name in index:
+                names.append(name)
+                values.append(int(items[item_pos]) % _UNSIGNED)
+    return tuple(names), values
+
+
+def _nested(names, values):
+    """
+    PRIVATE METHOD
+    Turns "Prefix.Header" names and their values into nested dictionaries
+    """
+    res = {}
+    for name, value in zip(names, values):
+        prefix, header = name.split('.', 1)
+        res.setdefault(prefix, {})[header] = value
+    return res
+
+
+def s(counters=None):
     """
     Return the statistics available in netstat -s.
     The netstat command is not needed: we use kernel-provided files directly.
+
+    counters
+        Only return these counters, given as a list or a comma-separated
+        string of "Prefix" (eg Tcp) or "Prefix.Header" (eg TcpExt.ListenOverflows)
+    """
+    names, values = _read_counters(_counter_filter(counters))
+    return _nested(names, [_signed(x) for x in values])
+
+
+def _signed(value):
+    """
+    PRIVATE METHOD
+    Turns a stored value back into the signed integer the kernel printed
+    """
+    return int(value - _UNSIGNED) if value >= _SIGNED_MAX else int(value)
+
+
+def _delta(name, old, new):
+    """
+    PRIVATE METHOD
+    Return the change of a value between two samples
+    """
+    if name in _GAUGES:
+        return _signed(new) - _signed(old)
+    if new >= old:
+        return new - old
+    # A 32 bits counter close to its maximum wrapped around, any other
+    # counter going down was reset (eg. by reloading its kernel module)
+    if _WRAP_32 // 2 <= old < _WRAP_32:
+        return new + _WRAP_32 - old
+    return new
+
+
+def rates(counters=None, interval=None):
+    """
+    Return the per second rate of change of the netstat -s counters.
+
+    Without interval, the rates are computed against the previous sample of
+    the same counters taken by this minion process, and an empty dictionary is
+    returned on the first call. With interval, two samples are taken interval
+    seconds apart.
+
+    counters
+        Only sample these counters, given as a list or a comma-separated
+        string of "Prefix" (eg Tcp) or "Prefix.Header" (eg Tcp.RetransSegs)
+    """
+    wanted = _counter_filter(counters)
+    key = wanted and tuple(sorted((x, y and tuple(sorted(y))) for x, y in wanted.items()))
+
+    names, values = _read_counters(wanted)
+    now = time.time()
+    if interval:
+        previous = (now, names, values)
+        time.sleep(float(interval))
+        names, values = _read_counters(wanted)
+        now = time.time()
+    else:
+        previous = _SAMPLES.get(key)
+    _SAMPLES[key] = (now, names, values)
+
+    # The set of counters changes when e.g. a kernel module is loaded
+    if previous is None or previous[1] != names or now <= previous[0]:
+        return {}
+
+    elapsed = now - previous[0]
+    deltas = [_delta(name, old, new) / elapsed
+              for name, old, new in zip(names, previous[2], values)]
+    return _nested(names, deltas)
+
+
+def benchmark(iterations=100, counters='Tcp.RetransSegs,TcpExt.ListenOverflows'):
+    """
+    Return the average cost in microseconds of one call of s() and of one
+    sample taken by rates() with the given counter filter, eg to evaluate the
+    overhead of sampling at 1 Hz. The previous samples of rates() are left
+    as they were.
     """
-    stats = {}
-    lines = open('/proc/net/netstat').readlines() + \
-        open('/proc/net/snmp').readlines()
-
-    currently_in_header_line = True
-    for line in lines:
-        sections = line.split(': ')
-        prefix, list = sections[0], sections[1].strip()
-        stats.setdefault(prefix, {})
-        items = list.split(' ')
-        if currently_in_header_line:
-            headers = items
-        else:
-            for pos in range(len(headers)):
-                stats[prefix][headers[pos]] = int(items[pos])
-        currently_in_header_line = not currently_in_header_line
-
-    return stats
+    iterations = int(iterations)
+    ret = {}
+    saved = dict(_SAMPLES)
+    try:
+        for name, func, args in (('s', s, ()),
+                                 ('rates', rates, (counters,)),
+                                 ('rates_unfiltered', rates, ())):
+            start = time.time()
+            for _ in range(iterations):
+                func(*args)
+            ret[name] = (time.time() - start) / iterations * 1e6
+    finally:
+        _SAMPLES.clear()
+        _SAMPLES.update(saved)
+    return ret
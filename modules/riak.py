@@ -1,16 +1,39 @@
 # -*- coding: utf-8 -*-
 '''
 Support for riak
+
+The output of ``riak ping`` and of the read-only ``riak-admin`` commands is
+kept in ``__context__``, so that several checks within one run (eg. a state
+calling ``riak.is_up`` then ``riak.member_status``) start the Erlang VM only
+once. Every command changing the node or the cluster clears it.
+
+When the Riak HTTP interface is enabled, ``riak.is_up`` and ``riak.status``
+can use it instead of starting ``riak``/``riak-admin``::
+
+    riak.http_url: 'http://127.0.0.1:8098'
+    riak.http_timeout: 2
 '''
 from __future__ import absolute_import
 
+import json
+import logging
+import re
+import threading
+
 import salt.utils
+from salt.ext.six.moves.urllib.error import URLError  # pylint: disable=import-error,no-name-in-module
+from salt.ext.six.moves.urllib.request import urlopen  # pylint: disable=import-error,no-name-in-module
 
+log = logging.getLogger(__name__)
 
 __outputter__ = {
     'signal': 'txt',
 }
 
+_NUMBER = re.compile(r'^-?\d+(\.\d+)?([eE][-+]?\d+)?$')
+_BINARY = re.compile(r'^<<"(.*)">>$')
+_NODE_COUNT = re.compile(r"^'?([^'\s]+)'? (waiting to handoff|does not have) (\d+)")
+
 
 def __virtual__():
     '''
@@ -22,6 +45,188 @@ def __virtual__():
     return False
 
 
+def _run(cmd):
+    '''
+    Run a riak command, without the warnings and the "Attempting to restart"
+    lines the script prints before the actual output
+    '''
+    out = __salt__['cmd.run'](cmd).split('\n')
+    msgs = [line for line in out if not line.startswith("!!!!")]
+    if msgs and msgs[0].startswith("Attempting"):
+        del msgs[0]
+    return msgs
+
+
+def _cached(cmd, refresh=False):
+    '''
+    Return the output lines of a read-only command, run once per
+    ``__context__``
+    '''
+    outputs = __context__.setdefault('riak.output', {})
+    if refresh or cmd not in outputs:
+        outputs[cmd] = _run(cmd)
+    return outputs[cmd]
+
+
+def _clear_context():
+    '''
+    Forget the cached outputs, after a command changing the node or cluster
+    '''
+    for key in ('riak.output', 'riak.stats'):
+        __context__.pop(key, None)
+
+
+def _http_get(path):
+    '''
+    GET a path of the Riak HTTP interface, return the body or None when it
+    is not configured or not answering
+    '''
+    url = __salt__['config.option']('riak.http_url')
+    if not url:
+        return None
+    timeout = float(__salt__['config.option']('riak.http_timeout') or 2)
+    try:
+        handle = urlopen('{0}/{1}'.format(url.rstrip('/'), path), timeout=timeout)
+        try:
+            return handle.read().decode('utf-8')
+        finally:
+            handle.close()
+    except (URLError, IOError, ValueError) as exc:
+        log.debug('Riak HTTP interface at %s not usable: %s', url, exc)
+        return None
+
+
+def _parse_value(value):
+    '''
+    Turn an Erlang term printed by riak-admin into a Python value: numbers,
+    booleans, binaries and flat lists are converted, anything else is
+    returned as a string
+    '''
+    value = value.strip()
+    if _NUMBER.match(value):
+        return float(value) if '.' in value or 'e' in value.lower() else int(value)
+    if value in ('true', 'false'):
+        return value == 'true'
+    if value == 'undefined':
+        return None
+    match = _BINARY.match(value)
+    if match:
+        return match.group(1)
+    if value.startswith('[') and value.endswith(']'):
+        inner = value[1:-1].strip()
+        if not inner:
+            return []
+        if not any(char in inner for char in '[]{}<>"'):
+            return [_parse_value(item.strip().strip("'")) for item in inner.split(',')]
+    return value
+
+
+def _parse_status(lines):
+    '''
+    Parse the "name : value" lines of riak-admin status
+    '''
+    ret = {}
+    for line in lines:
+        parts = line.split(" : ", 1)
+        if len(parts) == 2:
+            ret[parts[0].strip()] = _parse_value(parts[1])
+    return ret
+
+
+def _parse_percent(value):
+    if value.endswith('%'):
+        return float(value[:-1])
+    return None
+
+
+def _parse_member_status(lines):
+    '''
+    Parse riak-admin member-status into the list of members and the count of
+    members in every state
+    '''
+    ret = {'members': [], 'summary': {}}
+    for line in lines:
+        fields = line.split()
+        if len(fields) == 4 and fields[1].endswith('%'):
+            ret['members'].append({'status': fields[0],
+                                   'ring': _parse_percent(fields[1]),
+                                   'pending': _parse_percent(fields[2]),
+                                   'node': fields[3].strip("'")})
+        elif ' / ' in line:
+            for item in line.split(' / '):
+                name, _, count = item.partition(':')
+                if count.strip().isdigit():
+                    ret['summary'][name.strip().lower()] = int(count)
+    return ret
+
+
+def _parse_ring_status(lines):
+    '''
+    Parse riak-admin ring-status into the claimant, its status, whether the
+    ring is ready, the pending ownership handoffs and the unreachable nodes
+    '''
+    ret = {'claimant': None, 'status': None, 'ringready': None,
+           'handoffs': [], 'unreachable': []}
+    section = None
+    handoff = None
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith('=='):
+            section = stripped.strip('= ').lower()
+            continue
+        if not stripped or stripped.startswith('--'):
+            continue
+        key, _, value = stripped.partition(':')
+        value = value.strip()
+        if section == 'claimant':
+            if key == 'Claimant':
+                ret['claimant'] = value.strip("'")
+            elif key == 'Status':
+                ret['status'] = value
+            elif key == 'Ring Ready':
+                ret['ringready'] = _parse_value(value)
+        elif section == 'ownership handoff':
+            if key == 'Owner':
+                handoff = {'owner': value, 'next_owner': None, 'partitions': []}
+                ret['handoffs'].append(handoff)
+            elif key == 'Next Owner' and handoff is not None:
+                handoff['next_owner'] = value
+            elif key == 'Index' and handoff is not None:
+                handoff['partitions'].append({'index': _parse_value(value)})
+            elif key in ('Waiting on', 'Complete') and handoff and handoff['partitions']:
+                handoff['partitions'][-1][key.lower().replace(' ', '_')] = _parse_value(value)
+        elif section == 'unreachable nodes' and stripped.startswith('The following'):
+            ret['unreachable'] = _parse_value(value)
+    return ret
+
+
+def _parse_transfers(lines):
+    '''
+    Parse riak-admin transfers into the partitions every node is waiting to
+    hand off, the primary partitions missing on every node and the active
+    transfers
+    '''
+    ret = {'waiting_to_handoff': {}, 'missing_primaries': {}, 'active': []}
+    active = None
+    for line in lines:
+        stripped = line.strip()
+        match = _NODE_COUNT.match(stripped)
+        if match:
+            key = 'waiting_to_handoff' if match.group(2).startswith('waiting') else 'missing_primaries'
+            ret[key][match.group(1)] = int(match.group(3))
+        elif stripped.startswith('Active Transfers'):
+            active = {}
+        elif active is not None and ': ' in stripped:
+            key, _, value = stripped.partition(': ')
+            if key in active:
+                ret['active'].append(active)
+                active = {}
+            active[key.strip()] = _parse_value(value)
+    if active:
+        ret['active'].append(active)
+    return ret
+
+
 def version():
     '''
     Return Riak node version
@@ -30,12 +235,7 @@ def version():
 
         salt '*' riak.version
     '''
-    cmd = 'riak version'
-    out = __salt__['cmd.run'](cmd).split('\n')
-    msgs = [line for line in out if not line.startswith("!!!!")]
-    if msgs and msgs[0].startswith("Attempting"):
-        del msgs[0]
-    return msgs[0]
+    return _cached('riak version')[0]
 
 
 def ping():
@@ -45,17 +245,22 @@ def ping():
         return ""
 
 
-def is_up():
+def is_up(refresh=False):
     '''
-    Ping a Riak node to check its status
+    Ping a Riak node to check its status. The result is kept for the rest of
+    the run, unless refresh is True.
 
     CLI Example::
 
         salt '*' riak.is_up
     '''
-    cmd = 'riak ping'
-    out = __salt__['cmd.run'](cmd).split('\n')
-    if out[-1] == "pong":
+    if not refresh and 'riak ping' in __context__.get('riak.output', {}):
+        return _cached('riak ping')[-1:] == ["pong"]
+    if _http_get('ping') == 'OK':
+        __context__.setdefault('riak.output', {})['riak ping'] = ["pong"]
+        return True
+    out = _cached('riak ping', refresh=True)
+    if out[-1:] == ["pong"]:
         return True
     else:
         return False
@@ -69,11 +274,8 @@ def start():
 
         salt '*' riak.start
     '''
-    cmd = 'riak start'
-    out = __salt__['cmd.run'](cmd).split('\n')
-    msgs = [line for line in out if not line.startswith("!!!!")]
-    if msgs and msgs[0].startswith("Attempting"):
-        del msgs[0]
+    _clear_context()
+    msgs = _run('riak start')
     if not msgs or msgs[0] == "Node is already running!":
         return True
     else:
@@ -89,11 +291,8 @@ def stop():
 
         salt '*' riak.stop
     '''
-    cmd = 'riak stop'
-    out = __salt__['cmd.run'](cmd).split('\n')
-    msgs = [line for line in out if not line.startswith("!!!!")]
-    if msgs and msgs[0].startswith("Attempting"):
-        del msgs[0]
+    _clear_context()
+    msgs = _run('riak stop')
     if msgs[0] in ("ok", "Node is not running!"):
         return True
     else:
@@ -109,11 +308,8 @@ def restart():
 
         salt '*' riak.restart
     '''
-    cmd = 'riak restart'
-    out = __salt__['cmd.run'](cmd).split('\n')
-    msgs = [line for line in out if not line.startswith("!!!!")]
-    if msgs and msgs[0].startswith("Attempting"):
-        del msgs[0]
+    _clear_context()
+    msgs = _run('riak restart')
     if msgs[0] == "ok":
         return True
     else:
@@ -133,11 +329,8 @@ def cluster_join(node):
     '''
     if len(node.split("@")) != 2:
         return False
-    cmd = 'riak-admin cluster join {0}'.format(node)
-    out = __salt__['cmd.run'](cmd).split('\n')
-    msgs = [line for line in out if not line.startswith("!!!!")]
-    if msgs and msgs[0].startswith("Attempting"):
-        del msgs[0]
+    _clear_context()
+    msgs = _run('riak-admin cluster join {0}'.format(node))
     if msgs[0].startswith("Success"):
         return True
     else:
@@ -170,10 +363,8 @@ def cluster_leave(node=None, force=False):
         cmd = 'riak-admin cluster force-remove'
     if node is not None:
         cmd = '{0} {1}'.format(cmd, node)
-    out = __salt__['cmd.run'](cmd).split('\n')
-    msgs = [line for line in out if not line.startswith("!!!!")]
-    if msgs and msgs[0].startswith("Attempting"):
-        del msgs[0]
+    _clear_context()
+    msgs = _run(cmd)
     if msgs[0].startswith("Success"):
         return True
     else:
@@ -202,11 +393,8 @@ def cluster_replace(node1, node2, force=False):
     '''
     if len(node1.split("@")) != 2 and len(node2.split("@")) != 2:
         return False
-    cmd = 'riak-admin cluster replace {0} {1}'.format(node1, node2)
-    out = __salt__['cmd.run'](cmd).split('\n')
-    msgs = [line for line in out if not line.startswith("!!!!")]
-    if msgs and msgs[0].startswith("Attempting"):
-        del msgs[0]
+    _clear_context()
+    msgs = _run('riak-admin cluster replace {0} {1}'.format(node1, node2))
     if msgs[0].startswith("Success"):
         return True
     else:
@@ -221,11 +409,7 @@ def cluster_plan():
 
         salt '*' riak.cluster_plan
     '''
-    cmd = 'riak-admin cluster plan'
-    out = __salt__['cmd.run'](cmd).split('\n')
-    msgs = [line for line in out if not line.startswith("!!!!")]
-    if msgs and msgs[0].startswith("Attempting"):
-        del msgs[0]
+    msgs = _run('riak-admin cluster plan')
     if msgs[0] == "There are no staged changes":
         return None
     else:
@@ -240,11 +424,8 @@ def cluster_clear():
 
         salt '*' riak.cluster_clear
     '''
-    cmd = 'riak-admin cluster clear'
-    out = __salt__['cmd.run'](cmd).split('\n')
-    msgs = [line for line in out if not line.startswith("!!!!")]
-    if msgs and msgs[0].startswith("Attempting"):
-        del msgs[0]
+    _clear_context()
+    msgs = _run('riak-admin cluster clear')
     if msgs[0] == "Cleared staged cluster changes":
         return True
     else:
@@ -259,18 +440,15 @@ def cluster_commit():
 
         salt '*' riak.cluster_commit
     '''
-    cmd = 'riak-admin cluster commit'
-    out = __salt__['cmd.run'](cmd).split('\n')
-    msgs = [line for line in out if not line.startswith("!!!!")]
-    if msgs and msgs[0].startswith("Attempting"):
-        del msgs[0]
+    _clear_context()
+    msgs = _run('riak-admin cluster commit')
     if msgs[0].startswith("You must verify the plan"):
         return cluster_plan()
     else:
         return msgs[0]
 
 
-def ringready():
+def ringready(refresh=False):
     '''
     Checks whether all nodes in the cluster agree on the ring state.
 
@@ -278,67 +456,107 @@ def ringready():
 
         salt '*' riak.ringready
     '''
-    cmd = 'riak-admin ringready'
-    out = __salt__['cmd.run'](cmd).split('\n')
+    out = _cached('riak-admin ringready', refresh)
     if out and out[0].startswith("TRUE"):
         return True
     else:
         return False
 
 
-def ring_status():
+def ring_status(raw=False, refresh=False):
     '''
     Outputs the current claimant, its status, ringready, pending ownership
     handoffs and a list of unreachable nodes.
 
+    raw
+        Return the output lines instead of a dictionary
+
     CLI Example::
 
         salt '*' riak.ring_status
     '''
-    cmd = 'riak-admin ring-status'
-    out = __salt__['cmd.run'](cmd).split('\n')
-    out = out[1:len(out)]
+    out = _cached('riak-admin ring-status', refresh)
+    if not raw:
+        return _parse_ring_status(out)
     ret = []
-    for line in out:
+    for line in out[1:]:
         if line and line[:1] != "=" and line[:1] != " ":
             ret.append(line)
     return ret
 
 
-def member_status():
+def member_status(raw=False, refresh=False):
     '''
     Prints the current status of all cluster members.
 
+    raw
+        Return the output lines instead of a dictionary
+
     CLI Example::
 
         salt '*' riak.member_status
     '''
-    cmd = 'riak-admin member-status'
-    out = __salt__['cmd.run'](cmd).split('\n')
-    out = out[1:len(out)]
+    out = _cached('riak-admin member-status', refresh)
+    if not raw:
+        return _parse_member_status(out)
     ret = []
-    for line in out:
+    for line in out[1:]:
         if line and line[:1] != "=" and line[:1] != "-":
             ret.append(line)
     return ret
 
 
-def transfers():
+def transfers(raw=False, refresh=False):
     '''
     Identifies nodes that are awaiting transfer of one or more partitions.
 
+    raw
+        Return the output lines instead of a dictionary
+
     CLI Example::
 
         salt '*' riak.transfers
     '''
-    cmd = 'riak-admin transfers'
-    out = __salt__['cmd.run'](cmd).split('\n')
+    out = _cached('riak-admin transfers', refresh)
+    if not raw:
+        return _parse_transfers(out)
     if out[0] == "No transfers active":
         return out[0]
     else:
         return out
 
 
+def cluster_snapshot(refresh=False):
+    '''
+    Return the member, ring and transfer status of the cluster at once. The
+    riak-admin commands not already run in this ``__context__`` are run in
+    parallel.
+
+    CLI Example::
+
+        salt '*' riak.cluster_snapshot
+    '''
+    cmds = ('riak-admin member-status', 'riak-admin ring-status',
+            'riak-admin transfers')
+    outputs = __context__.setdefault('riak.output', {})
+    missing = [cmd for cmd in cmds if refresh or cmd not in outputs]
+    results = {}
+
+    def worker(cmd):
+        results[cmd] = _run(cmd)
+
+    threads = [threading.Thread(target=worker, args=(cmd,)) for cmd in missing]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    outputs.update(results)
+
+    return {'members': member_status(),
+            'ring': ring_status(),
+            'transfers': transfers()}
+
+
 def diag():
     '''
     Run diagnostic checks against <node>.
@@ -355,20 +573,44 @@ def diag():
         return out
 
 
-def status():
+def status(raw=False, refresh=False, http=True):
     '''
     Prints status information, including performance statistics, system health
-    information, and version numbers.
+    information, and version numbers, as a dictionary of numbers, booleans,
+    strings and lists.
+
+    The statistics are read from the HTTP ``/stats`` endpoint when
+    ``riak.http_url`` is set, from riak-admin otherwise or when it fails.
+
+    raw
+        Return the riak-admin output as a list of one-key dictionaries of
+        strings
+
+    http
+        Set to False to always use riak-admin
 
     CLI Example::
 
         salt '*' riak.status
     '''
-    cmd = 'riak-admin status'
-    out = __salt__['cmd.run'](cmd).split('\n')
-    ret = []
-    for line in out:
-        parts = line.split(" : ")
-        if len(parts) == 2:
-            ret.append({parts[0]: parts[1]})
-    return ret
+    if raw:
+        ret = []
+        for line in _cached('riak-admin status', refresh):
+            parts = line.split(" : ")
+            if len(parts) == 2:
+                ret.append({parts[0]: parts[1]})
+        return ret
+    if not refresh and 'riak.stats' in __context__:
+        return __context__['riak.stats']
+    stats = None
+    if http:
+        body = _http_get('stats')
+        if body is not None:
+            try:
+                stats = json.loads(body)
+            except ValueError:
+                log.debug('Riak /stats did not return JSON')
+    if stats is None:
+        stats = _parse_status(_cached('riak-admin status', refresh))
+    __context__['riak.stats'] = stats
+    return stats
@@ -4,10 +4,36 @@ The 'sysbench' module is used to analyse the
 performance of the minions, right from the master!
 It measures various system parameters such as
 CPU, Memory, FileI/O, Threads and Mutex.
+
+Results are returned as numbers: times in seconds (``_s``), latencies in
+milliseconds (``_ms``), throughputs in events or MiB per second. With
+``store=True`` they are also appended to a JSON file on the minion, so that
+``sysbench.compare`` can flag the metrics that regressed against a baseline
+saved with ``sysbench.set_baseline``. The defaults can be set in the minion
+config::
+
+    sysbench.results_dir: /var/cache/salt/minion/sysbench
+    sysbench.history: 100
+    sysbench.threshold: 10
+    sysbench.fileio_dir: /srv/data
+
+Hosts without the sysbench binary can still run ``sysbench.python_suite``,
+a smaller set of pure Python measurements (CPU, memory bandwidth, fsync
+latency, small-file I/O).
 '''
 
+import json
+import logging
+import os
 import re
+import shutil
+import tempfile
+import time
+
 import salt.utils
+from salt.exceptions import CommandExecutionError
+
+log = logging.getLogger(__name__)
 
 __outputter__ = {
     'ping': 'txt',
@@ -15,114 +41,266 @@ __outputter__ = {
     'threads': 'yaml',
     'mutex': 'yaml',
     'memory': 'yaml',
-    'fileio': 'yaml'
+    'fileio': 'yaml',
+    'python_suite': 'yaml',
+    'compare': 'yaml',
 }
 
+# metric name -> regex of its value, for the 0.4 and 1.x output formats
+_METRICS = (
+    ('total_time_s', re.compile(r'total time:\s*([\d.]+)s')),
+    ('events', re.compile(r'total number of events:\s*([\d.]+)')),
+    ('events_per_sec', re.compile(r'events per second:\s*([\d.]+)')),
+    ('execution_time_s', re.compile(
+        r'(?:total time taken by event execution|execution time \(avg/stddev\)):\s*([\d.]+)')),
+    ('mib_per_sec', re.compile(r'\(([\d.]+) ?Mi?[bB]/sec\)')),
+    ('read_mib_per_sec', re.compile(r'read, MiB/s:\s*([\d.]+)')),
+    ('written_mib_per_sec', re.compile(r'written, MiB/s:\s*([\d.]+)')),
+)
+# Latencies are in ms, unless another unit follows them (0.4 format)
+_LATENCIES = (
+    ('latency_min_ms', re.compile(r'\bmin:\s*([\d.]+)(ms|s)?')),
+    ('latency_avg_ms', re.compile(r'\bavg:\s*([\d.]+)(ms|s)?')),
+    ('latency_max_ms', re.compile(r'\bmax:\s*([\d.]+)(ms|s)?')),
+    ('latency_p95_ms', re.compile(r'\b95(?:th)? percentile:\s*([\d.]+)(ms|s)?')),
+)
+# Metrics for which a higher value is better, a lower value is better for
+# all the others
+_HIGHER_IS_BETTER = ('events', 'events_per_sec', 'mib_per_sec',
+                     'read_mib_per_sec', 'written_mib_per_sec')
+
+RESULTS_FILE = 'results.json'
+FILEIO_PARTIAL = 'fileio.partial.json'
+DEFAULT_HISTORY = 100
+DEFAULT_THRESHOLD = 10
+
 
 def __virtual__():
     '''
-    loads the module, if only sysbench is installed
+    Always loads, the pure Python suite works without sysbench
     '''
-    # finding the path of the binary
-    if salt.utils.which('sysbench'):
-        return 'sysbench'
-    return False
+    return 'sysbench'
+
+
+def _run(options, **kwargs):
+    '''
+    Run sysbench with the given options and return its output, raise if it
+    is not installed or fails
+    '''
+    if not salt.utils.which('sysbench'):
+        raise CommandExecutionError(
+            'sysbench is not installed, sysbench.python_suite can be used instead')
+    ret = __salt__['cmd.run_all']('sysbench {0}'.format(options), **kwargs)
+    if ret['retcode'] != 0:
+        raise CommandExecutionError('sysbench {0} failed with exit code {1}: {2}'.format(
+            options.strip(), ret['retcode'], (ret.get('stderr') or ret.get('stdout') or '').strip()))
+    return ret['stdout']
 
 
 def _parser(result):
     '''
-    parses the output into a dictionary
+    parses the output into a dictionary of numbers, metrics missing from
+    the output are None
+    '''
+    ret = {}
+    for name, regex in _METRICS:
+        match = regex.search(result)
+        ret[name] = float(match.group(1)) if match else None
+    for name, regex in _LATENCIES:
+        match = regex.search(result)
+        if match:
+            value = float(match.group(1))
+            ret[name] = value * 1000 if match.group(2) == 's' else value
+        else:
+            ret[name] = None
+    if ret['events'] is not None:
+        ret['events'] = int(ret['events'])
+        if ret['events_per_sec'] is None and ret['total_time_s']:
+            ret['events_per_sec'] = ret['events'] / ret['total_time_s']
+    return ret
+
+
+def _limits(time_limit, max_requests):
+    '''
+    Options bounding the duration of a test
+    '''
+    options = ''
+    if time_limit is not None:
+        options += ' --max-time={0}'.format(int(time_limit))
+    if max_requests is not None:
+        options += ' --max-requests={0}'.format(int(max_requests))
+    return options
+
+
+def _option(name, default):
+    value = __salt__['config.option']('sysbench.{0}'.format(name))
+    # config.option returns '' for unset options, 0 is a valid value
+    if value is None or value == '':
+        return default
+    return value
+
+
+def _results_path(name=RESULTS_FILE):
+    directory = _option('results_dir', None)
+    if not directory:
+        directory = os.path.join(__opts__['cachedir'], 'sysbench')
+    return os.path.join(directory, name)
+
+
+def _read_json(path):
+    try:
+        with salt.utils.fopen(path, 'r') as handle:
+            return json.load(handle)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _load():
+    data = _read_json(_results_path())
+    data.setdefault('runs', [])
+    data.setdefault('baseline', {})
+    return data
+
+
+def _dump(data, path=None):
+    '''
+    Atomically replace the results file
     '''
+    path = path or _results_path()
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd_, tmp = tempfile.mkstemp(prefix='.results.', dir=directory)
+    try:
+        with os.fdopen(fd_, 'w') as handle:
+            json.dump(data, handle)
+        os.rename(tmp, path)
+    except (IOError, OSError, TypeError, ValueError):
+        os.unlink(tmp)
+        raise
+
+
+def _store(test, results):
+    '''
+    Append the results of a test to the history, keeping the last
+    sysbench.history runs
+    '''
+    data = _load()
+    data['runs'].append({'time': time.time(), 'test': test, 'results': results})
+    history = int(_option('history', DEFAULT_HISTORY))
+    data['runs'] = data['runs'][-history:] if history > 0 else []
+    _dump(data)
+
 
-    # regexes to match
-    _total_time = re.compile(r'total time:\s*(\d*.\d*s)')
-    _total_execution = re.compile(r'event execution:\s*(\d*.\d*s)')
-    _min_response_time = re.compile(r'min:\s*(\d*.\d*ms)')
-    _max_response_time = re.compile(r'max:\s*(\d*.\d*ms)')
-    _avg_response_time = re.compile(r'avg:\s*(\d*.\d*ms)')
-    _per_response_time = re.compile(r'95 percentile:\s*(\d*.\d*ms)')
+def _finish(test, results, store):
+    if store:
+        _store(test, results)
+    return results
 
-    # extracting data
-    total_time = re.search(_total_time, result).group(1)
-    total_execution = re.search(_total_execution, result).group(1)
-    min_response_time = re.search(_min_response_time, result).group(1)
-    max_response_time = re.search(_max_response_time, result).group(1)
-    avg_response_time = re.search(_avg_response_time, result).group(1)
-    per_response_time = re.search(_per_response_time, result)
-    if per_response_time is not None:
-        per_response_time = per_response_time.group(1)
 
-    # returning the data as dictionary
+def _latency_stats(samples):
+    '''
+    Summarise latencies given in seconds as the metrics sysbench reports
+    '''
+    samples = sorted(samples)
+    count = len(samples)
+    total = sum(samples)
+    if not count:
+        # Eg. the duration was too short for a single event
+        return {
+            'total_time_s': total,
+            'events': 0,
+            'events_per_sec': None,
+            'latency_min_ms': None,
+            'latency_avg_ms': None,
+            'latency_max_ms': None,
+            'latency_p95_ms': None,
+        }
     return {
-        'total time            ': total_time,
-        'total execution time  ': total_execution,
-        'minimum response time ': min_response_time,
-        'maximum response time ': max_response_time,
-        'average response time ': avg_response_time,
-        '95 percentile         ': per_response_time
+        'total_time_s': total,
+        'events': count,
+        'events_per_sec': count / total if total else None,
+        'latency_min_ms': samples[0] * 1000,
+        'latency_avg_ms': total / count * 1000,
+        'latency_max_ms': samples[-1] * 1000,
+        'latency_p95_ms': samples[min(count - 1, int(count * 0.95))] * 1000,
     }
 
 
-def cpu():
+def cpu(max_primes=(500, 1000, 2500, 5000), num_threads=1, time_limit=None,
+        max_requests=None, store=False):
     '''
     Tests for the cpu performance of minions.
 
+    max_primes
+        Upper limits of the prime numbers computed, one test per limit
+
+    num_threads, time_limit, max_requests
+        Number of threads, and maximum duration in seconds or number of
+        events of every test
+
+    store
+        Save the results in the history used by sysbench.compare
+
     CLI Examples::
 
         salt '*' sysbench.cpu
+        salt '*' sysbench.cpu max_primes=[20000] num_threads=4 time_limit=10
     '''
 
-    # Test data
-    max_primes = [500, 1000, 2500, 5000]
-
     # Initializing the test variables
-    test_command = 'sysbench --test=cpu --cpu-max-prime={0} run'
-    result = None
+    test_command = '--num-threads={0} --test=cpu --cpu-max-prime={1}{2} run'
+    limits = _limits(time_limit, max_requests)
     ret_val = {}
 
     # Test beings!
     for primes in max_primes:
         key = 'Primer numbers limit: {0}'.format(primes)
-        run_command = test_command.format(primes)
-        result = __salt__['cmd.run'](run_command)
+        result = _run(test_command.format(num_threads, primes, limits))
         ret_val[key] = _parser(result)
 
-    return ret_val
+    return _finish('cpu', ret_val, store)
 
 
-def threads():
+def threads(thread_yields=(100, 200, 500, 1000), thread_locks=(2, 4, 8, 16),
+            num_threads=64, time_limit=None, max_requests=None, store=False):
     '''
     This tests the performance of the processor's scheduler
 
+    thread_yields, thread_locks
+        Number of yields and locks of every test, taken pairwise
+
+    num_threads, time_limit, max_requests
+        Number of threads, and maximum duration in seconds or number of
+        events of every test
+
     CLI Example::
 
         salt \* sysbench.threads
     '''
 
-    # Test data
-    thread_yields = [100, 200, 500, 1000]
-    thread_locks = [2, 4, 8, 16]
-
     # Initializing the test variables
-    test_command = 'sysbench --num-threads=64 --test=threads '
-    test_command += '--thread-yields={0} --thread-locks={1} run '
-    result = None
+    test_command = '--num-threads={0} --test=threads '
+    test_command += '--thread-yields={1} --thread-locks={2}{3} run'
+    limits = _limits(time_limit, max_requests)
     ret_val = {}
 
     # Test begins!
     for yields, locks in zip(thread_yields, thread_locks):
         key = 'Yields: {0} Locks: {1}'.format(yields, locks)
-        run_command = test_command.format(yields, locks)
-        result = __salt__['cmd.run'](run_command)
+        result = _run(test_command.format(num_threads, yields, locks, limits))
         ret_val[key] = _parser(result)
 
-    return ret_val
+    return _finish('threads', ret_val, store)
 
 
-def mutex():
+def mutex(num_threads=250, store=False):
     '''
     Tests the implementation of mutex
 
+    num_threads
+        Number of threads competing for the mutexes
+
     CLI Examples::
 
         salt \* sysbench.mutex
@@ -141,58 +319,62 @@ def mutex():
     mutex_loops = [2500, 5000, 10000, 10000, 2500, 5000, 5000, 10000, 2500]
 
     # Initializing the test variables
-    test_command = 'sysbench --num-threads=250 --test=mutex '
-    test_command += '--mutex-num={0} --mutex-locks={1} --mutex-loops={2} run '
-    result = None
+    test_command = '--num-threads={0} --test=mutex '
+    test_command += '--mutex-num={1} --mutex-locks={2} --mutex-loops={3} run'
     ret_val = {}
 
     # Test begins!
     for num, locks, loops in zip(mutex_num, mutex_locks, mutex_loops):
         key = 'Mutex: {0} Locks: {1} Loops: {2}'.format(num, locks, loops)
-        run_command = test_command.format(num, locks, loops)
-        result = __salt__['cmd.run'](run_command)
+        result = _run(test_command.format(num_threads, num, locks, loops))
         ret_val[key] = _parser(result)
 
-    return ret_val
+    return _finish('mutex', ret_val, store)
 
 
-def memory():
+def memory(block_size='1K', total_size='32G', num_threads=64, time_limit=None,
+           store=False):
     '''
     This tests the memory for read and write operations.
 
+    block_size, total_size
+        Size of the blocks read or written, and of all of them
+
+    num_threads, time_limit
+        Number of threads, and maximum duration in seconds of every test
+
     CLI Examples::
 
         salt \* sysbench.memory
+        salt \* sysbench.memory total_size=4G num_threads=8
     '''
 
-    # test defaults
-    # --memory-block-size = 10M
-    # --memory-total-size = 1G
-
     # We test memory read / write against global / local scope of memory
     # Test data
     memory_oper = ['read', 'write']
     memory_scope = ['local', 'global']
 
     # Initializing the test variables
-    test_command = 'sysbench --num-threads=64 --test=memory '
-    test_command += '--memory-oper={0} --memory-scope={1} '
-    test_command += '--memory-block-size=1K --memory-total-size=32G run '
-    result = None
+    test_command = '--num-threads={0} --test=memory '
+    test_command += '--memory-oper={1} --memory-scope={2} '
+    test_command += '--memory-block-size={3} --memory-total-size={4}{5} run'
+    limits = _limits(time_limit, None)
     ret_val = {}
 
     # Test begins!
     for oper in memory_oper:
         for scope in memory_scope:
             key = 'Operation: {0} Scope: {1}'.format(oper, scope)
-            run_command = test_command.format(oper, scope)
-            result = __salt__['cmd.run'](run_command)
+            result = _run(test_command.format(num_threads, oper, scope,
+                                              block_size, total_size, limits))
             ret_val[key] = _parser(result)
 
-    return ret_val
+    return _finish('memory', ret_val, store)
 
 
-def fileio():
+def fileio(directory=None, total_size='1G', file_num=32, num_threads=16,
+           time_limit=None, modes=('seqwr', 'seqrewr', 'seqrd', 'rndrd', 'rndwr', 'rndrw'),
+           resume=True, store=False):
     '''
     This tests for the file read and write operations
     Various modes of operations are
@@ -203,41 +385,284 @@ def fileio():
         random write
         random read and write
 
-    The test works with 32 files with each file being 1Gb in size
-    The test consumes a lot of time. Be patient!
+    The test files are prepared once and shared by all the modes, and always
+    removed at the end, even when a mode fails. The result of every mode is
+    saved as soon as it completes: when a run fails or is interrupted, the
+    next one with the same parameters only runs the modes left (unless
+    resume is False). The test consumes a lot of time. Be patient!
+
+    directory
+        Where the test files are created, in a temporary subdirectory.
+        Defaults to sysbench.fileio_dir, or the minion cache directory
+
+    total_size, file_num
+        Size of all the test files (eg. 1G, 512M) and number of files
+
+    num_threads, time_limit
+        Number of threads, and maximum duration in seconds of every mode
+
+    modes
+        The test modes to run
 
     CLI Examples::
 
         salt \* sysbench.fileio
+        salt \* sysbench.fileio directory=/srv/data total_size=4G time_limit=60
     '''
-
-    # Test data
-    test_modes = ['seqwr', 'seqrewr', 'seqrd', 'rndrd', 'rndwr', 'rndrw']
+    params = {'directory': directory, 'total_size': total_size,
+              'file_num': int(file_num), 'num_threads': int(num_threads),
+              'time_limit': time_limit}
+    partial_path = _results_path(FILEIO_PARTIAL)
+    partial = _read_json(partial_path) if resume else {}
+    if partial.get('params') != params:
+        partial = {'params': params, 'results': {}}
+    ret_val = partial['results']
+    todo = [mode for mode in modes if 'Mode: {0}'.format(mode) not in ret_val]
 
     # Initializing the required variables
-    test_command = 'sysbench --num-threads=16 --test=fileio '
-    test_command += '--file-num=32 --file-total-size=1G --file-test-mode={0} '
-    result = None
-    ret_val = {}
+    test_command = '--num-threads={0} --test=fileio '.format(num_threads)
+    test_command += '--file-num={0} --file-total-size={1}{2} '.format(
+        file_num, total_size, _limits(time_limit, None))
+    test_command += '--file-test-mode={0} {1}'
 
     # Test begins!
-    for mode in test_modes:
-        key = 'Mode: {0}'.format(mode)
+    if todo:
+        parent = directory or _option('fileio_dir', None) or __opts__['cachedir']
+        workdir = tempfile.mkdtemp(prefix='sysbench.', dir=parent)
+        try:
+            # Prepare phase, the files are the same for all the modes
+            _run(test_command.format(todo[0], 'prepare'), cwd=workdir)
+
+            # Test phase
+            for mode in todo:
+                result = _run(test_command.format(mode, 'run'), cwd=workdir)
+                ret_val['Mode: {0}'.format(mode)] = _parser(result)
+                _dump(partial, partial_path)
+        finally:
+            # Clean up phase
+            try:
+                _run(test_command.format(todo[0], 'cleanup'), cwd=workdir)
+            except CommandExecutionError as exc:
+                # The files are removed below anyway
+                log.warning('sysbench fileio cleanup failed: {0}'.format(exc))
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    if os.path.exists(partial_path):
+        os.unlink(partial_path)
+    return _finish('fileio', ret_val, store)
+
+
+def _py_cpu(duration, max_prime):
+    '''
+    Count the primes up to max_prime by trial division, as many times as
+    possible in duration seconds
+    '''
+    samples = []
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        start = time.time()
+        count = 0
+        for candidate in range(3, max_prime + 1):
+            limit = int(candidate ** 0.5)
+            divisor = 2
+            while divisor <= limit:
+                if candidate % divisor == 0:
+                    break
+                divisor += 1
+            else:
+                count += 1
+        samples.append(time.time() - start)
+    return _latency_stats(samples)
+
+
+def _py_memory(duration, block_size):
+    '''
+    Copy a block of memory into another one for duration seconds
+    '''
+    source = bytearray(b'\x5a' * block_size)
+    target = bytearray(block_size)
+    copied = 0
+    start = time.time()
+    deadline = start + duration
+    while time.time() < deadline:
+        for _ in range(16):
+            target[:] = source
+        copied += 16 * block_size
+    elapsed = time.time() - start
+    return {'total_time_s': elapsed,
+            'mib_per_sec': copied / elapsed / 1048576.0}
+
+
+def _py_fsync(directory, duration, size):
+    '''
+    Write and fsync a small block over and over
+    '''
+    samples = []
+    block = b'\x5a' * size
+    path = os.path.join(directory, 'fsync')
+    fd_ = os.open(path, os.O_WRONLY | os.O_CREAT, 0o600)
+    try:
+        deadline = time.time() + duration
+        while time.time() < deadline:
+            start = time.time()
+            os.lseek(fd_, 0, os.SEEK_SET)
+            os.write(fd_, block)
+            os.fsync(fd_)
+            samples.append(time.time() - start)
+    finally:
+        os.close(fd_)
+    return _latency_stats(samples)
+
+
+def _py_small_files(directory, count, size):
+    '''
+    Create, read back and remove small files, each cycle being one event
+    '''
+    samples = []
+    block = b'\x5a' * size
+    for num in range(count):
+        path = os.path.join(directory, 'small.{0}'.format(num))
+        start = time.time()
+        with salt.utils.fopen(path, 'wb') as handle:
+            handle.write(block)
+        with salt.utils.fopen(path, 'rb') as handle:
+            handle.read()
+        os.unlink(path)
+        samples.append(time.time() - start)
+    return _latency_stats(samples)
+
+
+def python_suite(duration=2, max_prime=5000, block_size=1048576,
+                 fsync_size=4096, small_files=1000, small_file_size=4096,
+                 directory=None, store=False):
+    '''
+    Runs a pure Python benchmark suite, for hosts without sysbench. Its
+    results are comparable between runs and hosts of the same Python version,
+    not with the sysbench results.
 
-        # Prepare phase
-        run_command = (test_command + 'prepare').format(mode)
-        __salt__['cmd.run'](run_command)
+    duration
+        Seconds spent on each of the CPU, memory and fsync tests
 
-        # Test phase
-        run_command = (test_command + 'run').format(mode)
-        result = __salt__['cmd.run'](run_command)
-        ret_val[key] = _parser(result)
+    max_prime
+        Upper limit of the prime numbers computed per CPU event
+
+    block_size
+        Bytes copied per memory event
 
-        # Clean up phase
-        run_command = (test_command + 'cleanup').format(mode)
-        __salt__['cmd.run'](run_command)
+    fsync_size
+        Bytes written before each fsync
 
-    return ret_val
+    small_files, small_file_size
+        Number and size in bytes of the files of the small-file I/O test
+
+    directory
+        Where the fsync and small-file tests write, defaults to the minion
+        cache directory
+
+    CLI Examples::
+
+        salt \* sysbench.python_suite
+        salt \* sysbench.python_suite directory=/srv/data store=True
+    '''
+    duration = float(duration)
+    workdir = tempfile.mkdtemp(prefix='sysbench.',
+                               dir=directory or __opts__['cachedir'])
+    try:
+        ret_val = {
+            'CPU: primes up to {0}'.format(max_prime): _py_cpu(duration, int(max_prime)),
+            'Memory: copy blocks of {0}'.format(block_size): _py_memory(duration, int(block_size)),
+            'Fsync: blocks of {0}'.format(fsync_size): _py_fsync(workdir, duration, int(fsync_size)),
+            'Small files: {0} of {1}'.format(small_files, small_file_size):
+                _py_small_files(workdir, int(small_files), int(small_file_size)),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return _finish('python', ret_val, store)
+
+
+def history(test=None):
+    '''
+    Returns the stored results, oldest first
+
+    CLI Examples::
+
+        salt \* sysbench.history cpu
+    '''
+    runs = _load()['runs']
+    if test is not None:
+        runs = [run for run in runs if run['test'] == test]
+    return runs
+
+
+def set_baseline(test=None):
+    '''
+    Makes the last stored results of a test, or of every test, the baseline
+    sysbench.compare measures against
+
+    CLI Examples::
+
+        salt \* sysbench.set_baseline
+    '''
+    data = _load()
+    for run in data['runs']:
+        if test is None or run['test'] == test:
+            data['baseline'][run['test']] = run
+    _dump(data)
+    return sorted(data['baseline'])
+
+
+def _change(name, old, new, threshold):
+    '''
+    Relative change of a metric in percent, positive when it got worse
+    '''
+    if not old or new is None:
+        return None
+    change = (new - old) * 100.0 / old
+    if name in _HIGHER_IS_BETTER:
+        change = -change
+    return {'baseline': old, 'current': new, 'change_pct': round(change, 2),
+            'regression': change > threshold}
+
+
+def compare(test=None, threshold=None):
+    '''
+    Compares the last stored results of a test, or of every test, with the
+    baseline. A metric regressed when it got worse by more than threshold
+    percent (sysbench.threshold, 10 by default).
+
+    Returns the changes of every metric and the list of the regressions.
+
+    CLI Examples::
+
+        salt \* sysbench.compare cpu threshold=5
+    '''
+    if threshold is None:
+        threshold = _option('threshold', DEFAULT_THRESHOLD)
+    threshold = float(threshold)
+    data = _load()
+    latest = {}
+    for run in data['runs']:
+        latest[run['test']] = run
+
+    ret = {'changes': {}, 'regressions': []}
+    for name in sorted(data['baseline']):
+        if (test is not None and name != test) or name not in latest:
+            continue
+        baseline = data['baseline'][name]['results']
+        current = latest[name]['results']
+        changes = ret['changes'][name] = {}
+        for key in sorted(set(baseline) & set(current)):
+            for metric in sorted(set(baseline[key]) & set(current[key])):
+                change = _change(metric, baseline[key][metric],
+                                 current[key][metric], threshold)
+                if change is None:
+                    continue
+                changes.setdefault(key, {})[metric] = change
+                if change['regression']:
+                    ret['regressions'].append('{0}: {1}: {2}'.format(name, key, metric))
+    return ret
 
 
 def ping():
@@ -35,6 +35,7 @@ import copy
 import fnmatch
 import logging
 import re
+import time
 import yaml
 
 # Import salt libs
@@ -306,9 +307,13 @@ def latest_version(*names, **kwargs):
         exactmatch, matched, unmatched = yum.packages.parsePackages(
             pkglist, [namearch_map[x]['name'] for x in names]
         )
+        # Group the matches by name once, so that resolving each requested
+        # name does not require another pass over every exact match.
+        matches_by_name = {}
+        for pkg in exactmatch:
+            matches_by_name.setdefault(pkg.name, []).append(pkg)
         for name in names:
-            for pkg in (x for x in exactmatch
-                        if x.name == namearch_map[name]['name']):
+            for pkg in matches_by_name.get(namearch_map[name]['name'], ()):
                 if (all(x in suffix_notneeded
                         for x in (namearch_map[name]['arch'], pkg.arch))
                         or namearch_map[name]['arch'] == pkg.arch):
@@ -458,6 +463,109 @@ def list_repo_pkgs(*args, **kwargs):
     return ret
 
 
+def _repo_options_key(**kwargs):
+    '''
+    Returns a hashable key describing the repo options in effect, used to
+    cache package indexes per set of enabled repos.
+    '''
+    return tuple(
+        str(kwargs.get(x, ''))
+        for x in ('fromrepo', 'repo', 'disablerepo', 'enablerepo')
+    )
+
+
+def _pkg_index(yumbase, **kwargs):
+    '''
+    Returns a dict mapping package names to the set of arches under which they
+    are available or installed. The index is built with a single pass over the
+    package sack and the rpmdb, and is cached in ``__context__`` per set of
+    repo options, so that subsequent lookups in the same run are dict lookups
+    instead of sack searches.
+    '''
+    cache = __context__.setdefault('pkg._pkg_index', {})
+    key = _repo_options_key(**kwargs)
+    if key not in cache:
+        index = {}
+        for source in (yumbase.pkgSack, yumbase.rpmdb):
+            for pkg in source.returnPackages():
+                index.setdefault(pkg.name, set()).add(pkg.arch)
+        cache[key] = {'names': index, 'provides': None}
+    return cache[key]
+
+
+def _provides_index(yumbase, index):
+    '''
+    Adds (if not already present) a provides index to the passed package
+    index, mapping each provided name to the list of ``(name, arch)`` tuples of
+    the packages that provide it. Building it requires loading the provides of
+    every package, so it is only done when a lookup actually misses.
+    '''
+    if index['provides'] is None:
+        provides = {}
+        for source in (yumbase.pkgSack, yumbase.rpmdb):
+            for pkg in source.returnPackages():
+                for prov in pkg.provides_names:
+                    provides.setdefault(prov, []).append((pkg.name, pkg.arch))
+        index['provides'] = provides
+    return index['provides']
+
+
+def _check_db_batched(yumbase, names, **kwargs):
+    '''
+    Resolve all of the passed names against a name/provides index built once,
+    rather than searching the sack separately for each name. Returns the same
+    structure as :py:func:`check_db`.
+    '''
+    index = _pkg_index(yumbase, **kwargs)
+    ret = {}
+    for name in names:
+        pkgname, pkgarch = _pkg_arch(name)
+        arches = index['names'].get(pkgname, ())
+        ret.setdefault(name, {})['found'] = \
+            pkgarch in arches or 'noarch' in arches
+        if ret[name]['found'] is False:
+            if pkgname.startswith('/'):
+                # File provides are not part of the index, let yum handle them
+                providers = [
+                    (x.name, x.arch) for x in yumbase.whatProvides(
+                        pkgname, None, None
+                    ).returnPackages()
+                ]
+            else:
+                providers = _provides_index(yumbase, index).get(pkgname, [])
+            ret[name]['suggestions'] = [
+                x for x, y in providers if y in (pkgarch, 'noarch')
+            ]
+    return ret
+
+
+def _check_db_per_name(yumbase, names):
+    '''
+    Resolve the passed names one at a time by searching the sack for each of
+    them. Returns the same structure as :py:func:`check_db`.
+    '''
+    ret = {}
+    for name in names:
+        pkgname, pkgarch = _pkg_arch(name)
+        ret.setdefault(name, {})['found'] = bool(
+            [x for x in yumbase.searchPackages(('name', 'arch'), (pkgname,))
+             if x.name == pkgname and x.arch in (pkgarch, 'noarch')]
+        )
+        if ret[name]['found'] is False:
+            provides = [
+                x for x in yumbase.whatProvides(
+                    pkgname, None, None
+                ).returnPackages()
+                if x.arch in (pkgarch, 'noarch')
+            ]
+            if provides:
+                for pkg in provides:
+                    ret[name].setdefault('suggestions', []).append(pkg.name)
+            else:
+                ret[name]['suggestions'] = []
+    return ret
+
+
 def check_db(*names, **kwargs):
     '''
     .. versionadded:: 0.17.0
@@ -473,6 +581,11 @@ def check_db(*names, **kwargs):
     The ``fromrepo``, ``enablerepo``, and ``disablerepo`` arguments are
     supported, as used in pkg states.
 
+    batch : True
+        Resolve all names against a name/provides index that is built once and
+        cached for the rest of the run. Set to ``False`` to search the package
+        sack separately for each name.
+
     CLI Examples:
 
     .. code-block:: bash
@@ -480,34 +593,66 @@ def check_db(*names, **kwargs):
         salt '*' pkg.check_db <package1> <package2> <package3>
         salt '*' pkg.check_db <package1> <package2> <package3> fromrepo=epel-testing
     '''
+    batch = salt.utils.is_true(kwargs.pop('batch', True))
     yumbase = _YumBase()
     error = _set_repo_options(yumbase, **kwargs)
     if error:
         log.error(error)
         return {}
 
-    ret = {}
-    for name in names:
-        pkgname, pkgarch = _pkg_arch(name)
-        ret.setdefault(name, {})['found'] = bool(
-            [x for x in yumbase.searchPackages(('name', 'arch'), (pkgname,))
-             if x.name == pkgname and x.arch in (pkgarch, 'noarch')]
-        )
-        if ret[name]['found'] is False:
-            provides = [
-                x for x in yumbase.whatProvides(
-                    pkgname, None, None
-                ).returnPackages()
-                if x.arch in (pkgarch, 'noarch')
-            ]
-            if provides:
-                for pkg in provides:
-                    ret[name].setdefault('suggestions', []).append(pkg.name)
-            else:
-                ret[name]['suggestions'] = []
+    start = time.time()
+    if batch:
+        ret = _check_db_batched(yumbase, names, **kwargs)
+    else:
+        ret = _check_db_per_name(yumbase, names)
+    log.debug('pkg.check_db resolved {0} name(s) in {1:.3f}s (batch={2})'
+              .format(len(names), time.time() - start, batch))
     return ret
 
 
+def check_db_timings(*names, **kwargs):
+    '''
+    Resolve the passed names with both the batched and the per-name
+    :py:func:`check_db` strategies and return the time taken by each, along
+    with whether both produced the same results. Intended for comparing the
+    two strategies on a given host.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' pkg.check_db_timings <package1> <package2> <package3>
+    '''
+    kwargs.pop('batch', None)
+    yumbase = _YumBase()
+    error = _set_repo_options(yumbase, **kwargs)
+    if error:
+        log.error(error)
+        return {}
+
+    # Always time a cold index, a cached one would not be a fair comparison
+    __context__.get('pkg._pkg_index', {}).pop(_repo_options_key(**kwargs), None)
+
+    start = time.time()
+    batched = _check_db_batched(yumbase, names, **kwargs)
+    batched_time = time.time() - start
+
+    start = time.time()
+    per_name = _check_db_per_name(yumbase, names)
+    per_name_time = time.time() - start
+
+    def _normalize(results):
+        return dict(
+            (x, (y['found'], sorted(y.get('suggestions', []))))
+            for x, y in six.iteritems(results)
+        )
+
+    return {'names': len(names),
+            'batch': batched_time,
+            'per_name': per_name_time,
+            'match': _normalize(batched) == _normalize(per_name)}
+
+
 def refresh_db():
     '''
     Since yum refreshes the database automatically, this runs a yum clean,
@@ -521,6 +666,7 @@ def refresh_db():
     '''
     yumbase = _YumBase()
     yumbase.cleanMetadata()
+    __context__.pop('pkg._pkg_index', None)
     return True
 
 
@@ -785,6 +931,7 @@ def install(name=None,
         log.error('Install failed: {0}'.format(e))
 
     __context__.pop('pkg.list_pkgs', None)
+    __context__.pop('pkg._pkg_index', None)
     new = list_pkgs()
     return salt.utils.compare_dicts(old, new)
 
@@ -828,6 +975,7 @@ def upgrade(refresh=True):
         log.error('Upgrade failed: {0}'.format(e))
 
     __context__.pop('pkg.list_pkgs', None)
+    __context__.pop('pkg._pkg_index', None)
     new = list_pkgs()
     return salt.utils.compare_dicts(old, new)
 
@@ -900,6 +1048,7 @@ def remove(name=None, pkgs=None, **kwargs):
     yumbase.closeRpmDB()
 
     __context__.pop('pkg.list_pkgs', None)
+    __context__.pop('pkg._pkg_index', None)
     new = list_pkgs()
     return salt.utils.compare_dicts(old, new)
 
@@ -4,25 +4,176 @@ zabbix module for salt
 ============================
 
 The user module is used to config zabbix
+
+Zabbix objects looked up during a run are cached in ``__context__`` and the
+cache is kept up to date with the objects created and updated by this module,
+so checking an object after creating or updating it does not require another
+API call. Templates are prefetched along with all of their applications and
+items in a single batch request.
 '''
 
 # Import python libs
 from __future__ import absolute_import
+import json
 import logging
+import threading
 from zapi import *
 
 log = logging.getLogger(__name__)
 
-zapi = ZabbixAPI(url='{{web_api}}', user='{{web_user}}', password='{{web_pass}}')
-zapi.login()
+# Created and logged in on first use, see _zapi()
+_ZAPI = None
+_ZAPI_LOCK = threading.Lock()
+
+# Name of the id field of the API objects, when it is not <object>id
+_ID_FIELDS = {
+    'Hostgroup': 'groupid',
+    'Usergroup': 'usrgrpid',
+}
+
+
+def _zapi():
+    '''
+    Return the Zabbix API client, logging in on first use rather than when
+    the module is loaded. The auth token is renewed when it expires.
+    '''
+    global _ZAPI
+    with _ZAPI_LOCK:
+        if _ZAPI is None:
+            _ZAPI = ZabbixAPI(url='{{web_api}}', user='{{web_user}}', password='{{web_pass}}')
+    _ZAPI.ensureLogin()
+    return _ZAPI
 
 
 # {% raw %}
+def _id_field(obj):
+    return _ID_FIELDS.get(obj, obj.lower() + 'id')
+
+
+def _cache():
+    '''
+    Return the object cache of this run. ``found`` maps (object, filter) to
+    the list of objects found with that filter, and ``complete`` maps
+    (object, hostid) to the list of all the objects of the host or template,
+    which can be filtered locally. ``prefetched`` holds the names of the
+    templates fetched by _prefetch_template.
+    '''
+    return __context__.setdefault('zabbix.cache', {'found': {},
+                                                   'complete': {},
+                                                   'prefetched': set()})
+
+
+def _filter_key(obj, params):
+    return obj, json.dumps(params, sort_keys=True)
+
+
+def _matches(item, params):
+    '''
+    Return True if the object matches the find() filter in params
+    '''
+    for key, value in params.items():
+        values = value if isinstance(value, list) else [value]
+        values = [str(x) for x in values]
+        if key == 'application':
+            ids = [str(x['applicationid']) for x in item.get('applications', [])]
+            if not set(values) & set(ids):
+                return False
+        elif str(item.get(key)) not in values:
+            return False
+    return True
+
+
+def _find(obj, params):
+    '''
+    Cached equivalent of _zapi().<obj>.find(params)
+    '''
+    cache = _cache()
+    hostid = params.get('hostid')
+    if not isinstance(hostid, list) and (obj, hostid) in cache['complete']:
+        return [x for x in cache['complete'][(obj, hostid)] if _matches(x, params)]
+
+    key = _filter_key(obj, params)
+    if key not in cache['found']:
+        cache['found'][key] = getattr(_zapi(), obj).find(params)
+    return cache['found'][key]
+
+
+def _invalidate(obj):
+    '''
+    Drop the cached lookups of the object type
+    '''
+    found = _cache()['found']
+    for key in [x for x in found if x[0] == obj]:
+        del found[key]
+
+
+def _create(obj, params, lookup):
+    '''
+    Create an object and record it in the cache as the result of the lookup
+    filter that was used to look for it
+    '''
+    result = getattr(_zapi(), obj).create(params)
+    idfield = _id_field(obj)
+    created = dict(params)
+    created[idfield] = result[idfield + 's'][0]
+    if 'applications' in created:
+        created['applications'] = [{'applicationid': x} for x in params['applications']]
+
+    cache = _cache()
+    # Lookups with other filters may or may not match the new object
+    _invalidate(obj)
+    cache['found'][_filter_key(obj, lookup)] = [created]
+    hostid = params.get('hostid')
+    if (obj, hostid) in cache['complete']:
+        cache['complete'][(obj, hostid)].append(created)
+    return created
+
+
+def _update(obj, params):
+    '''
+    Update an object, and the cached copies of it
+    '''
+    getattr(_zapi(), obj).update(params)
+    idfield = _id_field(obj)
+    cache = _cache()
+    for objects in list(cache['found'].values()) + list(cache['complete'].values()):
+        for item in objects:
+            if idfield in item and item[idfield] == params[idfield]:
+                item.update(params)
+
+
+def _prefetch_template(name):
+    '''
+    Fetch the template along with all of its applications and items in one
+    batch request, so that they are then resolved locally
+    '''
+    cache = _cache()
+    if name in cache['prefetched']:
+        return
+    cache['prefetched'].add(name)
+    with _zapi().batch() as batch:
+        batch.add('template.get', {'output': 'extend',
+                                   'filter': {'host': name},
+                                   'selectApplications': 'extend'})
+        batch.add('item.get', {'output': 'extend',
+                               'host': name,
+                               'templated': True,
+                               'selectApplications': ['applicationid']})
+    templates, items = batch.results
+    for template in templates:
+        tpid = template['templateid']
+        applications = template.pop('applications', [])
+        for key in ({'host': name}, {'name': template.get('name', name)}):
+            cache['found'][_filter_key('Template', key)] = [template]
+        cache['complete'][('Application', tpid)] = applications
+        cache['complete'][('Item', tpid)] = [x for x in items if x.get('hostid') == tpid]
+
+
 def _hostgroup(name):
-    if not zapi.Hostgroup.find({"name": name}):
-        zapi.Hostgroup.create({"name": name})
+    if not _find('Hostgroup', {"name": name}):
+        _create('Hostgroup', {"name": name}, {"name": name})
 
-    if not zapi.Hostgroup.find({"name": name}):
+    if not _find('Hostgroup', {"name": name}):
         return False
     else:
         return True
@@ -48,32 +199,33 @@ def hostgroup(name):
 def _host(name, hostgroups, interface="127.0.0.1", templates=None):
     for hostgroup in hostgroups:
         _hostgroup(hostgroup)
-    hgs = zapi.Hostgroup.find({"name": hostgroups})
+    hgs = _find('Hostgroup', {"name": hostgroups})
     hgids = [{'groupid': x['groupid']} for x in hgs]
 
     tpids = []
     if templates:
-        tps = zapi.Template.find({"name": templates})
+        tps = _find('Template', {"name": templates})
         tpids = [{'templateid': x['templateid']} for x in tps]
 
-    if not zapi.Host.find({"name": name}):
-        zapi.Host.create({
+    hosts = _find('Host', {"name": name})
+    if not hosts:
+        _create('Host', {
             "host": name,
             "groups": hgids,
             "templates": tpids,
             "interfaces": [{"type": "1", "main": "1", "useip": "1",
                             "ip": interface, "dns": "", "port": "10050"}]
-        })
+        }, {"name": name})
     else:
-        zapi.Host.update({
-            "hostid": zapi.Host.find({"name": name})[0]["hostid"],
+        _update('Host', {
+            "hostid": hosts[0]["hostid"],
             "groups": hgids,
             "templates": tpids,
             #            "interfaces":[{"type":"1","main":"1","useip":"1",
             #                        "ip":interface,"dns":"","port":"10050"}]
         })
 
-    if not zapi.Host.find({"name": name}):
+    if not _find('Host', {"name": name}):
         return False
     else:
         return True
@@ -97,10 +249,17 @@ def host(name, hostgroups, interface="127.0.0.1", templates=None):
 
 
 def _template(name):
-    if not zapi.Template.find({"host": name}):
-        zapi.Template.create({"host": name, "groups": {"groupid": "1"}})
-
-    if not zapi.Template.find({"host": name}):
+    _prefetch_template(name)
+    if not _find('Template', {"host": name}):
+        tp = _create('Template', {"host": name, "groups": {"groupid": "1"}}, {"host": name})
+        tp['name'] = name
+        cache = _cache()
+        cache['found'][_filter_key('Template', {"name": name})] = [tp]
+        # A new template has no applications nor items yet
+        cache['complete'][('Application', tp['templateid'])] = []
+        cache['complete'][('Item', tp['templateid'])] = []
+
+    if not _find('Template', {"host": name}):
         return False
     else:
         return True
@@ -109,15 +268,15 @@ def _template(name):
 def _application(name, template):
     _template(template)
 
-    tp = zapi.Template.find({"name": template})
+    tp = _find('Template', {"name": template})
     if not tp:
         return False
     tpid = tp[0]["templateid"]
 
-    if not zapi.Application.find({"name": name, "hostid": tpid}):
-        zapi.Application.create({"name": name, "hostid": tpid})
+    if not _find('Application', {"name": name, "hostid": tpid}):
+        _create('Application', {"name": name, "hostid": tpid}, {"name": name, "hostid": tpid})
 
-    if not zapi.Application.find({"name": name, "hostid": tpid}):
+    if not _find('Application', {"name": name, "hostid": tpid}):
         return False
     else:
         return True
@@ -143,27 +302,28 @@ def application(name):
 def _item(name, key, template, application, itemtype=0, valuetype=0, datatype=0, delta=0, delay=60):
     _application(application, template)
 
-    tp = zapi.Template.find({"name": template})
+    tp = _find('Template', {"name": template})
     if not tp:
         return False
     tpid = tp[0]["templateid"]
 
-    app = zapi.Application.find({"name": application, "hostid": tpid})
+    app = _find('Application', {"name": application, "hostid": tpid})
     if not app:
         return False
     appid = app[0]["applicationid"]
 
-    if not zapi.Item.find({"name": name, "key_": key, "hostid": tpid, "application": appid}):
-        zapi.Item.create({"name": name, "key_": key, "hostid": tpid, "applications": [appid],
-                          "type": itemtype, "value_type": valuetype, "data_type": datatype,
-                          "delta": delta, "delay": delay})
+    lookup = {"name": name, "key_": key, "hostid": tpid, "application": appid}
+    items = _find('Item', lookup)
+    if not items:
+        _create('Item', {"name": name, "key_": key, "hostid": tpid, "applications": [appid],
+                         "type": itemtype, "value_type": valuetype, "data_type": datatype,
+                         "delta": delta, "delay": delay}, lookup)
     else:
-        itemid = zapi.Item.find({"name": name, "key_": key, "hostid": tpid, "application": appid})[0]["itemid"]
-        zapi.Item.update({"itemid": itemid,
-                          "type": itemtype, "value_type": valuetype, "data_type": datatype,
-                          "delta": delta, "delay": delay})
+        _update('Item', {"itemid": items[0]["itemid"],
+                         "type": itemtype, "value_type": valuetype, "data_type": datatype,
+                         "delta": delta, "delay": delay})
 
-    if not zapi.Item.find({"name": name, "key_": key, "hostid": tpid, "application": appid}):
+    if not _find('Item', lookup):
         return False
     else:
         return True
@@ -268,36 +428,36 @@ color = [
 def _graph(name, width, height, template, application, keys, graphtype=0, ymax_type=0, yaxismax=0, ymin_type=0, yaxismin=0):
     _template(template)
 
-    tp = zapi.Template.find({"name": template})
+    tp = _find('Template', {"name": template})
     if not tp:
         return False
     tpid = tp[0]["templateid"]
 
-    app = zapi.Application.find({"name": application, "hostid": tpid})
+    app = _find('Application', {"name": application, "hostid": tpid})
     if not app:
         return False
     appid = app[0]["applicationid"]
 
     gitems = []
     for key in keys:
-        if not zapi.Item.find({"key_": key, "hostid": tpid, "application": appid}):
+        if not _find('Item', {"key_": key, "hostid": tpid, "application": appid}):
             return False
-        gitems.append({"itemid": zapi.Item.find({"key_": key, "hostid": tpid, "application": appid})
+        gitems.append({"itemid": _find('Item', {"key_": key, "hostid": tpid, "application": appid})
                        [0]["itemid"], "color": color[len(gitems)]})
 
-    if not zapi.Graph.find({"name": name}):
-        zapi.Graph.create({"name": name, "width": width, "height": height,
-                           "graphtype": graphtype, "ymax_type": ymax_type, "yaxismax": yaxismax,
-                           "ymin_type": ymin_type, "yaxismin": yaxismin,
-                           "gitems": gitems})
+    if not _find('Graph', {"name": name}):
+        _create('Graph', {"name": name, "width": width, "height": height,
+                          "graphtype": graphtype, "ymax_type": ymax_type, "yaxismax": yaxismax,
+                          "ymin_type": ymin_type, "yaxismin": yaxismin,
+                          "gitems": gitems}, {"name": name})
     else:
-        graphid = zapi.Graph.find({"name": name})[0]["graphid"]
-        zapi.Graph.update({"graphid": graphid, "width": width, "height": height,
-                           "graphtype": graphtype, "ymax_type": ymax_type, "yaxismax": yaxismax,
-                           "ymin_type": ymin_type, "yaxismin": yaxismin,
-                           "gitems": gitems})
+        graphid = _find('Graph', {"name": name})[0]["graphid"]
+        _update('Graph', {"graphid": graphid, "width": width, "height": height,
+                          "graphtype": graphtype, "ymax_type": ymax_type, "yaxismax": yaxismax,
+                          "ymin_type": ymin_type, "yaxismin": yaxismin,
+                          "gitems": gitems})
 
-    if not zapi.Graph.find({"name": name}):
+    if not _find('Graph', {"name": name}):
         return False
     else:
         return True
@@ -322,15 +482,15 @@ def graph(name, width, height, application, keys, graphtype=0, ymax_type=0, yaxi
 
 
 def _usergroup(name, debug_mode=0, gui_access=0, status=0):
-    if not zapi.Usergroup.find({"name": name}):
-        zapi.Usergroup.create({"name": name, "debug_mode": debug_mode,
-                               "gui_access": gui_access, "users_status": status})
+    if not _find('Usergroup', {"name": name}):
+        _create('Usergroup', {"name": name, "debug_mode": debug_mode,
+                              "gui_access": gui_access, "users_status": status}, {"name": name})
     else:
-        ugid = zapi.Usergroup.find({"name": name})[0]["usrgrpid"]
-        zapi.Usergroup.update({"usrgrpid": ugid, "debug_mode": debug_mode,
-                               "gui_access": gui_access, "users_status": status})
+        ugid = _find('Usergroup', {"name": name})[0]["usrgrpid"]
+        _update('Usergroup', {"usrgrpid": ugid, "debug_mode": debug_mode,
+                              "gui_access": gui_access, "users_status": status})
 
-    if not zapi.Usergroup.find({"name": name}):
+    if not _find('Usergroup', {"name": name}):
         return False
     else:
         return True
@@ -356,16 +516,16 @@ def usergroup(name, debug_mode=0, gui_access=0, status=0):
 def _user(name, lastname, firstname, passwd, usergroups, sendto, usertype="3", mediatype="Send Email", period="1-7,00:00-24:00", severity="63"):
     for usergroup in usergroups:
         _usergroup(usergroup)
-    ugs = zapi.Usergroup.find({"name": usergroups})
+    ugs = _find('Usergroup', {"name": usergroups})
     ugids = [{'usrgrpid': x['usrgrpid']} for x in ugs]
 
-    if not zapi.User.find({"alias": name}):
-        zapi.User.create({"alias": name, "name": lastname, "surname": firstname,
-                          "passwd": passwd, "type": usertype, "usrgrps": ugids})
+    if not _find('User', {"alias": name}):
+        _create('User', {"alias": name, "name": lastname, "surname": firstname,
+                         "passwd": passwd, "type": usertype, "usrgrps": ugids}, {"alias": name})
     else:
-        uid = zapi.User.find({"alias": name})[0]["userid"]
-        zapi.User.update({"userid": uid, "name": lastname, "surname": firstname,
-                          "passwd": passwd, "type": usertype, "usrgrps": ugids})
+        uid = _find('User', {"alias": name})[0]["userid"]
+        _update('User', {"userid": uid, "name": lastname, "surname": firstname,
+                         "passwd": passwd, "type": usertype, "usrgrps": ugids})
 
     _mediatype(mediatype, "0")
     _mediatype("Send Cloud", "1", "sendcloud")
@@ -373,7 +533,7 @@ def _user(name, lastname, firstname, passwd, usergroups, sendto, usertype="3", m
     _media(name, mediatype, sendto, 0, period, severity)
     _media(name, "Send Cloud", sendto, 0, period, severity)
 
-    if not zapi.User.find({"alias": name}):
+    if not _find('User', {"alias": name}):
         return False
     else:
         return True
@@ -397,14 +557,15 @@ def user(name, lastname, firstname, passwd, usergroups, sendto, usertype="3", me
 
 
 def _trigger(name, expression, priority=1, status=0):
-    if not zapi.Trigger.find({"description": name}):
-        zapi.Trigger.create({"description": name, "expression": expression, "priority": priority, "status": status})
+    if not _find('Trigger', {"description": name}):
+        _create('Trigger', {"description": name, "expression": expression,
+                            "priority": priority, "status": status}, {"description": name})
     else:
-        triggerid = zapi.Trigger.find({"description": name})[0]["triggerid"]
-        zapi.Trigger.update({"triggerid": triggerid,
-                             "expression": expression, "priority": priority, "status": status})
+        triggerid = _find('Trigger', {"description": name})[0]["triggerid"]
+        _update('Trigger', {"triggerid": triggerid,
+                            "expression": expression, "priority": priority, "status": status})
 
-    if not zapi.Trigger.find({"description": name}):
+    if not _find('Trigger', {"description": name}):
         return False
     else:
         return True
@@ -429,14 +590,14 @@ def trigger(name, expression, priority=1, status=0):
 
 
 def _script(name, command, execute_on=1):
-    if not zapi.Script.find({"name": name}):
-        zapi.Script.create({"name": name, "command": command, "execute_on": execute_on})
+    if not _find('Script', {"name": name}):
+        _create('Script', {"name": name, "command": command, "execute_on": execute_on}, {"name": name})
     else:
-        scriptid = zapi.Script.find({"name": name})[0]["scriptid"]
-        zapi.Script.update({"scriptid": scriptid,
-                            "command": command, "execute_on": execute_on})
+        scriptid = _find('Script', {"name": name})[0]["scriptid"]
+        _update('Script', {"scriptid": scriptid,
+                           "command": command, "execute_on": execute_on})
 
-    if not zapi.Script.find({"name": name}):
+    if not _find('Script', {"name": name}):
         return False
     else:
         return True
@@ -463,48 +624,49 @@ def _mediatype(name, mtype, script=""):
     if int(mtype) != 0 and int(mtype) != 1:
         return False
 
-    if not zapi.Mediatype.find({"description": name}):
+    if not _find('Mediatype', {"description": name}):
         if int(mtype) == 0:
-            zapi.Mediatype.create({"description": name, "type": mtype,
-                                   "smtp_email": "zabbix@localhost", "smtp_helo": "localhost",
-                                   "smtp_server": "localhost"})
+            _create('Mediatype', {"description": name, "type": mtype,
+                                  "smtp_email": "zabbix@localhost", "smtp_helo": "localhost",
+                                  "smtp_server": "localhost"}, {"description": name})
         else:
-            zapi.Mediatype.create({"description": name, "type": mtype, "exec_path": script})
+            _create('Mediatype', {"description": name, "type": mtype, "exec_path": script}, {"description": name})
     else:
-        mediatypeid = zapi.Mediatype.find({"description": name})[0]["mediatypeid"]
+        mediatypeid = _find('Mediatype', {"description": name})[0]["mediatypeid"]
         if int(mtype) == 0:
-            zapi.Mediatype.update({"mediatypeid": mediatypeid, "type": mtype,
-                                   "smtp_email": "zabbix@localhost", "smtp_helo": "localhost",
-                                   "smtp_server": "localhost"})
+            _update('Mediatype', {"mediatypeid": mediatypeid, "type": mtype,
+                                  "smtp_email": "zabbix@localhost", "smtp_helo": "localhost",
+                                  "smtp_server": "localhost"})
         else:
-            zapi.Mediatype.update({"mediatypeid": mediatypeid,
-                                   "type": mtype, "exec_path": script})
+            _update('Mediatype', {"mediatypeid": mediatypeid,
+                                  "type": mtype, "exec_path": script})
 
-    if not zapi.Mediatype.find({"description": name}):
+    if not _find('Mediatype', {"description": name}):
         return False
     else:
         return True
 
 
 def _media(user, mediatype, sendto, active=0, period="1-7,00:00-24:00", severity="63"):
-    u = zapi.User.find({"alias": user})
+    u = _find('User', {"alias": user})
     if not u:
         return False
     uid = u[0]["userid"]
 
-    mt = zapi.Mediatype.find({"description": mediatype})
+    mt = _find('Mediatype', {"description": mediatype})
     if not mt:
         return False
     mtid = mt[0]["mediatypeid"]
 
-    if not zapi.Usermedia.find({"userid": uid, "mediatypeid": mtid}):
-        zapi.User.addmedia({"users": [{"userid": uid}],
+    if not _find('Usermedia', {"userid": uid, "mediatypeid": mtid}):
+        _zapi().User.addmedia({"users": [{"userid": uid}],
                             "medias": {"mediatypeid": mtid, "sendto": sendto, "active": active, "period": period, "severity": severity}})
     else:
-        zapi.User.updatemedia({"users": [{"userid": uid}],
+        _zapi().User.updatemedia({"users": [{"userid": uid}],
                                "medias": {"mediatypeid": mtid, "sendto": sendto, "active": active, "period": period, "severity": severity}})
+    _invalidate('Usermedia')
 
-    if not zapi.Usermedia.find({"mediatypeid": mtid, "userid": uid}):
+    if not _find('Usermedia', {"mediatypeid": mtid, "userid": uid}):
         return False
     else:
         return True
@@ -513,7 +675,7 @@ def _media(user, mediatype, sendto, active=0, period="1-7,00:00-24:00", severity
 def _action(name, trigger_filter, notify_usergroup, mediatype="Send Email", status=0, esc_period=60,
             def_shortdata="{HOST.HOST} {TRIGGER.NAME}: {TRIGGER.STATUS}",
             def_longdata="Latest value: {{HOST.HOST}:{ITEM.KEY}.last(0)}\r\nMAX for 15 minutes: {{HOST.HOST}:{ITEM.KEY}.max(900)}\r\nMIN for 15 minutes: {{HOST.HOST}:{ITEM.KEY}.min(900)}\r\n\r\n{TRIGGER.URL}"):
-    ug = zapi.Usergroup.find({"name": notify_usergroup})
+    ug = _find('Usergroup', {"name": notify_usergroup})
     if not ug:
         return False
     ugid = ug[0]["usrgrpid"]
@@ -521,28 +683,28 @@ def _action(name, trigger_filter, notify_usergroup, mediatype="Send Email", stat
     _mediatype(mediatype, "0")
     _mediatype("Send Cloud", "1", "sendcloud")
 
-    mt = zapi.Mediatype.find({"description": "Send Cloud"})
+    mt = _find('Mediatype', {"description": "Send Cloud"})
     if not mt:
         return False
     mtid = mt[0]["mediatypeid"]
 
-    if not zapi.Action.find({"name": name}):
-        zapi.Action.create({"name": name, "eventsource": "0", "evaltype": "0", "status": status,
-                            "esc_period": esc_period, "def_shortdata": def_shortdata, "def_longdata": def_longdata,
-                            "conditions": [{"conditiontype": 3, "operator": 2, "value": trigger_filter}],
-                            "operations": [{"operationtype": 0, "esc_period": 0, "esc_step_from": 1, "esc_step_to": 1,
-                                            "evaltype": 0, "opmessage_grp": [{"usrgrpid": ugid}],
-                                            "opmessage": {"default_msg": 1, "mediatypeid": mtid}}]})
+    if not _find('Action', {"name": name}):
+        _create('Action', {"name": name, "eventsource": "0", "evaltype": "0", "status": status,
+                           "esc_period": esc_period, "def_shortdata": def_shortdata, "def_longdata": def_longdata,
+                           "conditions": [{"conditiontype": 3, "operator": 2, "value": trigger_filter}],
+                           "operations": [{"operationtype": 0, "esc_period": 0, "esc_step_from": 1, "esc_step_to": 1,
+                                           "evaltype": 0, "opmessage_grp": [{"usrgrpid": ugid}],
+                                           "opmessage": {"default_msg": 1, "mediatypeid": mtid}}]}, {"name": name})
     else:
-        actionid = zapi.Action.find({"name": name})[0]["actionid"]
-        zapi.Action.update({"actionid": actionid, "eventsource": "0", "evaltype": "0", "status": status,
-                            "esc_period": esc_period, "def_shortdata": def_shortdata, "def_longdata": def_longdata,
-                            "conditions": [{"conditiontype": 3, "operator": 2, "value": trigger_filter}],
-                            "operations": [{"operationtype": 0, "esc_period": 0, "esc_step_from": 1, "esc_step_to": 1,
-                                            "evaltype": 0, "opmessage_grp": [{"usrgrpid": ugid}],
-                                            "opmessage": {"default_msg": 1, "mediatypeid": mtid}}]})
-
-    if not zapi.Action.find({"name": name}):
+        actionid = _find('Action', {"name": name})[0]["actionid"]
+        _update('Action', {"actionid": actionid, "eventsource": "0", "evaltype": "0", "status": status,
+                           "esc_period": esc_period, "def_shortdata": def_shortdata, "def_longdata": def_longdata,
+                           "conditions": [{"conditiontype": 3, "operator": 2, "value": trigger_filter}],
+                           "operations": [{"operationtype": 0, "esc_period": 0, "esc_step_from": 1, "esc_step_to": 1,
+                                           "evaltype": 0, "opmessage_grp": [{"usrgrpid": ugid}],
+                                           "opmessage": {"default_msg": 1, "mediatypeid": mtid}}]})
+
+    if not _find('Action', {"name": name}):
         return False
     else:
         return True
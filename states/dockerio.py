@@ -392,23 +392,31 @@ def pulled(name,
 
     insecure_registry
         Set to ``True`` to allow connections to non-HTTPS registries. Default ``False``.
+
+    With ``aggregate: True``, the images of all the pulled states of the run
+    are pulled in parallel when the first of them runs (see mod_aggregate).
     '''
 
-    inspect_image = __salt__['docker.inspect_image']
     image_name = _get_image_name(name, tag)
-    image_infos = inspect_image(image_name)
-    if image_infos['status'] and not force:
-        return _valid(
-            name=name,
-            comment='Image already pulled: {0}'.format(image_name))
+    prefetched = __context__.get('docker.prefetched', {}).pop((name, tag), None)
+    if prefetched is not None:
+        # pulled along with the other images of the run, see mod_aggregate
+        previous_id, returned = prefetched
+    else:
+        inspect_image = __salt__['docker.inspect_image']
+        image_infos = inspect_image(image_name)
+        if image_infos['status'] and not force:
+            return _valid(
+                name=name,
+                comment='Image already pulled: {0}'.format(image_name))
 
-    if __opts__['test']:
-        comment = 'Image {0} will be pulled'.format(image_name)
-        return _ret_status(name=name, comment=comment)
+        if __opts__['test']:
+            comment = 'Image {0} will be pulled'.format(image_name)
+            return _ret_status(name=name, comment=comment)
 
-    previous_id = image_infos['out']['Id'] if image_infos['status'] else None
-    pull = __salt__['docker.pull']
-    returned = pull(name, tag=tag, insecure_registry=insecure_registry)
+        previous_id = image_infos['out']['Id'] if image_infos['status'] else None
+        pull = __salt__['docker.pull']
+        returned = pull(name, tag=tag, insecure_registry=insecure_registry)
     if previous_id != returned['id']:
         changes = {name: {'old': previous_id,
                           'new': returned['id']}}
@@ -419,6 +427,58 @@ def pulled(name,
     return _ret_status(returned, name, changes=changes, comment=comment)
 
 
+def mod_aggregate(low, chunks, running):
+    '''
+    Prefetch the images of all the docker.pulled states of the run together,
+    with docker.pull_many, when the first of them runs. This happens when the
+    state aggregation is enabled, for a state with ``aggregate: True``:
+
+    .. code-block:: yaml
+
+        ubuntu:
+          docker.pulled:
+            - tag: 14.04
+            - aggregate: True
+
+    or for all of them with ``state_aggregate: True`` in the minion config.
+    At most ``docker.prefetch_workers`` (4 by default) images are pulled at
+    the same time. The pulled states then report the prefetched results.
+    '''
+    if low.get('fun') != 'pulled' or __opts__['test']:
+        return low
+
+    # insecure_registry -> (name, tag) -> id of the image before the pull
+    wanted = {}
+    for chunk in chunks:
+        if chunk.get('state') != 'docker' or chunk.get('fun') != 'pulled':
+            continue
+        if '__agg__' in chunk or salt.utils.gen_state_tag(chunk) in running:
+            continue
+        chunk['__agg__'] = True
+        name, tag = chunk['name'], chunk.get('tag', 'latest')
+        image_infos = __salt__['docker.inspect_image'](_get_image_name(name, tag))
+        if image_infos['status'] and not chunk.get('force', False):
+            continue
+        previous_id = image_infos['out']['Id'] if image_infos['status'] else None
+        insecure_registry = chunk.get('insecure_registry', False)
+        wanted.setdefault(insecure_registry, {})[(name, tag)] = previous_id
+
+    prefetched = __context__.setdefault('docker.prefetched', {})
+    workers = __salt__['config.option']('docker.prefetch_workers') or 4
+    for insecure_registry, images in six.iteritems(wanted):
+        log.info('Prefetching {0} docker images'.format(len(images)))
+        returned = __salt__['docker.pull_many'](
+            [{name: tag} for name, tag in sorted(images)],
+            workers=workers,
+            insecure_registry=insecure_registry)
+        results = (returned.get('out') or {}).get('images', {})
+        for (name, tag), previous_id in six.iteritems(images):
+            image_status = results.get('{0}:{1}'.format(name, tag))
+            if image_status is not None:
+                prefetched[(name, tag)] = (previous_id, image_status)
+    return low
+
+
 def pushed(name, tag='latest', insecure_registry=False):
     '''
     Push an image from a docker registry. (`docker push`)
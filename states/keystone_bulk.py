@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+'''
+Bulk management of Keystone tenants, users, roles and user-roles.
+=================================================================
+
+NOTE: This module requires the proper pillar values set. See
+salt.modules.keystone for more information.
+
+The keystone_bulk module reconciles the complete desired set of Keystone
+objects in one state, listing each collection once and applying the
+differences concurrently, instead of checking and creating objects one at a
+time like the keystone_tenant, keystone_user, keystone_role and
+keystone_user_role states do.
+
+.. code-block:: yaml
+
+    keystone-objects:
+      keystone_bulk.managed:
+        - tenants:
+          - admin
+          - demo
+        - roles:
+          - admin
+          - Member
+        - users:
+            jack:
+              password: zero
+              email: jack@halloweentown.org
+              tenant: demo
+              enabled: True
+        - user_roles:
+          - user: jack
+            role: Member
+            tenant: demo
+        - workers: 8
+'''
+
+
+def __virtual__():
+    '''
+    Only load if the keystone module is in __salt__
+    '''
+    return 'keystone_bulk' if 'keystone.reconcile' in __salt__ else False
+
+
+def managed(name,
+            tenants=None,
+            users=None,
+            roles=None,
+            user_roles=None,
+            prune=False,
+            workers=8):
+    '''
+    Ensure that the passed tenants, users, roles and user-roles are present
+
+    name
+        An arbitrary name for this set of objects
+    tenants
+        List of tenant names, or dict of tenant names to their
+        ``description`` and ``enabled`` settings
+    users
+        Dict of user names to their ``password``, ``email``, ``tenant`` and
+        ``enabled`` settings
+    roles
+        List of role names
+    user_roles
+        List of dicts with the ``user``, ``role`` and ``tenant`` names
+    prune
+        Also remove the objects of the passed collections which are not
+        listed, see salt.modules.keystone.reconcile
+    workers
+        Maximum number of concurrent requests made to Keystone
+    '''
+    ret = {
+        'name': name,
+        'changes': {},
+        'result': True,
+        'comment': 'Keystone objects are already in the desired state'
+    }
+    diff = __salt__['keystone.reconcile'](
+        tenants=tenants,
+        users=users,
+        roles=roles,
+        user_roles=user_roles,
+        prune=prune,
+        workers=workers,
+        test=__opts__['test'],
+    )
+    for section in ('created', 'updated', 'deleted'):
+        if diff[section]:
+            ret['changes'][section] = diff[section]
+
+    if diff['errors']:
+        ret['result'] = False
+        ret['comment'] = 'Failed to reconcile Keystone objects: {0}'.format(
+            '; '.join(diff['errors']))
+    elif ret['changes']:
+        if __opts__['test']:
+            ret['result'] = None
+            ret['comment'] = 'Keystone objects are set to be reconciled'
+            ret['changes'] = {}
+        else:
+            ret['comment'] = 'Keystone objects have been reconciled'
+    return ret
@@ -5,28 +5,62 @@ try:
 except ImportError:
     import json
 
-import urllib2
+import errno
+import httplib
+import socket
 import subprocess
+import threading
+import time
+import urlparse
 
 
 class ZabbixAPIException(Exception):
     pass
 
 
+# Substrings of the error data returned by Zabbix when the session is invalid
+AUTH_ERRORS = ('re-login', 'Not authorised', 'Not authorized')
+
+
+def _closedByPeer(exc):
+    '''
+    Return True if the exception tells that the server closed the connection
+    without answering the request
+    '''
+    if isinstance(exc, httplib.BadStatusLine):
+        return True
+    return isinstance(exc, socket.error) and exc.errno == errno.ECONNRESET
+
+
 class ZabbixAPI(object):
     __auth = ''
+    __auth_time = 0
     __id = 0
     _state = {}
+    _state_lock = threading.Lock()
+    # The instance is shared, so are its locks
+    _id_lock = threading.Lock()
+    _login_lock = threading.Lock()
 
     def __new__(cls, *args, **kw):
-        if not cls._state.has_key(cls):
-            cls._state[cls] = super(ZabbixAPI, cls).__new__(cls, *args, **kw)
+        with cls._state_lock:
+            if cls not in cls._state:
+                cls._state[cls] = super(ZabbixAPI, cls).__new__(cls)
         return cls._state[cls]
 
-    def __init__(self, url, user, password):
+    def __init__(self, url, user, password, timeout=30, session_ttl=900):
+        '''
+        session_ttl is the number of seconds after which the auth token is
+        renewed by ensureLogin(). The token is also renewed whenever Zabbix
+        reports that the session is no longer valid.
+        '''
         self.__url = url.rstrip('/') + '/api_jsonrpc.php'
         self.__user = user
         self.__password = password
+        self.__timeout = timeout
+        self.__session_ttl = session_ttl
+        # Connections are not thread safe, each thread keeps its own
+        self.__local = threading.local()
         self._zabbix_api_object_list = ('Action', 'Alert', 'APIInfo', 'Application', 'DCheck', 'DHost', 'DRule',
                                         'DService', 'Event', 'Graph', 'Grahpitem', 'History', 'Host', 'Hostgroup', 'Image', 'Item',
                                         'Maintenance', 'Map', 'Mediatype', 'Proxy', 'Screen', 'Script', 'Template', 'Trigger', 'User',
@@ -42,37 +76,166 @@ class ZabbixAPI(object):
     def login(self):
         user_info = {'user': self.__user,
                      'password': self.__password}
+        self.__auth = ''
         obj = self.json_obj('user.login', user_info)
         content = self.postRequest(obj)
         try:
             self.__auth = content['result']
+            self.__auth_time = time.time()
         except KeyError, e:
             e = content['error']['data']
             raise ZabbixAPIException(e)
 
+    def ensureLogin(self):
+        '''
+        Log in if there is no auth token yet, or if it is older than
+        session_ttl
+        '''
+        with self._login_lock:
+            if not self.isLogin() or \
+                    (self.__session_ttl and time.time() - self.__auth_time > self.__session_ttl):
+                self.login()
+
+    def authToken(self):
+        return self.__auth
+
+    def relogin(self, stale_auth):
+        '''
+        Log in again, unless another thread already replaced stale_auth
+        '''
+        with self._login_lock:
+            if self.__auth == stale_auth:
+                self.login()
+
     def isLogin(self):
         return self.__auth != ''
 
+    @staticmethod
+    def isAuthError(content):
+        try:
+            data = '%s %s' % (content['error'].get('message', ''), content['error'].get('data', ''))
+        except (KeyError, TypeError, AttributeError):
+            return False
+        return any(x in data for x in AUTH_ERRORS)
+
+    def nextId(self):
+        with self._id_lock:
+            self.__id += 1
+            return self.__id
+
+    def call(self, method_name, params):
+        '''
+        Call an API method and return its result, logging in again and
+        retrying once if the session is no longer valid
+        '''
+        auth = self.__auth
+        content = self.postRequest(self.json_obj(method_name, params))
+        if self.isAuthError(content):
+            self.relogin(auth)
+            content = self.postRequest(self.json_obj(method_name, params))
+        try:
+            return content['result']
+        except KeyError:
+            raise ZabbixAPIException(content['error']['data'])
+
     def __checkAuth__(self):
         if not self.isLogin():
             raise ZabbixAPIException("NOT logged in")
 
+    def json_dict(self, method, params, id=None):
+        if id is None:
+            id = self.nextId()
+        return {'jsonrpc': '2.0',
+                'method': method,
+                'params': params,
+                'auth': self.__auth,
+                'id': id}
+
     def json_obj(self, method, params):
-        obj = {'jsonrpc': '2.0',
-               'method': method,
-               'params': params,
-               'auth': self.__auth,
-               'id': self.__id}
-        return json.dumps(obj)
+        return json.dumps(self.json_dict(method, params))
+
+    def __connection(self):
+        '''
+        Return the persistent connection of the current thread to the API,
+        opening it if needed. The connection is kept alive and reused by every
+        request made by the thread.
+        '''
+        if getattr(self.__local, 'conn', None) is None:
+            parsed = urlparse.urlsplit(self.__url)
+            if parsed.scheme == 'https':
+                conn_class = httplib.HTTPSConnection
+            else:
+                conn_class = httplib.HTTPConnection
+            self.__local.conn = conn_class(parsed.netloc, timeout=self.__timeout)
+        return self.__local.conn
+
+    def close(self):
+        if getattr(self.__local, 'conn', None) is not None:
+            self.__local.conn.close()
+            self.__local.conn = None
+
+    def __post(self, body):
+        headers = {'Content-Type': 'application/json-rpc',
+                   'User-Agent': 'python/zabbix_api',
+                   'Connection': 'keep-alive'}
+        path = urlparse.urlsplit(self.__url).path
+        # The server may have closed an idle keep-alive connection, in which
+        # case the request is retried once on a new connection. Nothing else
+        # is retried: after a timeout for instance, Zabbix may already have
+        # run the request, and a create or update must not run twice.
+        for attempt in (0, 1):
+            conn = self.__connection()
+            reused = conn.sock is not None
+            sent = False
+            try:
+                conn.request('POST', path, body, headers)
+                sent = True
+                response = conn.getresponse()
+                # The response must be read entirely before the connection
+                # can be reused
+                data = response.read()
+                break
+            except (httplib.HTTPException, socket.error), e:
+                self.close()
+                if attempt or not reused or isinstance(e, socket.timeout) or \
+                        (sent and not _closedByPeer(e)):
+                    raise
+        if response.status != 200:
+            raise ZabbixAPIException('HTTP error %s: %s' % (response.status, response.reason))
+        if response.getheader('connection', '').lower() == 'close':
+            self.close()
+        return json.loads(data)
 
     def postRequest(self, json_obj):
-        headers = {'Content-Type': 'application/json-rpc',
-                   'User-Agent': 'python/zabbix_api'}
-        req = urllib2.Request(self.__url, json_obj, headers)
-        opener = urllib2.urlopen(req)
-        content = json.loads(opener.read())
-        self.__id += 1
-        return content
+        return self.__post(json_obj)
+
+    def postBatch(self, json_objs):
+        '''
+        Send a list of json_dict objects in one JSON-RPC batch request, and
+        return the list of responses in the same order as the requests.
+        '''
+        if not json_objs:
+            return []
+        content = self.__post(json.dumps(json_objs))
+        if isinstance(content, dict):
+            # A single error object is returned when the whole batch is invalid
+            raise ZabbixAPIException(content.get('error', {}).get('data', content))
+        by_id = dict((x.get('id'), x) for x in content)
+        return [by_id.get(x['id'], {}) for x in json_objs]
+
+    def batch(self):
+        '''
+        Return a ZabbixAPIBatch queueing method calls to be sent in a single
+        request:
+
+            with zapi.batch() as batch:
+                batch.add('host.get', {'filter': {'host': 'a'}})
+                batch.add('host.get', {'filter': {'host': 'b'}})
+            hosts_a, hosts_b = batch.results
+        '''
+        self.__checkAuth__()
+        return ZabbixAPIBatch(self)
+
 
     '''
     /usr/local/zabbix/bin/zabbix_get is the default path to zabbix_get, it depends on the 'prefix' while install zabbix.
@@ -106,24 +269,14 @@ def checkAuth(func):
 def postJson(method_name):
     def decorator(func):
         def wrapper(self, params):
-            try:
-                content = self.postRequest(self.json_obj(method_name, params))
-                return content['result']
-            except KeyError, e:
-                e = content['error']['data']
-                raise ZabbixAPIException(e)
+            return self.call(method_name, params)
         return wrapper
     return decorator
 
 
 def ZabbixAPIObjectMethod(func):
     def wrapper(self, method_name, params):
-        try:
-            content = self.postRequest(self.json_obj(method_name, params))
-            return content['result']
-        except KeyError, e:
-            e = content['error']['data']
-            raise ZabbixAPIException(e)
+        return self.call(method_name, params)
     return wrapper
 
 
@@ -141,14 +294,24 @@ class ZabbixAPIObjectFactory(object):
     def json_obj(self, method, param):
         return self.__zapi.json_obj(method, param)
 
+    def call(self, method_name, params):
+        return self.__zapi.call(method_name, params)
+
     def __getattr__(self, method_name):
         def method(params):
             return self.proxyMethod('%s.%s' % (self.__object_name, method_name), params)
         return method
 
-    def find(self, params, attr_name=None, to_create=False):
+    def find(self, params, attr_name=None, to_create=False, output=None):
+        '''
+        Return the objects matching the filter in params. Only the fields
+        listed in output are returned, which defaults to attr_name when it is
+        passed and to all fields otherwise.
+        '''
         filtered_list = []
-        result = self.proxyMethod('%s.get' % self.__object_name, {'output': 'extend', 'filter': params})
+        if output is None:
+            output = [attr_name] if attr_name is not None else 'extend'
+        result = self.proxyMethod('%s.get' % self.__object_name, {'output': output, 'filter': params})
         if to_create and len(result) == 0:
             result = self.proxyMethod('%s.create' % self.__object_name, params)
             return result.values()[0]
@@ -165,6 +328,61 @@ class ZabbixAPIObjectFactory(object):
         pass
 
 
+class ZabbixAPIBatch(object):
+    '''
+    Queue of API method calls sent as a single JSON-RPC batch request
+    '''
+    def __init__(self, zapi):
+        self.__zapi = zapi
+        self.__calls = []
+        self.results = None
+
+    def __len__(self):
+        return len(self.__calls)
+
+    def add(self, method_name, params):
+        '''
+        Queue a call and return its index in the results
+        '''
+        self.__calls.append((method_name, params))
+        return len(self.__calls) - 1
+
+    def find(self, object_name, params, attr_name=None, output=None):
+        '''
+        Queue a <object_name>.get call filtered like ZabbixAPIObjectFactory.find
+        '''
+        if output is None:
+            output = [attr_name] if attr_name is not None else 'extend'
+        return self.add('%s.get' % object_name.lower(), {'output': output, 'filter': params})
+
+    def send(self):
+        '''
+        Send the queued calls and return their results in order. Raises
+        ZabbixAPIException if any of the calls failed.
+        '''
+        calls, self.__calls = self.__calls, []
+        auth = self.__zapi.authToken()
+        responses = self.__zapi.postBatch([self.__zapi.json_dict(method, params) for method, params in calls])
+        if any(self.__zapi.isAuthError(x) for x in responses):
+            self.__zapi.relogin(auth)
+            responses = self.__zapi.postBatch([self.__zapi.json_dict(method, params) for method, params in calls])
+        self.results = []
+        for content in responses:
+            try:
+                self.results.append(content['result'])
+            except KeyError:
+                raise ZabbixAPIException(content.get('error', {}).get('data', content))
+        return self.results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+        return False
+
+
 def testCase():
     zapi = ZabbixAPI(url='http://127.0.0.1/zabbix', user='admin', password='zabbix')
     zapi.login()
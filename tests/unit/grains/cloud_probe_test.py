@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+'''
+Test module for the cloud platform probe, against a fake sysfs tree
+'''
+
+# Import python libs
+from __future__ import absolute_import
+import os
+import shutil
+import socket
+import tempfile
+import time
+
+# Import Salt Testing libs
+from salttesting import TestCase
+from salttesting.helpers import ensure_in_syspath
+
+ensure_in_syspath('../../')
+
+from salt.grains import _cloud_probe
+
+
+class CloudProbeTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.opts = {'cachedir': os.path.join(self.root, 'cache')}
+        # A listening socket stands in for the metadata service
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.saved = (_cloud_probe.SYSFS_ROOT, _cloud_probe.METADATA_HOST,
+                      _cloud_probe.METADATA_PORT)
+        _cloud_probe.SYSFS_ROOT = os.path.join(self.root, 'sys')
+        _cloud_probe.METADATA_HOST, _cloud_probe.METADATA_PORT = self.listener.getsockname()
+        _cloud_probe.reset(self.opts)
+
+    def tearDown(self):
+        (_cloud_probe.SYSFS_ROOT, _cloud_probe.METADATA_HOST,
+         _cloud_probe.METADATA_PORT) = self.saved
+        _cloud_probe.reset(self.opts)
+        self.listener.close()
+        shutil.rmtree(self.root)
+
+    def _dmi(self, **fields):
+        dmi = os.path.join(self.root, 'sys', 'class', 'dmi', 'id')
+        os.makedirs(dmi)
+        for name, value in fields.items():
+            with open(os.path.join(dmi, name), 'w') as handle:
+                handle.write(value + '\n')
+
+    def _no_metadata(self):
+        self.listener.close()
+
+    def test_ec2(self):
+        self._dmi(sys_vendor='Amazon EC2', product_name='t3.micro', bios_vendor='Amazon EC2')
+        self.assertEqual(_cloud_probe.probe(self.opts), {'platform': 'ec2', 'metadata': True})
+        self.assertTrue(_cloud_probe.on_cloud(self.opts, 'ec2'))
+        self.assertFalse(_cloud_probe.on_cloud(self.opts, 'gce'))
+
+    def test_gce(self):
+        self._dmi(sys_vendor='Google', product_name='Google Compute Engine')
+        self.assertTrue(_cloud_probe.on_cloud(self.opts, 'gce'))
+        self.assertFalse(_cloud_probe.on_cloud(self.opts, 'vultr'))
+
+    def test_xen_ec2(self):
+        os.makedirs(os.path.join(self.root, 'sys', 'hypervisor'))
+        with open(os.path.join(self.root, 'sys', 'hypervisor', 'uuid'), 'w') as handle:
+            handle.write('ec2e1916-9099-7caf-fd21-012345abcdef\n')
+        self.assertTrue(_cloud_probe.on_cloud(self.opts, 'ec2'))
+
+    def test_bare_metal(self):
+        self._dmi(sys_vendor='Dell Inc.', product_name='PowerEdge R640')
+        self._no_metadata()
+        start = time.time()
+        for platform in ('ec2', 'gce', 'digitalocean', 'vultr'):
+            self.assertFalse(_cloud_probe.on_cloud(self.opts, platform))
+        self.assertLess(time.time() - start, 1)
+
+    def test_no_dmi(self):
+        self.assertEqual(_cloud_probe.probe(self.opts), {'platform': None, 'metadata': True})
+        self.assertTrue(_cloud_probe.on_cloud(self.opts, 'digitalocean'))
+
+    def test_cached(self):
+        self._dmi(sys_vendor='DigitalOcean')
+        self.assertTrue(_cloud_probe.on_cloud(self.opts, 'digitalocean'))
+        shutil.rmtree(os.path.join(self.root, 'sys'))
+        self.assertTrue(_cloud_probe.on_cloud(self.opts, 'digitalocean'))
+        # The result survives a new process through the grain cache
+        _cloud_probe._RESULT.clear()
+        self.assertTrue(_cloud_probe.on_cloud(self.opts, 'digitalocean'))
+
+    def test_forced(self):
+        self._no_metadata()
+        self.opts['cloud_platform'] = 'vultr'
+        self.assertTrue(_cloud_probe.on_cloud(self.opts, 'vultr'))
+        self.assertFalse(_cloud_probe.on_cloud(self.opts, 'ec2'))
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(CloudProbeTestCase, needs_daemon=False)
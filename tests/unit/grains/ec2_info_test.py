@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+'''
+Test module for the ec2_info grain, against a local fake metadata service
+'''
+
+# Import python libs
+from __future__ import absolute_import
+import json
+import shutil
+import tempfile
+import threading
+
+# Import Salt Testing libs
+from salttesting import TestCase
+from salttesting.helpers import ensure_in_syspath
+from salt.ext.six.moves import BaseHTTPServer, socketserver
+
+ensure_in_syspath('../../')
+
+from salt.grains import ec2_info
+
+DOCUMENT = {
+    'instanceId': 'i-0123456789',
+    'imageId': 'ami-42',
+    'region': 'eu-west-1',
+    'availabilityZone': 'eu-west-1a',
+    'instanceType': 't2.micro',
+}
+
+METADATA = {
+    '/latest/dynamic/instance-identity/document': json.dumps(DOCUMENT),
+    '/latest/dynamic/instance-identity/': 'document\npkcs7\nsignature',
+    '/latest/dynamic/instance-identity/pkcs7': 'PKCS7',
+    '/latest/dynamic/instance-identity/signature': 'SIGNATURE',
+    '/latest/user-data': '{"role": "web"}',
+    '/latest/meta-data/': ('ami-id\nblock-device-mapping/\nhostname\n'
+                           'instance-id\nlocal-ipv4\nplacement/\npublic-keys/'),
+    '/latest/meta-data/ami-id': 'ami-42',
+    '/latest/meta-data/block-device-mapping/': 'ami\nroot',
+    '/latest/meta-data/block-device-mapping/ami': 'xvda',
+    '/latest/meta-data/block-device-mapping/root': '/dev/xvda',
+    '/latest/meta-data/hostname': 'ip-10-0-0-1',
+    '/latest/meta-data/instance-id': 'i-0123456789',
+    '/latest/meta-data/instance-id/': 'i-0123456789',
+    '/latest/meta-data/local-ipv4': '10.0.0.1',
+    '/latest/meta-data/placement/': 'availability-zone\nregion',
+    '/latest/meta-data/placement/availability-zone': 'eu-west-1a',
+    '/latest/meta-data/placement/region': 'eu-west-1',
+    '/latest/meta-data/public-keys/': '0=admin',
+    '/latest/meta-data/public-keys/0/': 'openssh-key',
+    '/latest/meta-data/public-keys/0/openssh-key': 'ssh-rsa AAAA admin',
+}
+
+
+class FakeMetadataHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        body = METADATA.get(self.path)
+        if body is None:
+            self.send_response(404)
+            body = 'Not Found'
+        else:
+            self.send_response(200)
+        body = body.encode('utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeMetadataServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class EC2InfoTestCase(TestCase):
+    def setUp(self):
+        self.server = FakeMetadataServer(('127.0.0.1', 0), FakeMetadataHandler)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.cachedir = tempfile.mkdtemp()
+        self.saved = (ec2_info.AWS_HOST, ec2_info.AWS_PORT)
+        ec2_info.AWS_HOST, ec2_info.AWS_PORT = self.server.server_address
+        ec2_info.__opts__ = {'cachedir': self.cachedir, 'cloud_platform': 'ec2'}
+
+    def tearDown(self):
+        ec2_info.AWS_HOST, ec2_info.AWS_PORT = self.saved
+        del ec2_info.__opts__
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cachedir)
+
+    def test_ec2_info(self):
+        ret = ec2_info.ec2_info()['ec2']
+        self.assertEqual(ret['region'], 'eu-west-1')
+        self.assertEqual(ret['user-data'], {'role': 'web'})
+        self.assertEqual(ret['hostname'], 'ip-10-0-0-1')
+        self.assertEqual(ret['block_device_mapping'], {'ami': 'xvda', 'root': '/dev/xvda'})
+        self.assertEqual(ret['placement']['availability_zone'], 'eu-west-1a')
+        self.assertEqual(ret['public_keys'], {'0': {'openssh_key': 'ssh-rsa AAAA admin'}})
+        self.assertEqual(ret['instance_identity']['pkcs7'], b'PKCS7')
+
+    def test_cached_refresh(self):
+        first = ec2_info.ec2_info()
+        cold = list(self.server.requests)
+        del self.server.requests[:]
+        second = ec2_info.ec2_info()
+        self.assertEqual(first, second)
+        warm = self.server.requests
+        self.assertLess(len(warm), len(cold))
+        for path in ('/latest/meta-data/ami-id',
+                     '/latest/meta-data/block-device-mapping/root',
+                     '/latest/meta-data/placement/region'):
+            self.assertIn(path, cold)
+            self.assertNotIn(path, warm)
+        self.assertIn('/latest/meta-data/local-ipv4', warm)
+
+    def test_cache_other_instance(self):
+        ec2_info.ec2_info()
+        METADATA['/latest/meta-data/instance-id'] = 'i-other'
+        try:
+            del self.server.requests[:]
+            ret = ec2_info.ec2_info()['ec2']
+        finally:
+            METADATA['/latest/meta-data/instance-id'] = 'i-0123456789'
+        self.assertEqual(ret['instance_id'], 'i-other')
+        self.assertIn('/latest/meta-data/ami-id', self.server.requests)
+
+    def test_instance_id(self):
+        self.assertEqual(ec2_info.ec2_instance_id(), {'instance-id': 'i-0123456789'})
+
+    def test_no_metadata_service(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = FakeMetadataServer(('127.0.0.1', 0), FakeMetadataHandler)
+        ec2_info.AWS_PORT = self.server.server_address[1]
+        self.server.server_close()
+        self.server.shutdown = lambda: None
+        self.assertEqual(ec2_info.ec2_info(), {})
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(EC2InfoTestCase, needs_daemon=False)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+'''
+Test module for the facter grain, with a stubbed facter command
+'''
+
+# Import python libs
+from __future__ import absolute_import
+import json
+import shutil
+import tempfile
+
+# Import Salt Testing libs
+from salttesting import TestCase, skipIf
+from salttesting.helpers import ensure_in_syspath
+from salttesting.mock import NO_MOCK, NO_MOCK_REASON, MagicMock, patch
+
+ensure_in_syspath('../../')
+
+from salt.grains import facter
+
+FACTS = {'osfamily': 'Debian', 'memorysize': '7.79 GB', 'puppetversion': '3.8.7'}
+
+
+def _facter_output(cmd):
+    names = [x for x in cmd.split()[1:] if not x.startswith('-')]
+    if not names:
+        return json.dumps(FACTS)
+    return json.dumps(dict((x, FACTS[x]) for x in names))
+
+
+@skipIf(NO_MOCK, NO_MOCK_REASON)
+@patch('salt.utils.check_or_die', MagicMock(return_value=None))
+class FacterTestCase(TestCase):
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        facter.__opts__ = {'cachedir': self.cachedir}
+        self.run = MagicMock(side_effect=_facter_output)
+        self.saved = facter.__salt__
+        facter.__salt__ = {'cmd.run': self.run}
+
+    def tearDown(self):
+        facter.__salt__ = self.saved
+        del facter.__opts__
+        shutil.rmtree(self.cachedir)
+
+    def test_all_facts(self):
+        self.assertEqual(facter.facter(), {'facter_osfamily': 'Debian',
+                                           'facter_memorysize': '7.79 GB',
+                                           'facter_puppetversion': '3.8.7'})
+        self.run.assert_called_once_with('facter -p -j')
+
+    def test_allowlist(self):
+        facter.__opts__['facter'] = {'facts': ['osfamily', 'memorysize'], 'puppet': False}
+        self.assertEqual(facter.facter(), {'facter_osfamily': 'Debian',
+                                           'facter_memorysize': '7.79 GB'})
+        self.run.assert_called_once_with('facter -j memorysize osfamily')
+
+    def test_cached(self):
+        facter.facter()
+        self.assertEqual(facter.facter()['facter_osfamily'], 'Debian')
+        self.assertEqual(self.run.call_count, 1)
+        # Another selection of facts is not served from the cache
+        facter.__opts__['facter'] = {'facts': ['osfamily']}
+        self.assertEqual(facter.facter(), {'facter_osfamily': 'Debian'})
+        self.assertEqual(self.run.call_count, 2)
+
+    def test_failure_not_cached(self):
+        self.run.side_effect = None
+        self.run.return_value = 'Could not load puppet'
+        self.assertEqual(facter.facter(), {})
+        self.run.side_effect = _facter_output
+        self.assertEqual(facter.facter()['facter_osfamily'], 'Debian')
+
+    def test_failure_cache_disabled(self):
+        facter.__opts__['grain_cache'] = {'enabled': False}
+        self.run.side_effect = OSError('facter: not found')
+        self.assertEqual(facter.facter(), {})
+        self.run.side_effect = None
+        self.run.return_value = 'Could not load puppet'
+        self.assertEqual(facter.facter(), {})
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(FacterTestCase, needs_daemon=False)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+'''
+Test module for the grain cache helper
+'''
+
+# Import python libs
+from __future__ import absolute_import
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+# Import Salt Testing libs
+from salttesting import TestCase
+from salttesting.helpers import ensure_in_syspath
+
+ensure_in_syspath('../../')
+
+from salt.grains import _grain_cache
+
+
+class GrainCacheTestCase(TestCase):
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.opts = {'cachedir': self.cachedir}
+        self.calls = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def _grain(self, value):
+        def func():
+            self.calls += 1
+            return value
+        return func
+
+    def _age(self, name, seconds):
+        path = os.path.join(self.cachedir, 'grain_cache', '{0}.json'.format(name))
+        with open(path) as handle:
+            entry = json.load(handle)
+        entry['time'] -= seconds
+        with open(path, 'w') as handle:
+            json.dump(entry, handle)
+
+    def test_cold_then_warm(self):
+        func = self._grain({'cloud': 'yes'})
+        self.assertEqual(_grain_cache.cached(self.opts, 'test', func), {'cloud': 'yes'})
+        self.assertEqual(_grain_cache.timings()['test']['source'], 'cold')
+        self.assertEqual(_grain_cache.cached(self.opts, 'test', func), {'cloud': 'yes'})
+        self.assertEqual(_grain_cache.timings()['test']['source'], 'warm')
+        self.assertEqual(self.calls, 1)
+
+    def test_ttl_from_config(self):
+        self.opts['grain_cache'] = {'ttl': {'test': 10}, 'max_stale': 0}
+        func = self._grain({'cloud': 'yes'})
+        _grain_cache.cached(self.opts, 'test', func, ttl=3600)
+        self._age('test', 20)
+        _grain_cache.cached(self.opts, 'test', func, ttl=3600)
+        self.assertEqual(self.calls, 2)
+
+    def test_stale_while_revalidate(self):
+        _grain_cache.cached(self.opts, 'test', self._grain({'cloud': 'old'}), ttl=10)
+        self._age('test', 20)
+        refreshed = threading.Event()
+
+        def slow():
+            refreshed.wait(5)
+            return {'cloud': 'new'}
+
+        start = time.time()
+        self.assertEqual(_grain_cache.cached(self.opts, 'test', slow, ttl=10), {'cloud': 'old'})
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(_grain_cache.timings()['test']['source'], 'stale')
+        refreshed.set()
+        for _ in range(50):
+            if 'test' not in _grain_cache._REFRESHING:
+                break
+            time.sleep(0.1)
+        self.assertEqual(_grain_cache.cached(self.opts, 'test', slow, ttl=10), {'cloud': 'new'})
+
+    def test_negative(self):
+        func = self._grain({'cloud': []})
+        _grain_cache.cached(self.opts, 'test', func, negative_ttl=100)
+        self.assertEqual(_grain_cache.cached(self.opts, 'test', func, negative_ttl=100), {'cloud': []})
+        self.assertEqual(_grain_cache.timings()['test']['source'], 'negative')
+        self.assertEqual(self.calls, 1)
+
+    def test_error_keeps_last_value(self):
+        _grain_cache.cached(self.opts, 'test', self._grain({'cloud': 'yes'}), ttl=10)
+        self._age('test', 100)
+
+        def broken():
+            raise IOError('no route to host')
+
+        self.assertEqual(_grain_cache.cached(self.opts, 'test', broken, ttl=10, max_stale=0),
+                         {'cloud': 'yes'})
+        self.assertEqual(_grain_cache.cached(self.opts, 'other', broken), None)
+
+    def test_invalidate(self):
+        func = self._grain({'cloud': 'yes'})
+        _grain_cache.cached(self.opts, 'test', func)
+        _grain_cache.invalidate(self.opts, 'test')
+        _grain_cache.cached(self.opts, 'test', func)
+        self.assertEqual(self.calls, 2)
+
+    def test_disabled(self):
+        self.opts['grain_cache'] = {'enabled': False}
+        func = self._grain({'cloud': 'yes'})
+        _grain_cache.cached(self.opts, 'test', func)
+        _grain_cache.cached(self.opts, 'test', func)
+        self.assertEqual(self.calls, 2)
+
+        def broken():
+            raise IOError('no route to host')
+
+        self.assertEqual(_grain_cache.cached(self.opts, 'test', broken), None)
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(GrainCacheTestCase, needs_daemon=False)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+'''
+Test module for the hw_raid grain, against a fake sysfs tree
+'''
+
+# Import python libs
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+
+# Import Salt Testing libs
+from salttesting import TestCase
+from salttesting.helpers import ensure_in_syspath
+
+ensure_in_syspath('../../')
+
+from salt.grains import hw_raid
+
+PCI_IDS = '''\
+# fake pci.ids
+1000  Broadcom / LSI
+\t005d  MegaRAID SAS-3 3108 [Invader]
+\t\t1028 1f49  PERC H730 Adapter
+\t0097  SAS3008 PCI-Express Fusion-MPT SAS-3
+8086  Intel Corporation
+\t2822  SATA Controller [RAID mode]
+\t1d02  C600/X79 series chipset 6-Port SATA AHCI Controller
+C 01  Mass storage controller
+'''
+
+MODINFO = '''\
+#!/bin/sh
+echo "$1" >> "$(dirname "$0")/modinfo.calls"
+echo "filename:       /lib/modules/3.10.0/kernel/drivers/scsi/$1.ko.xz"
+echo "version:        07.702.06.00-rh2"
+echo "description:    $1 driver"
+echo "author:         First Author"
+echo "author:         Last Author"
+'''
+
+
+class HwRaidTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.saved = (hw_raid.SYSFS_ROOT, hw_raid.PCI_IDS, hw_raid.BOOT_ID, hw_raid.MODINFO)
+        hw_raid.SYSFS_ROOT = os.path.join(self.root, 'sys')
+        hw_raid.PCI_IDS = (os.path.join(self.root, 'pci.ids'),)
+        hw_raid.BOOT_ID = os.path.join(self.root, 'boot_id')
+        hw_raid.MODINFO = os.path.join(self.root, 'modinfo')
+        hw_raid.__opts__ = {'cachedir': os.path.join(self.root, 'cache')}
+        with open(hw_raid.PCI_IDS[0], 'w') as handle:
+            handle.write(PCI_IDS)
+        with open(hw_raid.BOOT_ID, 'w') as handle:
+            handle.write('boot-1\n')
+        with open(hw_raid.MODINFO, 'w') as handle:
+            handle.write(MODINFO)
+        os.chmod(hw_raid.MODINFO, 0o755)
+        os.makedirs(os.path.join(self.root, 'sys', 'bus', 'pci', 'devices'))
+
+    def tearDown(self):
+        hw_raid.SYSFS_ROOT, hw_raid.PCI_IDS, hw_raid.BOOT_ID, hw_raid.MODINFO = self.saved
+        del hw_raid.__opts__
+        shutil.rmtree(self.root)
+
+    def _device(self, slot, pci_class, vendor, device, driver=None,
+                subsystem=('0x0000', '0x0000')):
+        path = os.path.join(self.root, 'sys', 'bus', 'pci', 'devices', slot)
+        os.makedirs(path)
+        attrs = {'class': pci_class, 'vendor': vendor, 'device': device,
+                 'revision': '0x02', 'subsystem_vendor': subsystem[0],
+                 'subsystem_device': subsystem[1]}
+        for name, value in attrs.items():
+            with open(os.path.join(path, name), 'w') as handle:
+                handle.write(value + '\n')
+        if driver:
+            drivers = os.path.join(self.root, 'sys', 'bus', 'pci', 'drivers', driver)
+            module = os.path.join(self.root, 'sys', 'module', driver)
+            if not os.path.isdir(module):
+                os.makedirs(drivers)
+                os.makedirs(module)
+                os.symlink(module, os.path.join(drivers, 'module'))
+                with open(os.path.join(module, 'version'), 'w') as handle:
+                    handle.write('07.702.06.00-rh2\n')
+            os.symlink(drivers, os.path.join(path, 'driver'))
+
+    def test_all_controllers(self):
+        self._device('0000:02:00.0', '0x010400', '0x1000', '0x005d', 'megaraid_sas',
+                     subsystem=('0x1028', '0x1f49'))
+        self._device('0000:03:00.0', '0x010700', '0x1000', '0x0097', 'mpt3sas')
+        self._device('0000:00:1f.2', '0x010601', '0x8086', '0x1d02', 'ahci')
+        self._device('0000:00:02.0', '0x030000', '0x8086', '0x0162')
+        self._device('0000:04:00.0', '0x010400', '0x1000', '0x005d', 'megaraid_sas')
+        ret = hw_raid.raid_info()
+        self.assertEqual([x['slot'] for x in ret['raidcontrollers']],
+                         ['02:00.0', '03:00.0', '04:00.0'])
+        self.assertEqual(ret['raidcontrollers'][0], {
+            'slot': '02:00.0',
+            'class': 'RAID bus controller',
+            'vendor': 'Broadcom / LSI',
+            'device': 'MegaRAID SAS-3 3108 [Invader]',
+            'rev': '02',
+            'subsystem_vendor': '1028',
+            'subsystem': 'PERC H730 Adapter',
+            'driver': 'megaraid_sas',
+            'driver_version': '07.702.06.00-rh2',
+            'driver_filename': '/lib/modules/3.10.0/kernel/drivers/scsi/megaraid_sas.ko.xz',
+            'driver_description': 'megaraid_sas driver',
+            'driver_author': 'Last Author',
+        })
+        self.assertEqual(ret['raidcontrollers'][1]['class'], 'Serial Attached SCSI controller')
+        # Like lspci | grep RAID used to, raidcontroller is the last one
+        self.assertEqual(ret['raidcontroller'], ret['raidcontrollers'][2])
+        # modinfo runs once per driver
+        with open(os.path.join(self.root, 'modinfo.calls')) as handle:
+            self.assertEqual(handle.read().split(), ['megaraid_sas', 'mpt3sas'])
+
+    def test_no_modinfo(self):
+        os.unlink(hw_raid.MODINFO)
+        self._device('0000:02:00.0', '0x010400', '0x1000', '0x005d', 'megaraid_sas')
+        ret = hw_raid.raid_info()
+        self.assertEqual(ret['raidcontroller']['driver_version'], '07.702.06.00-rh2')
+        self.assertNotIn('driver_filename', ret['raidcontroller'])
+
+    def test_raid_by_name(self):
+        self._device('0000:00:1f.2', '0x010400', '0x8086', '0x2822', 'ahci')
+        self._device('0000:00:1f.3', '0x010601', '0x8086', '0x2822')
+        ret = hw_raid.raid_info()
+        self.assertEqual(len(ret['raidcontrollers']), 2)
+        self.assertEqual(ret['raidcontrollers'][1]['driver'], None)
+
+    def test_no_controller(self):
+        self._device('0000:00:1f.2', '0x010601', '0x8086', '0x1d02', 'ahci')
+        self.assertEqual(hw_raid.raid_info(), None)
+
+    def test_cached_until_reboot(self):
+        self._device('0000:02:00.0', '0x010400', '0x1000', '0x005d', 'megaraid_sas')
+        self.assertEqual(len(hw_raid.raid_info()['raidcontrollers']), 1)
+        self._device('0000:03:00.0', '0x010700', '0x1000', '0x0097', 'mpt3sas')
+        self.assertEqual(len(hw_raid.raid_info()['raidcontrollers']), 1)
+        with open(hw_raid.BOOT_ID, 'w') as handle:
+            handle.write('boot-2\n')
+        self.assertEqual(len(hw_raid.raid_info()['raidcontrollers']), 2)
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(HwRaidTestCase, needs_daemon=False)
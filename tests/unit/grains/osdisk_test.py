@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+'''
+Test module for the osdisk grain, against a fake mount table
+'''
+
+# Import python libs
+from __future__ import absolute_import
+import collections
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+# Import Salt Testing libs
+from salttesting import TestCase, skipIf
+from salttesting.helpers import ensure_in_syspath
+from salttesting.mock import NO_MOCK, NO_MOCK_REASON, patch
+
+ensure_in_syspath('../../')
+
+from salt.grains import osdisk
+
+MOUNTINFO = '''\
+22 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw
+23 22 0:21 / /proc rw,nosuid shared:12 - proc proc rw
+24 22 0:22 / /sys rw,nosuid shared:2 - sysfs sysfs rw
+25 22 0:5 / /dev rw,nosuid shared:3 - devtmpfs udev rw
+26 22 0:23 / /run rw,nosuid shared:5 - tmpfs tmpfs rw
+27 22 8:2 / /srv/my\\040data rw,relatime shared:30 - xfs /dev/sda2 rw
+28 22 8:1 /var/lib/kubelet /var/lib/kubelet rw,relatime shared:1 - ext4 /dev/sda1 rw
+29 22 8:2 /pods /var/lib/kubelet/pods rw,relatime shared:30 - xfs /dev/sda2 rw
+30 22 0:50 / /var/lib/docker/overlay2/abc/merged rw - overlay overlay rw
+31 22 0:51 / /mnt/nfs rw,relatime shared:40 - nfs4 filer:/export rw
+32 22 0:52 / /mnt/nfs2 rw,relatime shared:41 - nfs4 filer:/export2 rw
+'''
+
+StatVFS = collections.namedtuple('StatVFS', 'f_bsize f_blocks f_bavail')
+GB = 1024 ** 3
+
+
+@skipIf(NO_MOCK, NO_MOCK_REASON)
+class OsdiskTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.saved = osdisk.MOUNTINFO
+        osdisk.MOUNTINFO = os.path.join(self.root, 'mountinfo')
+        with open(osdisk.MOUNTINFO, 'w') as handle:
+            handle.write(MOUNTINFO)
+        osdisk.__opts__ = {'cachedir': os.path.join(self.root, 'cache'),
+                           'osdisk': {'timeout': 0.2}}
+        self.calls = []
+        self.hang = threading.Event()
+        self.returned = threading.Event()
+        osdisk._STUCK.clear()
+
+    def tearDown(self):
+        self.hang.set()
+        osdisk.MOUNTINFO = self.saved
+        del osdisk.__opts__
+        shutil.rmtree(self.root)
+
+    def statvfs(self, path):
+        self.calls.append(path)
+        if path == '/mnt/nfs':
+            self.hang.wait(5)
+            self.returned.set()
+        return StatVFS(4096, 10 * GB // 4096, 4 * GB // 4096)
+
+    def test_mounts(self):
+        self.assertEqual(osdisk._mounts(MOUNTINFO, osdisk.EXCLUDE_FSTYPES),
+                         ['/', '/srv/my data', '/mnt/nfs', '/mnt/nfs2'])
+
+    def test_stats(self):
+        with patch.object(osdisk.os, 'statvfs', self.statvfs):
+            start = time.time()
+            ret = osdisk.get_osdisk_stats()['osdisk']
+            self.assertLess(time.time() - start, 2)
+        self.assertEqual(sorted(ret), ['/', '/mnt/nfs2', '/srv/my data'])
+        self.assertEqual(ret['/'], {'available': 4, 'used': 6})
+
+    def test_cached_until_mounts_change(self):
+        with patch.object(osdisk.os, 'statvfs', self.statvfs):
+            osdisk.get_osdisk_stats()
+            calls = len(self.calls)
+            osdisk.get_osdisk_stats()
+            self.assertEqual(len(self.calls), calls)
+            with open(osdisk.MOUNTINFO, 'a') as handle:
+                handle.write('33 22 8:3 / /backup rw - ext4 /dev/sdb1 rw\n')
+            ret = osdisk.get_osdisk_stats()['osdisk']
+        self.assertIn('/backup', ret)
+
+    def test_stuck_mount_skipped(self):
+        mount_points = ['/', '/mnt/nfs', '/mnt/nfs2']
+        with patch.object(osdisk.os, 'statvfs', self.statvfs):
+            self.assertEqual(sorted(osdisk._statvfs_all(mount_points, 2, 0.2)),
+                             ['/', '/mnt/nfs2'])
+            # The first call is still hanging, no other thread is sent there
+            self.assertEqual(sorted(osdisk._statvfs_all(mount_points, 2, 0.2)),
+                             ['/', '/mnt/nfs2'])
+            self.assertEqual(self.calls.count('/mnt/nfs'), 1)
+            self.hang.set()
+            self.returned.wait(5)
+            for _ in range(50):
+                if not osdisk._STUCK:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(sorted(osdisk._statvfs_all(mount_points, 2, 0.2)),
+                             ['/', '/mnt/nfs', '/mnt/nfs2'])
+        self.assertEqual(self.calls.count('/mnt/nfs'), 2)
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(OsdiskTestCase, needs_daemon=False)
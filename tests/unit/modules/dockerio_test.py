@@ -5,10 +5,12 @@
 
 # Import python libs
 from __future__ import absolute_import
+import json
 
 # Import Salt Testing libs
 from salttesting import TestCase, skipIf
 from salttesting.helpers import ensure_in_syspath
+from salttesting.mock import NO_MOCK, NO_MOCK_REASON, MagicMock, patch
 
 ensure_in_syspath('../../')
 
@@ -28,6 +30,106 @@ class DockerIoTestCase(TestCase):
         self.assertEqual('1.0 PB', dockerio._sizeof_fmt(1024**5))
 
 
+@skipIf(NO_MOCK, NO_MOCK_REASON)
+class DockerIoLogsTestCase(TestCase):
+    def test_iter_log_objects(self):
+        log = ('{"status":"Pulling fs layer","id":"a"}\r\n'
+               'image (latest) from foo/bar\r\n'
+               '{"status":"Downloading","progressDetail":{"current":1,"total":2},"id":"a"}'
+               '{"status":"Status: {done}"}\r\n')
+        expected = list(dockerio._iter_log_objects(log))
+        self.assertEqual([x['status'] for x in expected],
+                         ['Pulling fs layer', 'Downloading', 'Status: {done}'])
+        # the same objects come out whatever the chunks boundaries are
+        for size in (1, 3, 7, 64):
+            chunks = [log[pos:pos + size].encode('utf-8') for pos in range(0, len(log), size)]
+            self.assertEqual(list(dockerio._iter_log_objects(iter(chunks))), expected)
+
+    def test_iter_log_objects_malformed(self):
+        log = ('Error {x\r\n'
+               '{"status":"Pulling fs layer","id":"a"}\r\n'
+               '{"status": broken}\r\n'
+               '{"status":"Pull complete","id":"a"}\r\n')
+        for size in (1, 5, len(log)):
+            chunks = [log[pos:pos + size] for pos in range(0, len(log), size)]
+            self.assertEqual([x['status'] for x in dockerio._iter_log_objects(iter(chunks))],
+                             ['Pulling fs layer', 'Pull complete'])
+        # An object that never ends does not grow the buffer forever
+        with patch.object(dockerio, '_LOG_MAX_PENDING', 100):
+            chunks = ['{"status":"'] + ['x' * 10] * 50 + ['{"status":"done"}\r\n']
+            self.assertEqual([x['status'] for x in dockerio._iter_log_objects(iter(chunks))],
+                             ['done'])
+
+    def test_image_logs_last_status(self):
+        logs = dockerio._ImageLogs().feed(dockerio._synthetic_pull_log(3, 10))
+        kept = logs.logs()
+        # one message per layer, and the messages without layer id
+        self.assertEqual(len(kept), 3 + 1 + 2)
+        self.assertTrue(kept[0]['status'].startswith('Status: Downloaded'))
+        layers = [x for x in kept if x.get('status') == 'Pull complete']
+        self.assertEqual(len(layers), 3)
+        self.assertEqual(logs.last_done, layers[0]['id'])
+
+    def test_pull_streams(self):
+        client = MagicMock()
+        client.pull.return_value = iter([
+            json.dumps({'status': 'Download complete', 'id': 'abc'}),
+            json.dumps({'status': 'Status: Downloaded newer image for foo:latest'})])
+        with patch.object(dockerio, 'docker', MagicMock(__version__='1.0.0'), create=True):
+            with patch('salt.modules.dockerio._get_client', MagicMock(return_value=client)):
+                with patch('salt.modules.dockerio._get_image_infos',
+                           MagicMock(return_value={'Id': 'abc'})) as infos:
+                    with patch('salt.utils.compare_versions', MagicMock(return_value=True),
+                               create=True):
+                        status = dockerio.pull('foo')
+        self.assertTrue(status['status'])
+        self.assertEqual(status['id'], 'abc')
+        infos.assert_called_once_with('abc')
+        self.assertTrue(client.pull.call_args[1]['stream'])
+
+    def test_split_images(self):
+        self.assertEqual(dockerio._split_images('ubuntu:14.04, localhost:5000/app,redis'),
+                         [('ubuntu', '14.04'), ('localhost:5000/app', None), ('redis', None)])
+        self.assertEqual(dockerio._split_images([{'corp/app': '1.2'}]), [('corp/app', '1.2')])
+
+    def test_pull_many(self):
+        def pull(repo, stream=True, tag=None, **kwargs):
+            # the base layer is shared by both images
+            for layer in ('base', repo):
+                yield json.dumps({'status': 'Downloading', 'id': layer,
+                                  'progressDetail': {'current': 50, 'total': 100}})
+                yield json.dumps({'status': 'Download complete', 'id': layer,
+                                  'progressDetail': {}})
+            if repo == 'bad':
+                yield json.dumps({'error': 'boom', 'errorDetail': {'message': 'boom'}})
+
+        client = MagicMock()
+        client.pull.side_effect = pull
+        infos = MagicMock(side_effect=lambda id_: {'Id': id_} if id_ != 'bad' else None)
+        with patch.object(dockerio, 'docker', MagicMock(__version__='1.0.0'), create=True):
+            with patch('salt.modules.dockerio._get_client', MagicMock(return_value=client)):
+                with patch('salt.modules.dockerio._get_image_infos', infos):
+                    with patch('salt.utils.compare_versions', MagicMock(return_value=True),
+                               create=True):
+                        status = dockerio.pull_many('app1:1.0,app2', workers=2)
+                        failed = dockerio.pull_many(['app1', 'bad'])
+        self.assertTrue(status['status'])
+        self.assertEqual(sorted(status['out']['images']), ['app1:1.0', 'app2'])
+        progress = status['out']['progress']
+        self.assertEqual(progress['total'], 300)
+        self.assertEqual(progress['current'], 300)
+        self.assertEqual(progress['shared_layers'], 1)
+        self.assertEqual(progress['layers']['base']['images'], ['app1:1.0', 'app2'])
+        self.assertFalse(failed['status'])
+        self.assertEqual(failed['comment'], 'Could not pull: bad')
+        self.assertTrue(failed['out']['images']['app1']['status'])
+
+    def test_benchmark(self):
+        ret = dockerio.benchmark(layers=5, updates=4, iterations=1)
+        self.assertEqual(ret['kept'], 5 + 1 + 2)
+        self.assertEqual(ret['messages'], 1 + 5 * (1 + 2 * (4 + 1)) + 2)
+
+
 if __name__ == '__main__':
     from integration import run_tests
-    run_tests(DockerIoTestCase, needs_daemon=False)
+    run_tests(DockerIoTestCase, DockerIoLogsTestCase, needs_daemon=False)
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+'''
+Test module for drizzle
+'''
+
+# Import python libs
+from __future__ import absolute_import
+import contextlib
+import os
+import shutil
+import tempfile
+
+# Import Salt Testing libs
+from salttesting import TestCase, skipIf
+from salttesting.helpers import ensure_in_syspath
+from salttesting.mock import NO_MOCK, NO_MOCK_REASON, MagicMock, patch
+
+ensure_in_syspath('../../')
+
+from salt.modules import drizzle
+
+drizzle.__salt__ = {}
+drizzle.__opts__ = {}
+
+
+class DrizzleSplitTestCase(TestCase):
+    def test_split_quotes(self):
+        self.assertEqual(
+            drizzle._split_statements(
+                "insert into t values ('a;b', \"c\\\";d\", 'it''s;'); select `x;y` from t"),
+            ["insert into t values ('a;b', \"c\\\";d\", 'it''s;')", 'select `x;y` from t'])
+
+    def test_split_comments(self):
+        self.assertEqual(
+            drizzle._split_statements(
+                'select 1; -- first; comment\nselect 2 # second; comment\n;'
+                '/* third; comment */ select 3;;  '),
+            ['select 1', 'select 2', 'select 3'])
+        # -- only starts a comment when followed by a space
+        self.assertEqual(drizzle._split_statements('select 1--1'), ['select 1--1'])
+
+    def test_split_executable_comments(self):
+        self.assertEqual(
+            drizzle._split_statements('/*!40101 SET x=1; */; update t set a=1'),
+            ['/*!40101 SET x=1; */', 'update t set a=1'])
+
+    def test_split_unterminated(self):
+        for text in ("select 'it" + 'x' * 5000,
+                     'select "a' + '\\\\' * 3000,
+                     'select `x;y from t',
+                     'select 1 /* comment; select 2'):
+            self.assertRaises(ValueError, drizzle._split_statements, text)
+        self.assertEqual(drizzle.query('db', "select 'it;"),
+                         'Error in your SQL statement: Unterminated quoted string at position 7')
+
+
+class FakeCursor(object):
+    '''
+    Cursor returning the rows of a table for every SELECT, and failing the
+    statements which contain fail
+    '''
+    def __init__(self, tables, fail=None):
+        self.tables = tables
+        self.fail = fail
+        self.description = None
+        self.pending = []
+        self.executed = []
+
+    def _check(self, statement):
+        self.executed.append(statement)
+        if self.fail and self.fail in statement:
+            raise drizzle.MySQLdb.Error(1064, 'You have an error in your SQL syntax')
+
+    def execute(self, statement):
+        self._check(statement)
+        table = statement.split()[-1]
+        if statement.startswith('select'):
+            self.description = (('id',), ('name',))
+            self.pending = list(self.tables[table])
+        else:
+            self.description = None
+        return 1
+
+    def executemany(self, statement, args):
+        self._check(statement)
+        self.description = None
+        self.args = list(args)
+        return len(self.args)
+
+    def fetchmany(self, size):
+        batch, self.pending = self.pending[:size], self.pending[size:]
+        return batch
+
+    def close(self):
+        pass
+
+
+@skipIf(NO_MOCK, NO_MOCK_REASON)
+@skipIf(not drizzle.has_mysqldb, 'MySQLdb is not installed')
+class DrizzleQueryTestCase(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cursor = FakeCursor({'a': [(1, 'x'), (2, 'y'), (3, 'z')], 'b': [(4, 'w')]})
+        self.db = MagicMock()
+        self.db.cursor.return_value = self.cursor
+
+        @contextlib.contextmanager
+        def connection(**dsn):
+            yield self.db
+        self.patch = patch('salt.modules.drizzle._connection', connection)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_fetch_rows(self):
+        self.cursor.execute('select * from a')
+        self.assertEqual(drizzle._fetch_rows(self.cursor, 2, max_rows=2),
+                         ([[1, 'x'], [2, 'y']], 2, True))
+        # the rows left out were read
+        self.assertEqual(self.cursor.pending, [])
+
+    def test_query_rows(self):
+        ret = drizzle.query('db', 'select * from a; select * from b', fetch_size=2, max_rows=0)
+        self.assertEqual(ret['select * from a']['rows'], [[1, 'x'], [2, 'y'], [3, 'z']])
+        self.assertEqual(ret['select * from b']['Rows selected:'], 1)
+        self.db.commit.assert_called_once_with()
+
+    def test_query_out_file(self):
+        out_file = os.path.join(self.tmpdir, 'out.tsv')
+        ret = drizzle.query('db', 'select * from a; update c set x=1; select * from b',
+                            fetch_size=2, out_file=out_file)
+        self.assertEqual(ret['select * from b']['file'], out_file)
+        with open(out_file) as handle:
+            self.assertEqual(handle.read(), '1\tx\n2\ty\n3\tz\n4\tw\n')
+
+    def test_query_executemany(self):
+        statement = 'insert into a values (%s, %s)'
+        ret = drizzle.query('db', statement, args=[[4, 'w'], [5, 'v']])
+        self.assertEqual(ret[statement]['Rows affected:'], 2)
+        self.assertEqual(self.cursor.args, [[4, 'w'], [5, 'v']])
+        self.assertEqual(self.cursor.executed, ['USE db', statement])
+        self.db.commit.assert_called_once_with()
+
+        ret = drizzle.query('db', 'insert into a values (%(id)s, %(name)s);',
+                            args=[{'id': 6, 'name': 'u'}], transaction=False)
+        self.assertEqual(ret['insert into a values (%(id)s, %(name)s)']['Rows affected:'], 1)
+        self.assertEqual(self.db.commit.call_count, 1)
+
+        self.assertEqual(drizzle.query('db', statement + '; select * from a', args=[[7, 't']]),
+                         'args need a single SQL statement')
+
+
+class FakeConnection(object):
+    '''
+    MySQLdb connection recording its calls, whose ping() fails once it is dead
+    '''
+    def __init__(self, **dsn):
+        self.dsn = dsn
+        self.dead = False
+        self.closed = False
+        self.calls = []
+        self.cursors = []
+
+    def ping(self):
+        if self.dead:
+            raise drizzle.MySQLdb.OperationalError(2006, 'MySQL server has gone away')
+
+    def close(self):
+        self.closed = True
+
+    def cursor(self, cursorclass=None):
+        return self.cursors.pop(0)
+
+    def autocommit(self, value):
+        self.calls.append(('autocommit', value))
+
+    def commit(self):
+        self.calls.append(('commit',))
+
+    def rollback(self):
+        self.calls.append(('rollback',))
+
+
+@skipIf(NO_MOCK, NO_MOCK_REASON)
+@skipIf(not drizzle.has_mysqldb, 'MySQLdb is not installed')
+class DrizzlePoolTestCase(TestCase):
+    def setUp(self):
+        drizzle._POOL.clear()
+        self.connect = MagicMock(side_effect=FakeConnection)
+        patches = [patch.object(drizzle, '_connect', self.connect),
+                   patch.dict(drizzle.__opts__, {'drizzle.pool_size': 2, 'drizzle.host': 'localhost',
+                                                 'drizzle.user': 'salt', 'drizzle.passwd': 'secret',
+                                                 'drizzle.db': 'test', 'drizzle.port': 4427})]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(drizzle._POOL.clear)
+
+    def _idle(self, **dsn):
+        return drizzle._POOL.get(drizzle._dsn_key(**dsn), [])
+
+    def test_reuse(self):
+        with drizzle._connection() as first:
+            pass
+        with drizzle._connection() as second:
+            self.assertIs(second, first)
+        self.assertEqual(self.connect.call_count, 1)
+        self.assertEqual(self._idle(), [first])
+
+    def test_dead_connection_replaced(self):
+        with drizzle._connection() as first:
+            pass
+        first.dead = True
+        with drizzle._connection() as second:
+            self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+        self.assertFalse(second.closed)
+        self.assertEqual(self._idle(), [second])
+
+    def test_pool_size(self):
+        with drizzle._connection() as first:
+            with drizzle._connection() as second:
+                with drizzle._connection() as third:
+                    self.assertEqual(len(set([first, second, third])), 3)
+        self.assertEqual(self._idle(), [third, second])
+        self.assertTrue(first.closed)
+
+        for _ in range(3):
+            with drizzle._connection():
+                self.assertTrue(len(self._idle()) <= 2)
+        self.assertEqual(self.connect.call_count, 3)
+
+    def test_close_on_error(self):
+        def _fail():
+            with drizzle._connection() as drizzle_db:
+                self.conn = drizzle_db
+                raise drizzle.MySQLdb.OperationalError(2013, 'Lost connection')
+        self.assertRaises(drizzle.MySQLdb.OperationalError, _fail)
+        self.assertTrue(self.conn.closed)
+        self.assertEqual(self._idle(), [])
+
+    def test_dsn_keys(self):
+        with drizzle._connection(db='a') as conn_a:
+            with drizzle._connection(db='b') as conn_b:
+                self.assertIsNot(conn_a, conn_b)
+        self.assertEqual(conn_a.dsn['db'], 'a')
+        self.assertEqual(self._idle(db='a'), [conn_a])
+        self.assertEqual(self._idle(db='b'), [conn_b])
+        # The default DSN is not served the connections of the others
+        with drizzle._connection() as conn:
+            self.assertNotIn(conn, (conn_a, conn_b))
+        with drizzle._connection(db='b') as conn:
+            self.assertIs(conn, conn_b)
+        self.assertEqual(self.connect.call_count, 3)
+
+    def _query(self, query, cursor, **kwargs):
+        '''
+        Run the query on a pooled connection, recording when the connection
+        is given back to the pool among its calls
+        '''
+        release = drizzle._release
+
+        def _release(key, drizzle_db):
+            drizzle_db.calls.append(('release',))
+            release(key, drizzle_db)
+
+        with drizzle._connection() as drizzle_db:
+            pass
+        del drizzle_db.calls[:]
+        drizzle_db.cursors.append(cursor)
+        with patch.object(drizzle, '_release', _release):
+            return drizzle.query('db', query, **kwargs), drizzle_db
+
+    def test_query_error_rolls_back(self):
+        cursor = FakeCursor({'a': [(1, 'x')]}, fail='bad')
+        ret, drizzle_db = self._query('update a set x=1; update a set bad=1; update a set x=3', cursor)
+        self.assertEqual(ret, 'Error in your SQL statement')
+        self.assertEqual(cursor.executed, ['USE db', 'update a set x=1', 'update a set bad=1'])
+        self.assertEqual(drizzle_db.calls, [('autocommit', False), ('rollback',),
+                                            ('autocommit', True), ('release',)])
+        self.assertEqual(self._idle(), [drizzle_db])
+
+    def test_query_executemany_error_rolls_back(self):
+        cursor = FakeCursor({}, fail='bad')
+        ret, drizzle_db = self._query('insert into bad values (%s)', cursor, args=[[1], [2]])
+        self.assertEqual(ret, 'Error in your SQL statement')
+        self.assertEqual(drizzle_db.calls, [('autocommit', False), ('rollback',),
+                                            ('autocommit', True), ('release',)])
+
+    def test_query_commit(self):
+        cursor = FakeCursor({'a': [(1, 'x')]})
+        ret, drizzle_db = self._query('update a set x=1; select * from a', cursor)
+        self.assertEqual(ret['select * from a']['rows'], [[1, 'x']])
+        self.assertEqual(drizzle_db.calls, [('autocommit', False), ('commit',),
+                                            ('autocommit', True), ('release',)])
+
+        # Without a transaction, autocommit is left alone
+        cursor = FakeCursor({}, fail='bad')
+        ret, drizzle_db = self._query('update a set x=1; update a set bad=1', cursor, transaction=False)
+        self.assertEqual(ret, 'Error in your SQL statement')
+        self.assertEqual(drizzle_db.calls, [('release',)])
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(DrizzleSplitTestCase, DrizzleQueryTestCase, DrizzlePoolTestCase, needs_daemon=False)
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+'''
+Test module for iscsitarget
+'''
+
+# Import python libs
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import threading
+
+# Import Salt Testing libs
+from salttesting import TestCase, skipIf
+from salttesting.helpers import ensure_in_syspath
+from salttesting.mock import NO_MOCK, NO_MOCK_REASON, MagicMock, mock_open, patch
+
+ensure_in_syspath('../../')
+
+from salt.modules import iscsitarget
+
+iscsitarget.__salt__ = {}
+iscsitarget.__context__ = {}
+
+VOLUME = '''\
+tid:1 name:iqn.2007-12.net.enpraxis:db
+\tlun:0 state:0 iotype:blockio iomode:wt blocks:20971520 blocksize:512 path:/dev/vg_spare/db_0
+\tlun:1 state:0 iotype:blockio iomode:wt blocks:20971520 blocksize:512 path:/dev/vg_spare/db_1
+tid:3 name:iqn.2007-12.net.enpraxis:db2
+\tlun:0 state:0 iotype:fileio iomode:wt blocks:2048 blocksize:512 path:/srv/my images/db2.img
+tid:2 name:iqn.2007-12.net.enpraxis:empty
+'''
+
+CONFIG = '''\
+Target iqn.2007-12.net.enpraxis:db
+\tLun 0 PATH=/dev/vg_spare/db_0,Type=blockio
+\tLun 1 PATH=/dev/vg_spare/db_1,Type=blockio
+Target 2 iqn.2007-12.net.enpraxis:empty
+'''
+
+SESSION = '''\
+tid:1 name:iqn.2007-12.net.enpraxis:db
+\tsid:562949974196736 initiator:iqn.1993-08.org.debian:01:host1
+\t\tcid:0 ip:192.168.1.5 state:active hd:none dd:none
+\t\tcid:1 ip:192.168.2.5 state:active hd:none dd:none
+tid:2 name:iqn.2007-12.net.enpraxis:empty
+'''
+
+
+@skipIf(NO_MOCK, NO_MOCK_REASON)
+class IscsiTargetTestCase(TestCase):
+    def setUp(self):
+        iscsitarget.__context__ = {}
+
+    def test_parse_volumes(self):
+        model = iscsitarget._parse_volumes(VOLUME)
+        self.assertEqual(model['by_iqn'], {'iqn.2007-12.net.enpraxis:db': 1,
+                                           'iqn.2007-12.net.enpraxis:db2': 3,
+                                           'iqn.2007-12.net.enpraxis:empty': 2})
+        self.assertEqual(model['targets'][3]['luns'][0]['path'], '/srv/my images/db2.img')
+        self.assertEqual(model['targets'][1]['luns'][1]['iotype'], 'blockio')
+        self.assertEqual(model['targets'][2]['luns'], {})
+
+    def test_parse_sessions(self):
+        targets = iscsitarget._parse_sessions(SESSION)
+        session = targets[1]['sessions'][0]
+        self.assertEqual(session['initiator'], 'iqn.1993-08.org.debian:01:host1')
+        self.assertEqual([x['ip'] for x in session['connections']], ['192.168.1.5', '192.168.2.5'])
+        self.assertEqual(targets[2]['sessions'], [])
+
+    def test_lookups_read_once(self):
+        with patch('salt.modules.iscsitarget.open', mock_open(read_data=VOLUME), create=True) as mopen:
+            self.assertEqual(iscsitarget._get_new_tid(), 4)
+            # db is a prefix of db2, each IQN gets its own volumes
+            self.assertEqual(iscsitarget._get_tid_from_iqn('iqn.2007-12.net.enpraxis:db'), 1)
+            self.assertEqual(iscsitarget._get_volumes('iqn.2007-12.net.enpraxis:db'),
+                             ['/dev/vg_spare/db_0', '/dev/vg_spare/db_1'])
+            self.assertEqual(iscsitarget._get_volumes('iqn.2007-12.net.enpraxis:db2'),
+                             ['/srv/my images/db2.img'])
+            self.assertEqual(iscsitarget._get_tid_from_iqn('iqn.2007-12.net.enpraxis:nope'), 0)
+        self.assertEqual(mopen.call_count, 1)
+
+    def test_model_kept_up_to_date(self):
+        iscsitarget.__context__['iscsitarget.volumes'] = iscsitarget._parse_volumes(VOLUME)
+        iscsitarget._volumes_add_target(4, 'iqn.2007-12.net.enpraxis:new')
+        iscsitarget._volumes_add_lun(4, '0', '/dev/vg_spare/new_0')
+        self.assertEqual(iscsitarget._get_new_tid(), 5)
+        self.assertEqual(iscsitarget._get_volumes('iqn.2007-12.net.enpraxis:new'), ['/dev/vg_spare/new_0'])
+        iscsitarget._volumes_delete_lun(1, 0)
+        iscsitarget._volumes_delete_target(3)
+        self.assertEqual(iscsitarget._get_volumes('iqn.2007-12.net.enpraxis:db'), ['/dev/vg_spare/db_1'])
+        self.assertEqual(iscsitarget._get_tid_from_iqn('iqn.2007-12.net.enpraxis:db2'), 0)
+
+
+@skipIf(NO_MOCK, NO_MOCK_REASON)
+class IscsiTargetBatchTestCase(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = os.path.join(self.tmp, 'ietd.conf')
+        with open(self.config, 'w') as fd_:
+            fd_.write(CONFIG)
+        iscsitarget.__context__ = {'iscsitarget.volumes': iscsitarget._parse_volumes(VOLUME)}
+        self.commands = []
+        self.lock = threading.Lock()
+        self.failing = ()
+        iscsitarget.__salt__ = {
+            'cmd.run': MagicMock(return_value='1234'),
+            'cmd.retcode': self.retcode,
+            'config.option': lambda opt: {
+                'iscsitarget.iqn_base': 'iqn.2007-12.net.enpraxis',
+                'iscsitarget.volgroup': 'vg_spare',
+                'iscsitarget.config': self.config}[opt],
+        }
+
+    def tearDown(self):
+        iscsitarget.__salt__ = {}
+        shutil.rmtree(self.tmp)
+
+    def retcode(self, cmd):
+        with self.lock:
+            self.commands.append(cmd)
+        return 1 if any(x in cmd for x in self.failing) else 0
+
+    def _config(self):
+        with open(self.config) as fd_:
+            return fd_.read()
+
+    def test_add_batch(self):
+        ret = iscsitarget.add_batch([
+            {'name': 'db', 'luns': [{'lun': 1, 'size': '10G'}, {'lun': 2, 'size': '10G'}]},
+            {'name': 'web', 'luns': {0: '5G', 1: '5G'}},
+            'logs',
+        ])
+        self.assertEqual(ret, {'targets': ['iqn.2007-12.net.enpraxis:web',
+                                           'iqn.2007-12.net.enpraxis:logs'],
+                               'luns': {'iqn.2007-12.net.enpraxis:db': [2],
+                                        'iqn.2007-12.net.enpraxis:web': [0, 1]},
+                               'errors': []})
+        self.assertEqual(sorted(x for x in self.commands if x.startswith('lvcreate')), [
+            'lvcreate -n db_2 vg_spare -L 10G',
+            'lvcreate -n web_0 vg_spare -L 5G',
+            'lvcreate -n web_1 vg_spare -L 5G',
+        ])
+        self.assertIn('ietadm --op new --tid 4 --params Name=iqn.2007-12.net.enpraxis:web',
+                      self.commands)
+        self.assertIn('ietadm --op new --tid 4 --lun 0 --params Path=/dev/vg_spare/web_0,Type=blockio',
+                      self.commands)
+        self.assertEqual(self._config(), CONFIG.replace(
+            'Type=blockio\nTarget 2',
+            'Type=blockio\n\tLun 2 PATH=/dev/vg_spare/db_2,Type=blockio\nTarget 2') +
+            'Target 4 iqn.2007-12.net.enpraxis:web\n'
+            '\tLun 0 PATH=/dev/vg_spare/web_0,Type=blockio\n'
+            '\tLun 1 PATH=/dev/vg_spare/web_1,Type=blockio\n'
+            'Target 5 iqn.2007-12.net.enpraxis:logs\n')
+
+    def test_add_batch_errors(self):
+        self.failing = ('-n web_1 ', '--lun 0 --params Path=/dev/vg_spare/web_0')
+        ret = iscsitarget.add_batch([{'name': 'web', 'luns': {0: '5G', 1: '5G', 2: '5G'}}])
+        self.assertEqual(ret['luns'], {'iqn.2007-12.net.enpraxis:web': [2]})
+        self.assertEqual(len(ret['errors']), 2)
+        self.assertIn('lvremove -f /dev/vg_spare/web_0', self.commands)
+        self.assertNotIn('web_0', self._config())
+        self.assertNotIn('web_1', self._config())
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(IscsiTargetTestCase, IscsiTargetBatchTestCase, needs_daemon=False)
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+'''
+Test module for keystone
+'''
+
+# Import python libs
+from __future__ import absolute_import
+import json
+import re
+import threading
+
+# Import Salt Testing libs
+from salttesting import TestCase, skipIf
+from salttesting.helpers import ensure_in_syspath
+from salttesting.mock import NO_MOCK, NO_MOCK_REASON, MagicMock, patch
+from salt.ext.six.moves import BaseHTTPServer, socketserver
+
+ensure_in_syspath('../../')
+
+from salt.modules import keystone
+
+keystone.__salt__ = {}
+keystone.__opts__ = {}
+
+
+class Item(object):
+    def __init__(self, id, name, **kwargs):  # pylint: disable-msg=C0103
+        self.id = id  # pylint: disable-msg=C0103
+        self.name = name
+        self.__dict__.update(kwargs)
+
+
+@skipIf(NO_MOCK, NO_MOCK_REASON)
+@patch.dict(keystone.__salt__, {'config.option': MagicMock(return_value=None)})
+class KeystoneIndexTestCase(TestCase):
+    def setUp(self):
+        keystone.clear_cache()
+        self.kstone = MagicMock()
+
+    def tearDown(self):
+        keystone.clear_cache()
+
+    def test_index_keeps_last_duplicate(self):
+        self.kstone.users.list.return_value = [Item('1', 'jack'), Item('2', 'jack')]
+        self.assertEqual(keystone._index(self.kstone, 'users'), {'jack': '2'})
+        keystone._index_store('users', [Item('3', 'sally'), Item('4', 'sally')])
+        self.assertEqual(keystone._index(self.kstone, 'users'), {'sally': '4'})
+
+    def test_resolve_id_cached(self):
+        self.kstone.users.list.return_value = [Item('1', 'jack')]
+        self.assertEqual(keystone._resolve_id(self.kstone, 'users', 'jack'), '1')
+        self.assertEqual(keystone._resolve_id(self.kstone, 'users', 'jack'), '1')
+        self.assertEqual(self.kstone.users.list.call_count, 1)
+
+    def test_resolve_id_miss_cached(self):
+        self.kstone.users.list.return_value = [Item('1', 'jack')]
+        self.assertEqual(keystone._resolve_id(self.kstone, 'users', 'sally'), None)
+        keystone._index_add('users', 'sally', '2')
+        self.assertEqual(keystone._resolve_id(self.kstone, 'users', 'sally'), '2')
+        keystone._index_remove('users', '2')
+        self.assertEqual(keystone._resolve_id(self.kstone, 'users', 'sally'), None)
+        self.assertEqual(self.kstone.users.list.call_count, 1)
+
+    def test_user_get_unknown_name(self):
+        self.kstone.users.list.return_value = [Item('1', 'jack')]
+        with patch.object(keystone, 'auth', return_value=self.kstone):
+            self.assertEqual(keystone.user_get(name='sally'),
+                             {'Error': 'Unable to resolve user id'})
+        self.assertFalse(self.kstone.users.get.called)
+
+    @skipIf(not keystone.HAS_KEYSTONE, 'keystoneclient is not installed')
+    def test_user_get_stale_id(self):
+        # jack was deleted and recreated outside of salt after being indexed
+        self.kstone.users.list.side_effect = [[Item('1', 'jack')], [Item('2', 'jack')]]
+        user = Item('2', 'jack', email=None, enabled=True, tenantId=None)
+
+        def _get(user_id):
+            if user_id != '2':
+                raise keystone.NotFound(404)
+            return user
+        self.kstone.users.get.side_effect = _get
+        with patch.object(keystone, 'auth', return_value=self.kstone):
+            self.assertEqual(keystone.user_get(name='jack')['jack']['id'], '2')
+
+    @skipIf(not keystone.HAS_KEYSTONE, 'keystoneclient is not installed')
+    def test_user_delete_deleted_outside(self):
+        self.kstone.users.list.side_effect = [[Item('1', 'jack')], []]
+        self.kstone.users.delete.side_effect = keystone.NotFound(404)
+        with patch.object(keystone, 'auth', return_value=self.kstone):
+            self.assertEqual(keystone.user_delete(name='jack'),
+                             {'Error': 'Unable to resolve user id'})
+        self.kstone.users.delete.assert_called_once_with('1')
+
+
+class FakeKeystoneHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Just enough of the keystone v2.0 admin API for the keystone module, the
+    state lives in ``self.server``
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    ROUTES = (
+        ('GET', r'/tenants', 'list_tenants'),
+        ('POST', r'/tenants', 'create_tenant'),
+        ('DELETE', r'/tenants/([^/]+)', 'delete'),
+        ('GET', r'/users', 'list_users'),
+        ('GET', r'/users/([^/]+)', 'get_user'),
+        ('POST', r'/users', 'create_user'),
+        ('PUT', r'/users/([^/]+)', 'update_user'),
+        ('DELETE', r'/users/([^/]+)', 'delete'),
+        ('GET', r'/OS-KSADM/roles', 'list_roles'),
+        ('POST', r'/OS-KSADM/roles', 'create_role'),
+        ('DELETE', r'/OS-KSADM/roles/([^/]+)', 'delete'),
+        ('GET', r'/tenants/([^/]+)/users/([^/]+)/roles', 'user_roles'),
+        ('PUT', r'/tenants/([^/]+)/users/([^/]+)/roles/OS-KSADM/([^/]+)', 'add_user_role'),
+        ('DELETE', r'/tenants/([^/]+)/users/([^/]+)/roles/OS-KSADM/([^/]+)', 'remove_user_role'),
+    )
+
+    def _dispatch(self):
+        path = self.path.split('?')[0]
+        if path.startswith('/v2.0'):
+            path = path[len('/v2.0'):]
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+        self.server.requests.append((self.command, path))
+        for method, pattern, name in self.ROUTES:
+            match = re.match(pattern + '$', path)
+            if method == self.command and match:
+                with self.server.lock:
+                    status, ret = getattr(self, name)(body, *match.groups())
+                break
+        else:
+            status, ret = 404, {'error': {'code': 404, 'title': 'Not Found',
+                                          'message': path}}
+        data = json.dumps(ret).encode('utf-8') if ret is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+    def _create(self, collection, item):
+        item_id = self.server.add(collection, **item)
+        return 200, {collection[:-1]: self.server.items[collection][item_id]}
+
+    def _list(self, collection):
+        return 200, {collection: list(self.server.items[collection].values())}
+
+    def list_tenants(self, body):
+        return self._list('tenants')
+
+    def list_users(self, body):
+        return self._list('users')
+
+    def list_roles(self, body):
+        return self._list('roles')
+
+    def get_user(self, body, user_id):
+        if user_id not in self.server.items['users']:
+            return 404, {'error': {'code': 404, 'title': 'Not Found',
+                                   'message': 'Could not find user'}}
+        return 200, {'user': self.server.items['users'][user_id]}
+
+    def create_tenant(self, body):
+        return self._create('tenants', body['tenant'])
+
+    def create_user(self, body):
+        item = dict(body['user'])
+        item.pop('password', None)
+        return self._create('users', item)
+
+    def create_role(self, body):
+        return self._create('roles', body['role'])
+
+    def update_user(self, body, user_id):
+        user = self.server.items['users'][user_id]
+        user.update((x, y) for x, y in body['user'].items() if y is not None)
+        return 200, {'user': user}
+
+    def delete(self, body, item_id):
+        for items in self.server.items.values():
+            items.pop(item_id, None)
+        return 204, None
+
+    def user_roles(self, body, tenant_id, user_id):
+        if (user_id, tenant_id) in self.server.broken:
+            return 500, {'error': {'code': 500, 'title': 'Internal Server Error',
+                                  'message': 'database is gone'}}
+        return 200, {'roles': [self.server.items['roles'][y]
+                               for x, y, z in sorted(self.server.assigned)
+                               if x == user_id and z == tenant_id]}
+
+    def add_user_role(self, body, tenant_id, user_id, role_id):
+        self.server.assigned.add((user_id, role_id, tenant_id))
+        return 200, {'role': self.server.items['roles'][role_id]}
+
+    def remove_user_role(self, body, tenant_id, user_id, role_id):
+        self.server.assigned.discard((user_id, role_id, tenant_id))
+        return 204, None
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeKeystoneServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        BaseHTTPServer.HTTPServer.__init__(self, *args, **kwargs)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.items = {'tenants': {}, 'users': {}, 'roles': {}}
+        self.assigned = set()
+        self.broken = set()
+        self.last_id = 0
+
+    def add(self, collection, **item):
+        self.last_id += 1
+        item['id'] = str(self.last_id)
+        self.items[collection][item['id']] = item
+        return item['id']
+
+    def names(self, collection):
+        return sorted(x['name'] for x in self.items[collection].values())
+
+    def assignments(self):
+        return sorted((self.items['users'][x]['name'],
+                       self.items['roles'][y]['name'],
+                       self.items['tenants'][z]['name'])
+                      for x, y, z in self.assigned)
+
+
+@skipIf(NO_MOCK, NO_MOCK_REASON)
+@skipIf(not keystone.HAS_KEYSTONE, 'keystoneclient is not installed')
+class KeystoneReconcileTestCase(TestCase):
+    def setUp(self):
+        keystone.clear_cache()
+        self.server = FakeKeystoneServer(('127.0.0.1', 0), FakeKeystoneHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        options = {
+            'keystone.token': 'ADMIN',
+            'keystone.endpoint': 'http://{0}:{1}/v2.0'.format(*self.server.server_address),
+        }
+        self.patcher = patch.dict(keystone.__salt__, {'config.option': options.get})
+        self.patcher.start()
+        self.admin = self.server.add('tenants', name='admin', description='', enabled=True)
+        self.role = self.server.add('roles', name='admin')
+        # v2 users do not need to have an email
+        self.jack = self.server.add('users', name='jack', enabled=True, tenantId=self.admin)
+        self.server.assigned.add((self.jack, self.role, self.admin))
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        keystone.clear_cache()
+
+    def test_reconcile(self):
+        ret = keystone.reconcile(
+            tenants=['admin', 'demo'],
+            roles=['admin', 'Member'],
+            users={'jack': {'email': 'jack@halloweentown.org'},
+                   'sally': {'password': 'zero', 'tenant': 'demo'}},
+            user_roles=[{'user': 'jack', 'role': 'admin', 'tenant': 'admin'},
+                        {'user': 'sally', 'role': 'Member', 'tenant': 'demo'}],
+        )
+        self.assertEqual(ret['errors'], [])
+        self.assertEqual(ret['created'], {'tenants': ['demo'],
+                                          'roles': ['Member'],
+                                          'users': ['sally'],
+                                          'user_roles': [('sally', 'Member', 'demo')]})
+        self.assertEqual(ret['updated'], {'users': ['jack']})
+        self.assertEqual(self.server.names('users'), ['jack', 'sally'])
+        self.assertEqual(self.server.items['users'][self.jack]['email'],
+                         'jack@halloweentown.org')
+        self.assertEqual(self.server.assignments(), [('jack', 'admin', 'admin'),
+                                                     ('sally', 'Member', 'demo')])
+        # Nothing left to do, and each collection is listed once
+        del self.server.requests[:]
+        ret = keystone.reconcile(
+            tenants=['admin', 'demo'],
+            users={'jack': {'email': 'jack@halloweentown.org'}, 'sally': {}},
+        )
+        self.assertEqual((ret['created'], ret['updated'], ret['errors']), ({}, {}, []))
+        self.assertEqual(sorted(self.server.requests),
+                         [('GET', '/OS-KSADM/roles'), ('GET', '/tenants'), ('GET', '/users')])
+
+    def test_reconcile_prune(self):
+        self.server.add('tenants', name='old', description='', enabled=True)
+        ret = keystone.reconcile(tenants=['admin'], prune=True, test=True)
+        self.assertEqual(ret['deleted'], {'tenants': ['old']})
+        self.assertEqual(self.server.names('tenants'), ['admin', 'old'])
+        ret = keystone.reconcile(tenants=['admin'], prune=True)
+        self.assertEqual(ret['deleted'], {'tenants': ['old']})
+        self.assertEqual(self.server.names('tenants'), ['admin'])
+
+    def test_reconcile_role_listing_error(self):
+        self.server.add('roles', name='Member')
+        self.server.broken.add((self.jack, self.admin))
+        ret = keystone.reconcile(
+            user_roles=[{'user': 'jack', 'role': 'Member', 'tenant': 'admin'}],
+            prune=True,
+        )
+        # The pair is skipped: nothing is added nor pruned blindly
+        self.assertEqual((ret['created'], ret['deleted']), ({}, {}))
+        self.assertEqual(len(ret['errors']), 1)
+        self.assertIn('Unable to list the roles of user jack on tenant admin',
+                      ret['errors'][0])
+        self.assertEqual(self.server.assignments(), [('jack', 'admin', 'admin')])
+
+    def test_provision_users(self):
+        # What the keystone_user.present state does for every new user
+        for num in range(20):
+            name = 'user{0}'.format(num)
+            self.assertIn('Error', keystone.user_get(name=name))
+            keystone.user_create(name, 'zero', '{0}@halloweentown.org'.format(name),
+                                 tenant_id=self.admin)
+            self.assertEqual(keystone.user_get(name=name)[name]['name'], name)
+        self.assertEqual(self.server.requests.count(('GET', '/users')), 1)
+
+    def test_user_recreated_outside(self):
+        self.assertEqual(keystone.user_get(name='jack')['jack']['id'], self.jack)
+        del self.server.items['users'][self.jack]
+        jack = self.server.add('users', name='jack', enabled=True, tenantId=self.admin)
+        self.assertEqual(keystone.user_get(name='jack')['jack']['id'], jack)
+        self.assertEqual(self.server.requests.count(('GET', '/users')), 2)
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(KeystoneIndexTestCase, KeystoneReconcileTestCase, needs_daemon=False)
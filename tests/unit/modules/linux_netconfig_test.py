@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+'''
+Test module for the netlink backend of linux_netconfig, against synthetic
+dumps and the equivalent ``ip -o`` output
+'''
+
+# Import python libs
+from __future__ import absolute_import
+import socket
+import struct
+
+# Import Salt Testing libs
+from salttesting import TestCase, skipIf
+from salttesting.helpers import ensure_in_syspath
+from salttesting.mock import NO_MOCK, NO_MOCK_REASON, MagicMock, patch
+
+ensure_in_syspath('../../')
+
+from salt.modules import linux_netconfig as nc
+
+nc.__salt__ = {}
+
+IP_LINKS = '''\
+1: lo: <LOOPBACK,UP,LOWER_UP> mtu 65536 qdisc noqueue state UNKNOWN mode DEFAULT group default qlen 1000\\    \
+link/loopback 00:00:00:00:00:00 brd 00:00:00:00:00:00
+2: eth0: <NO-CARRIER,BROADCAST,MULTICAST,UP> mtu 1500 qdisc pfifo_fast state DOWN mode DEFAULT group default \
+qlen 1000\\    link/ether 52:54:00:12:34:56 brd ff:ff:ff:ff:ff:ff
+3: eth0.10@eth0: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 qdisc noqueue state UP mode DEFAULT group default\\    \
+link/ether 52:54:00:12:34:56 brd ff:ff:ff:ff:ff:ff
+'''
+
+IP_ADDRESSES = '''\
+1: lo    inet 127.0.0.1/8 scope host lo \\       valid_lft forever preferred_lft forever
+1: lo    inet6 ::1/128 scope host \\       valid_lft forever preferred_lft forever
+3: eth0.10    inet 192.168.1.10/24 brd 192.168.1.255 scope global eth0.10 \\       valid_lft 86000sec \
+preferred_lft 86000sec
+'''
+
+IP_NEIGHBOURS = '''\
+192.168.1.1 dev eth0.10 lladdr 52:54:00:00:00:01 REACHABLE
+192.168.1.2 dev eth0.10 lladdr 52:54:00:00:00:02 STALE
+192.168.1.3 dev eth0.10 FAILED
+fe80::1 dev eth0.10 lladdr 52:54:00:00:00:01 DELAY
+'''
+
+# Only listed by "ip neigh show nud all"
+IP_NEIGHBOURS_NUD_ALL = '''\
+224.0.0.251 dev eth0.10 lladdr 01:00:5e:00:00:fb NOARP
+192.168.1.4 dev eth0.10 NONE
+'''
+
+MAC = b'\x52\x54\x00\x12\x34\x56'
+BROADCAST = b'\xff' * 6
+
+
+def _u32(value):
+    return struct.pack('=I', value)
+
+
+def _link(index, link_type, flags, name, attrs):
+    body = nc.IFINFOMSG.pack(socket.AF_UNSPEC, link_type, index, flags, 0)
+    body += nc._nl_pack_attr(nc.IFLA_IFNAME, name + b'\0')
+    for attr_type, value in attrs:
+        body += nc._nl_pack_attr(attr_type, value)
+    return nc._nl_pack_msg(nc.RTM_NEWLINK, body)
+
+
+def _addr(family, prefixlen, scope, index, attrs):
+    body = nc.IFADDRMSG.pack(family, prefixlen, 0, scope, index)
+    for attr_type, value in attrs:
+        body += nc._nl_pack_attr(attr_type, value)
+    return nc._nl_pack_msg(nc.RTM_NEWADDR, body)
+
+
+def _neigh(family, index, state, dst, lladdr=None):
+    body = nc.NDMSG.pack(family, index, state, 0, 1)
+    body += nc._nl_pack_attr(nc.NDA_DST, socket.inet_pton(family, dst))
+    if lladdr:
+        body += nc._nl_pack_attr(nc.NDA_LLADDR, lladdr)
+    return nc._nl_pack_msg(nc.RTM_NEWNEIGH, body)
+
+
+def _settings(mtu, qdisc, operstate):
+    return [(nc.IFLA_MTU, _u32(mtu)),
+            (nc.IFLA_QDISC, qdisc + b'\0'),
+            (nc.IFLA_OPERSTATE, struct.pack('B', operstate)),
+            (nc.IFLA_LINKMODE, b'\0'),
+            (nc.IFLA_GROUP, _u32(0))]
+
+
+LINKS_DUMP = b''.join([
+    _link(1, 772, 0x8 | 0x1 | 0x40 | 0x10000, b'lo',
+          _settings(65536, b'noqueue', 0) +
+          [(nc.IFLA_TXQLEN, _u32(1000)),
+           (nc.IFLA_ADDRESS, b'\0' * 6),
+           (nc.IFLA_BROADCAST, b'\0' * 6)]),
+    # UP but not RUNNING, reported as NO-CARRIER
+    _link(2, 1, 0x2 | 0x1000 | 0x1, b'eth0',
+          _settings(1500, b'pfifo_fast', 2) +
+          [(nc.IFLA_TXQLEN, _u32(1000)),
+           (nc.IFLA_ADDRESS, MAC),
+           (nc.IFLA_BROADCAST, BROADCAST)]),
+    _link(3, 1, 0x2 | 0x1000 | 0x1 | 0x40 | 0x10000, b'eth0.10',
+          _settings(1500, b'noqueue', 6) +
+          [(nc.IFLA_TXQLEN, _u32(0)),
+           (nc.IFLA_LINK, _u32(2)),
+           (nc.IFLA_ADDRESS, MAC),
+           (nc.IFLA_BROADCAST, BROADCAST)]),
+    nc._nl_pack_msg(nc.NLMSG_DONE, _u32(0)),
+])
+
+ADDRESSES_DUMP = b''.join([
+    _addr(socket.AF_INET, 8, 254, 1,
+          [(nc.IFA_ADDRESS, socket.inet_aton('127.0.0.1')),
+           (nc.IFA_LOCAL, socket.inet_aton('127.0.0.1')),
+           (nc.IFA_LABEL, b'lo\0'),
+           (nc.IFA_CACHEINFO, nc.IFA_CACHEINFO_STRUCT.pack(0xFFFFFFFF, 0xFFFFFFFF, 0, 0))]),
+    _addr(socket.AF_INET6, 128, 254, 1,
+          [(nc.IFA_ADDRESS, socket.inet_pton(socket.AF_INET6, '::1')),
+           (nc.IFA_CACHEINFO, nc.IFA_CACHEINFO_STRUCT.pack(0xFFFFFFFF, 0xFFFFFFFF, 0, 0))]),
+    _addr(socket.AF_INET, 24, 0, 3,
+          [(nc.IFA_ADDRESS, socket.inet_aton('192.168.1.10')),
+           (nc.IFA_LOCAL, socket.inet_aton('192.168.1.10')),
+           (nc.IFA_BROADCAST, socket.inet_aton('192.168.1.255')),
+           (nc.IFA_LABEL, b'eth0.10\0'),
+           (nc.IFA_CACHEINFO, nc.IFA_CACHEINFO_STRUCT.pack(86000, 86000, 0, 0))]),
+    nc._nl_pack_msg(nc.NLMSG_DONE, _u32(0)),
+])
+
+NEIGHBOURS_DUMP = b''.join([
+    _neigh(socket.AF_INET, 3, 0x02, '192.168.1.1', b'\x52\x54\x00\x00\x00\x01'),
+    _neigh(socket.AF_INET, 3, 0x04, '192.168.1.2', b'\x52\x54\x00\x00\x00\x02'),
+    _neigh(socket.AF_INET, 3, 0x20, '192.168.1.3'),
+    _neigh(socket.AF_INET6, 3, 0x08, 'fe80::1', b'\x52\x54\x00\x00\x00\x01'),
+    _neigh(socket.AF_INET, 3, 0x40, '224.0.0.251', b'\x01\x00\x5e\x00\x00\xfb'),
+    _neigh(socket.AF_INET, 3, 0, '192.168.1.4'),
+    nc._nl_pack_msg(nc.NLMSG_DONE, _u32(0)),
+])
+
+
+@skipIf(NO_MOCK, NO_MOCK_REASON)
+class LinuxNetconfigNetlinkTestCase(TestCase):
+    def _names(self):
+        return nc._netlink_links(LINKS_DUMP)[1]
+
+    def test_links(self):
+        parsed, names = nc._netlink_links(LINKS_DUMP)
+        self.assertEqual(names, {1: 'lo', 2: 'eth0', 3: 'eth0.10'})
+        self.assertEqual(parsed, nc._structured_links_output(IP_LINKS))
+        self.assertEqual(parsed['eth0']['flags'][0], 'NO-CARRIER')
+        self.assertNotIn('qlen', parsed['eth0.10@eth0']['settings'])
+
+    def test_addresses(self):
+        parsed = nc._netlink_addresses(ADDRESSES_DUMP, self._names())
+        self.assertEqual(parsed, nc._structured_addresses_output(IP_ADDRESSES))
+
+    def test_neighbours_nud_filter(self):
+        parsed = nc._netlink_neighbours(NEIGHBOURS_DUMP, self._names())
+        self.assertEqual(parsed, nc._structured_neigh_output(IP_NEIGHBOURS))
+        self.assertNotIn(('224.0.0.251', 'eth0.10'), parsed)
+        self.assertNotIn(('192.168.1.4', 'eth0.10'), parsed)
+
+        parsed = nc._netlink_neighbours(NEIGHBOURS_DUMP, self._names(), nc.NUD_ALL_FILTER)
+        self.assertEqual(parsed,
+                         nc._structured_neigh_output(IP_NEIGHBOURS + IP_NEIGHBOURS_NUD_ALL))
+
+        # Only the failed entry passes a "nud failed" filter
+        parsed = nc._netlink_neighbours(NEIGHBOURS_DUMP, self._names(), 0x20)
+        self.assertEqual(parsed, {('192.168.1.3', 'eth0.10'): {'state': 'FAILED'}})
+
+    def test_neighbours_unknown_index(self):
+        data = _neigh(socket.AF_INET, 9, 0x02, '10.0.0.1', MAC)
+        self.assertEqual(nc._netlink_neighbours(data, {}),
+                         {('10.0.0.1', 'if9'): {'state': 'REACHABLE',
+                                                'lladdr': '52:54:00:12:34:56'}})
+
+    def test_truncated_attributes(self):
+        body = nc.NDMSG.pack(socket.AF_INET, 3, 0x02, 0, 1)
+        body += nc._nl_pack_attr(nc.NDA_DST, socket.inet_aton('10.0.0.1'))
+        # NDA_LLADDR claims 12 bytes but only 6 follow
+        body += struct.pack('=HH', 16, nc.NDA_LLADDR) + MAC
+        attrs = nc._netlink_attrs(body, nc.NDMSG.size)
+        self.assertEqual(attrs, {nc.NDA_DST: socket.inet_aton('10.0.0.1')})
+        self.assertEqual(nc._netlink_neighbours(nc._nl_pack_msg(nc.RTM_NEWNEIGH, body), self._names()),
+                         {('10.0.0.1', 'eth0.10'): {'state': 'REACHABLE'}})
+
+        # A zero length attribute, or a partial header, ends the list
+        body = nc._nl_pack_attr(nc.IFLA_MTU, _u32(1500)) + struct.pack('=HH', 0, nc.IFLA_QDISC) + b'xx'
+        self.assertEqual(nc._netlink_attrs(body, 0), {nc.IFLA_MTU: _u32(1500)})
+        self.assertEqual(nc._netlink_attrs(body[:10], 0), {nc.IFLA_MTU: _u32(1500)})
+
+        # A link whose broadcast address was cut off is skipped, like by the ip parser
+        body = nc.IFINFOMSG.pack(socket.AF_UNSPEC, 1, 4, 0x1, 0)
+        body += nc._nl_pack_attr(nc.IFLA_IFNAME, b'eth1\0') + nc._nl_pack_attr(nc.IFLA_ADDRESS, MAC)
+        body += struct.pack('=HH', 10, nc.IFLA_BROADCAST) + BROADCAST[:2]
+        data = nc._nl_pack_msg(nc.RTM_NEWLINK, body)
+        parsed, names = nc._netlink_links(data)
+        self.assertEqual(parsed, {})
+        self.assertEqual(names, {4: 'eth1'})
+
+    def test_truncated_messages(self):
+        message = _neigh(socket.AF_INET, 3, 0x02, '10.0.0.1', MAC)
+        data = NEIGHBOURS_DUMP[:-20] + message[:-4]
+        types = [nl_type for nl_type, _ in nc._netlink_messages(data)]
+        self.assertEqual(types, [nc.RTM_NEWNEIGH] * 6)
+
+    def test_dump(self):
+        sock = MagicMock()
+        sock.recv.side_effect = [NEIGHBOURS_DUMP[:-20], NEIGHBOURS_DUMP[-20:]]
+        with patch.object(nc.socket, 'socket', MagicMock(return_value=sock)):
+            self.assertEqual(nc._netlink_dump(nc.RTM_GETNEIGH), NEIGHBOURS_DUMP)
+        self.assertEqual(sock.recv.call_count, 2)
+        self.assertTrue(sock.close.called)
+
+        sock = MagicMock()
+        sock.recv.return_value = nc._nl_pack_msg(nc.NLMSG_ERROR, _u32(0))
+        with patch.object(nc.socket, 'socket', MagicMock(return_value=sock)):
+            self.assertRaises(socket.error, nc._netlink_dump, nc.RTM_GETNEIGH)
+        self.assertTrue(sock.close.called)
+
+    def test_backend_fallback(self):
+        cmd = MagicMock(return_value=IP_NEIGHBOURS)
+        with patch.dict(nc.__salt__, {'cmd.run': cmd}):
+            with patch.object(nc, '_netlink_dump', MagicMock(side_effect=socket.error)):
+                self.assertEqual(nc.neighbours(backend='netlink'),
+                                 nc._structured_neigh_output(IP_NEIGHBOURS))
+        cmd.assert_called_once_with('ip -o neigh show ')
+
+    def test_benchmark_parsers_match(self):
+        with patch.multiple(nc, _netlink_dump=MagicMock(return_value=NEIGHBOURS_DUMP),
+                            neighbours_with_options=MagicMock(return_value={})):
+            ret = nc.benchmark(50, 1)
+        self.assertEqual(ret['neighbours'], 50)
+        self.assertTrue(ret['parse']['match'])
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(LinuxNetconfigNetlinkTestCase, needs_daemon=False)
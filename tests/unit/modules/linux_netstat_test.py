@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+'''
+Test module for linux_netstat, against fake /proc/net files
+'''
+
+# Import python libs
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+
+# Import Salt Testing libs
+from salttesting import TestCase, skipIf
+from salttesting.helpers import ensure_in_syspath
+from salttesting.mock import NO_MOCK, NO_MOCK_REASON, MagicMock, patch
+
+ensure_in_syspath('../../')
+
+from salt.modules import linux_netstat
+
+NETSTAT = '''\
+TcpExt: SyncookiesSent ListenOverflows ListenDrops
+TcpExt: 0 10 20
+IpExt: InNoRoutes InOctets
+IpExt: 0 1000
+'''
+
+SNMP = '''\
+Ip: Forwarding DefaultTTL InReceives
+Ip: 1 64 100
+Tcp: RtoAlgorithm RtoMin RtoMax MaxConn ActiveOpens CurrEstab RetransSegs
+Tcp: 1 200 120000 -1 50 10 4294967290
+'''
+
+
+@skipIf(NO_MOCK, NO_MOCK_REASON)
+class LinuxNetstatTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.saved = linux_netstat.NETSTAT_FILES
+        linux_netstat.NETSTAT_FILES = (os.path.join(self.root, 'netstat'),
+                                       os.path.join(self.root, 'snmp'))
+        self._write(NETSTAT, SNMP)
+        linux_netstat._SAMPLES.clear()
+        self.now = 1000.0
+
+    def tearDown(self):
+        linux_netstat.NETSTAT_FILES = self.saved
+        linux_netstat._SAMPLES.clear()
+        shutil.rmtree(self.root)
+
+    def _write(self, netstat, snmp):
+        for path, content in zip(linux_netstat.NETSTAT_FILES, (netstat, snmp)):
+            with open(path, 'w') as handle:
+                handle.write(content)
+
+    def _rates(self, counters=None):
+        self.now += 1
+        with patch.object(linux_netstat.time, 'time', MagicMock(return_value=self.now)):
+            return linux_netstat.rates(counters)
+
+    def test_read_counters_filter(self):
+        names, values = linux_netstat._read_counters(
+            linux_netstat._counter_filter('Tcp.RetransSegs, TcpExt'))
+        self.assertEqual(names, ('TcpExt.SyncookiesSent', 'TcpExt.ListenOverflows',
+                                 'TcpExt.ListenDrops', 'Tcp.RetransSegs'))
+        self.assertEqual(list(values), [0, 10, 20, 4294967290])
+        self.assertEqual(linux_netstat.s('Tcp.MaxConn,Ip'),
+                         {'Tcp': {'MaxConn': -1},
+                          'Ip': {'Forwarding': 1, 'DefaultTTL': 64, 'InReceives': 100}})
+
+    def test_rates(self):
+        self.assertEqual(self._rates('Tcp,IpExt'), {})
+        self._write(NETSTAT.replace('0 1000', '0 3000'),
+                    SNMP.replace('1 200 120000 -1 50 10 4294967290',
+                                 '1 200 120000 -1 3 5 4'))
+        ret = self._rates('Tcp,IpExt')
+        self.assertEqual(ret['IpExt']['InOctets'], 2000)
+        # a gauge going down is not a wrap
+        self.assertEqual(ret['Tcp']['CurrEstab'], -5)
+        self.assertEqual(ret['Tcp']['MaxConn'], 0)
+        # a 32 bits counter close to its maximum wrapped, another was reset
+        self.assertEqual(ret['Tcp']['RetransSegs'], 10)
+        self.assertEqual(ret['Tcp']['ActiveOpens'], 3)
+
+    def test_rates_counter_set_change(self):
+        self._rates('TcpExt')
+        self._write(NETSTAT.replace('ListenDrops', 'ListenDrops TCPTimeouts')
+                           .replace('10 20', '10 20 7'), SNMP)
+        self.assertEqual(self._rates('TcpExt'), {})
+        self.assertEqual(self._rates('TcpExt')['TcpExt'],
+                         {'SyncookiesSent': 0, 'ListenOverflows': 0,
+                          'ListenDrops': 0, 'TCPTimeouts': 0})
+
+    def test_benchmark_keeps_samples(self):
+        self._rates('Tcp.RetransSegs,TcpExt.ListenOverflows')
+        saved = dict(linux_netstat._SAMPLES)
+        linux_netstat.benchmark(iterations=2)
+        self.assertEqual(linux_netstat._SAMPLES, saved)
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(LinuxNetstatTestCase, needs_daemon=False)
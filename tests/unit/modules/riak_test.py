@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+'''
+Test module for riak
+'''
+
+# Import python libs
+from __future__ import absolute_import
+
+# Import Salt Testing libs
+from salttesting import TestCase, skipIf
+from salttesting.helpers import ensure_in_syspath
+from salttesting.mock import NO_MOCK, NO_MOCK_REASON, MagicMock, patch
+
+ensure_in_syspath('../../')
+
+from salt.modules import riak
+
+riak.__salt__ = {}
+riak.__context__ = {}
+
+MEMBER_STATUS = '''\
+================================= Membership ==================================
+Status     Ring    Pending    Node
+-------------------------------------------------------------------------------
+valid      34.4%     50.0%    'dev1@127.0.0.1'
+leaving    65.6%      --      'dev2@127.0.0.1'
+-------------------------------------------------------------------------------
+Valid:1 / Leaving:1 / Exiting:0 / Joining:0 / Down:0'''
+
+RING_STATUS = '''\
+================================== Claimant ===================================
+Claimant:  'dev1@127.0.0.1'
+Status:     up
+Ring Ready: true
+
+============================== Ownership Handoff ==============================
+Owner:      dev1@127.0.0.1
+Next Owner: dev2@127.0.0.1
+
+Index: 22835963083295358096932575511191922182123945984
+  Waiting on: [riak_kv_vnode]
+  Complete:   [riak_pipe_vnode]
+
+-------------------------------------------------------------------------------
+
+============================== Unreachable Nodes ==============================
+The following nodes are unreachable: ['dev3@127.0.0.1']'''
+
+TRANSFERS = '''\
+'dev2@127.0.0.1' waiting to handoff 7 partitions
+'dev3@127.0.0.1' does not have 5 primary partitions running
+
+Active Transfers:
+
+transfer type: hinted_handoff
+vnode type: riak_kv_vnode
+partition: 1370157784997721485815954530671515330927436759040
+
+transfer type: ownership_transfer
+vnode type: riak_kv_vnode
+partition: 22835963083295358096932575511191922182123945984'''
+
+STATUS = '''\
+1-minute stats for 'dev1@127.0.0.1'
+-------------------------------------------
+vnode_gets : 12
+node_get_fsm_time_mean : 1.5e3
+cpu_avg1 : 0.25
+ring_members : ['dev1@127.0.0.1','dev2@127.0.0.1']
+riak_kv_version : <<"2.0.0">>
+storage_backend : riak_kv_bitcask_backend
+ring_ready : true
+disk : [{"/",1234,12}]'''
+
+
+@skipIf(NO_MOCK, NO_MOCK_REASON)
+class RiakTestCase(TestCase):
+    def setUp(self):
+        riak.__context__ = {}
+
+    def test_parse_status(self):
+        stats = riak._parse_status(STATUS.split('\n'))
+        self.assertEqual(stats['vnode_gets'], 12)
+        self.assertEqual(stats['node_get_fsm_time_mean'], 1500.0)
+        self.assertEqual(stats['cpu_avg1'], 0.25)
+        self.assertEqual(stats['ring_members'], ['dev1@127.0.0.1', 'dev2@127.0.0.1'])
+        self.assertEqual(stats['riak_kv_version'], '2.0.0')
+        self.assertEqual(stats['storage_backend'], 'riak_kv_bitcask_backend')
+        self.assertTrue(stats['ring_ready'])
+        self.assertEqual(stats['disk'], '[{"/",1234,12}]')
+
+    def test_parse_member_status(self):
+        ret = riak._parse_member_status(MEMBER_STATUS.split('\n'))
+        self.assertEqual(ret['members'][0], {'status': 'valid', 'ring': 34.4,
+                                             'pending': 50.0, 'node': 'dev1@127.0.0.1'})
+        self.assertEqual(ret['members'][1]['pending'], None)
+        self.assertEqual(ret['summary']['leaving'], 1)
+        self.assertEqual(ret['summary']['down'], 0)
+
+    def test_parse_ring_status(self):
+        ret = riak._parse_ring_status(RING_STATUS.split('\n'))
+        self.assertEqual(ret['claimant'], 'dev1@127.0.0.1')
+        self.assertEqual(ret['status'], 'up')
+        self.assertTrue(ret['ringready'])
+        self.assertEqual(ret['unreachable'], ['dev3@127.0.0.1'])
+        handoff = ret['handoffs'][0]
+        self.assertEqual(handoff['next_owner'], 'dev2@127.0.0.1')
+        self.assertEqual(handoff['partitions'][0]['waiting_on'], ['riak_kv_vnode'])
+
+    def test_parse_transfers(self):
+        ret = riak._parse_transfers(TRANSFERS.split('\n'))
+        self.assertEqual(ret['waiting_to_handoff'], {'dev2@127.0.0.1': 7})
+        self.assertEqual(ret['missing_primaries'], {'dev3@127.0.0.1': 5})
+        self.assertEqual([x['transfer type'] for x in ret['active']],
+                         ['hinted_handoff', 'ownership_transfer'])
+
+    def test_context_cache(self):
+        run = MagicMock(return_value='pong')
+        option = MagicMock(return_value=None)
+        with patch.dict(riak.__salt__, {'cmd.run': run, 'config.option': option}):
+            self.assertTrue(riak.is_up())
+            self.assertTrue(riak.is_up())
+            self.assertEqual(run.call_count, 1)
+            riak.__salt__['cmd.run'] = MagicMock(return_value='Node is already running!')
+            self.assertTrue(riak.start())
+            self.assertNotIn('riak.output', riak.__context__)
+
+    def test_cluster_snapshot(self):
+        outputs = {'riak-admin member-status': MEMBER_STATUS,
+                   'riak-admin ring-status': RING_STATUS,
+                   'riak-admin transfers': TRANSFERS}
+        run = MagicMock(side_effect=outputs.get)
+        with patch.dict(riak.__salt__, {'cmd.run': run}):
+            riak.member_status()
+            snapshot = riak.cluster_snapshot()
+            self.assertEqual(run.call_count, 3)
+        self.assertEqual(snapshot['members']['summary']['valid'], 1)
+        self.assertEqual(snapshot['ring']['claimant'], 'dev1@127.0.0.1')
+        self.assertEqual(snapshot['transfers']['missing_primaries'], {'dev3@127.0.0.1': 5})
+
+    def test_status_http(self):
+        option = MagicMock(side_effect={'riak.http_url': 'http://127.0.0.1:8098',
+                                        'riak.http_timeout': None}.get)
+        with patch.dict(riak.__salt__, {'config.option': option, 'cmd.run': MagicMock()}):
+            with patch('salt.modules.riak._http_get', MagicMock(return_value='{"vnode_gets": 3}')):
+                self.assertEqual(riak.status(), {'vnode_gets': 3})
+                self.assertFalse(riak.__salt__['cmd.run'].called)
+            with patch('salt.modules.riak._http_get', MagicMock(return_value=None)):
+                self.assertEqual(riak.status(), {'vnode_gets': 3})
+                riak.__salt__['cmd.run'].return_value = STATUS
+                self.assertEqual(riak.status(refresh=True)['vnode_gets'], 12)
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(RiakTestCase, needs_daemon=False)
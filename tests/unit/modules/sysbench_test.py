@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+'''
+Test module for sysbench
+'''
+
+# Import python libs
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+
+# Import Salt Testing libs
+from salttesting import TestCase, skipIf
+from salttesting.helpers import ensure_in_syspath
+from salttesting.mock import NO_MOCK, NO_MOCK_REASON, MagicMock, patch
+
+ensure_in_syspath('../../')
+
+from salt.modules import sysbench
+from salt.exceptions import CommandExecutionError
+
+sysbench.__salt__ = {}
+sysbench.__opts__ = {}
+
+OUTPUT_04 = '''\
+Test execution summary:
+    total time:                          10.0006s
+    total number of events:              10000
+    total time taken by event execution: 9.9925
+    per-request statistics:
+         min:                                  0.95ms
+         avg:                                  1.00ms
+         max:                                  1.20s
+         approx.  95 percentile:               1.03ms
+'''
+
+OUTPUT_10 = '''\
+CPU speed:
+    events per second:  1234.56
+
+General statistics:
+    total time:                          10.0002s
+    total number of events:              12346
+
+Latency (ms):
+         min:                                    0.79
+         avg:                                    0.81
+         max:                                    1.52
+         95th percentile:                        0.83
+         sum:                                 9998.25
+
+Threads fairness:
+    events (avg/stddev):           12346.0000/0.00
+    execution time (avg/stddev):   9.9983/0.00
+'''
+
+
+def _ran(stdout, retcode=0, stderr=''):
+    return {'retcode': retcode, 'stdout': stdout, 'stderr': stderr}
+
+
+@skipIf(NO_MOCK, NO_MOCK_REASON)
+class SysbenchTestCase(TestCase):
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        sysbench.__opts__ = {'cachedir': self.cachedir}
+        sysbench.__salt__ = {'config.option': MagicMock(return_value=None)}
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def test_parser(self):
+        ret = sysbench._parser(OUTPUT_04)
+        self.assertEqual(ret['total_time_s'], 10.0006)
+        self.assertEqual(ret['events'], 10000)
+        self.assertAlmostEqual(ret['events_per_sec'], 10000 / 10.0006)
+        self.assertEqual(ret['execution_time_s'], 9.9925)
+        self.assertEqual(ret['latency_max_ms'], 1200.0)
+        self.assertEqual(ret['latency_p95_ms'], 1.03)
+        self.assertEqual(ret['mib_per_sec'], None)
+
+        ret = sysbench._parser(OUTPUT_10)
+        self.assertEqual(ret['events_per_sec'], 1234.56)
+        self.assertEqual(ret['latency_min_ms'], 0.79)
+        self.assertEqual(ret['latency_max_ms'], 1.52)
+        self.assertEqual(ret['latency_p95_ms'], 0.83)
+        self.assertEqual(ret['execution_time_s'], 9.9983)
+
+    def test_options(self):
+        run = MagicMock(return_value=_ran(OUTPUT_10))
+        sysbench.__salt__['cmd.run_all'] = run
+        with patch('salt.utils.which', MagicMock(return_value='/usr/bin/sysbench')):
+            ret = sysbench.cpu(max_primes=[20000], num_threads=4, time_limit=10)
+        run.assert_called_once_with('sysbench --num-threads=4 --test=cpu '
+                                    '--cpu-max-prime=20000 --max-time=10 run')
+        self.assertEqual(list(ret), ['Primer numbers limit: 20000'])
+
+    def test_run_failure(self):
+        sysbench.__salt__['cmd.run_all'] = MagicMock(
+            return_value=_ran('', 1, "FATAL: invalid option '--bad'"))
+        with patch('salt.utils.which', MagicMock(return_value='/usr/bin/sysbench')):
+            self.assertRaisesRegexp(CommandExecutionError, "exit code 1: FATAL: invalid option '--bad'",
+                                    sysbench.cpu, max_primes=[500], store=True)
+        self.assertEqual(sysbench.history(), [])
+
+    def test_compare(self):
+        run = MagicMock(return_value=_ran(OUTPUT_10))
+        sysbench.__salt__['cmd.run_all'] = run
+        with patch('salt.utils.which', MagicMock(return_value='/usr/bin/sysbench')):
+            sysbench.cpu(max_primes=[500], store=True)
+            self.assertEqual(sysbench.set_baseline(), ['cpu'])
+            run.return_value = _ran(OUTPUT_10.replace('1234.56', '1000.00'))
+            sysbench.cpu(max_primes=[500], store=True)
+        self.assertEqual(len(sysbench.history('cpu')), 2)
+
+        ret = sysbench.compare('cpu')
+        change = ret['changes']['cpu']['Primer numbers limit: 500']['events_per_sec']
+        self.assertEqual(change['change_pct'], 19.0)
+        self.assertEqual(ret['regressions'], ['cpu: Primer numbers limit: 500: events_per_sec'])
+        self.assertEqual(sysbench.compare('cpu', threshold=20)['regressions'], [])
+        # A threshold of 0 set in the config is not replaced by the default
+        sysbench.__salt__['config.option'].side_effect = \
+            lambda name: 0 if name == 'sysbench.threshold' else None
+        run.return_value = _ran(OUTPUT_10.replace('1234.56', '1234.00'))
+        with patch('salt.utils.which', MagicMock(return_value='/usr/bin/sysbench')):
+            sysbench.cpu(max_primes=[500], store=True)
+        self.assertEqual(sysbench.compare('cpu')['regressions'],
+                         ['cpu: Primer numbers limit: 500: events_per_sec'])
+
+    def test_fileio(self):
+        calls = []
+        failing = ['--file-test-mode=rndrd run']
+
+        def run(cmd, cwd=None):
+            calls.append(cmd.split()[-2:])
+            self.assertTrue(os.path.isdir(cwd))
+            if any(cmd.endswith(x) for x in failing):
+                return _ran('', 1, 'FATAL: Failed to read file')
+            return _ran(OUTPUT_10)
+
+        sysbench.__salt__['cmd.run_all'] = run
+        partial_path = os.path.join(self.cachedir, 'sysbench', sysbench.FILEIO_PARTIAL)
+        with patch('salt.utils.which', MagicMock(return_value='/usr/bin/sysbench')):
+            self.assertRaises(CommandExecutionError, sysbench.fileio, directory=self.cachedir,
+                              total_size='64M')
+            self.assertEqual(calls, [['--file-test-mode=seqwr', 'prepare'],
+                                     ['--file-test-mode=seqwr', 'run'],
+                                     ['--file-test-mode=seqrewr', 'run'],
+                                     ['--file-test-mode=seqrd', 'run'],
+                                     ['--file-test-mode=rndrd', 'run'],
+                                     ['--file-test-mode=seqwr', 'cleanup']])
+            # only the sysbench directory holding the results is left
+            self.assertEqual(os.listdir(self.cachedir), ['sysbench'])
+            # the failed mode is not recorded as done
+            self.assertEqual(sorted(sysbench._read_json(partial_path)['results']),
+                             ['Mode: seqrd', 'Mode: seqrewr', 'Mode: seqwr'])
+
+            # a failed cleanup does not fail the run, the files are removed anyway
+            del calls[:]
+            failing[:] = ['cleanup']
+            ret = sysbench.fileio(directory=self.cachedir, total_size='64M')
+        self.assertEqual(len(ret), 6)
+        # seqwr, seqrewr and seqrd were not run again
+        self.assertEqual(calls, [['--file-test-mode=rndrd', 'prepare'],
+                                 ['--file-test-mode=rndrd', 'run'],
+                                 ['--file-test-mode=rndwr', 'run'],
+                                 ['--file-test-mode=rndrw', 'run'],
+                                 ['--file-test-mode=rndrd', 'cleanup']])
+        self.assertEqual(os.listdir(self.cachedir), ['sysbench'])
+        self.assertEqual(os.listdir(os.path.join(self.cachedir, 'sysbench')), [])
+
+    def test_fileio_prepare_failure(self):
+        calls = []
+
+        def run(cmd, cwd=None):
+            calls.append(cmd.split()[-1])
+            return _ran('', 1, 'FATAL: No space left on device') if cmd.endswith('prepare') else _ran('')
+
+        sysbench.__salt__['cmd.run_all'] = run
+        with patch('salt.utils.which', MagicMock(return_value='/usr/bin/sysbench')):
+            self.assertRaisesRegexp(CommandExecutionError, 'No space left on device', sysbench.fileio,
+                                    directory=self.cachedir, modes=['seqwr'])
+        self.assertEqual(calls, ['prepare', 'cleanup'])
+        self.assertEqual(os.listdir(self.cachedir), [])
+
+    def test_python_suite(self):
+        ret = sysbench.python_suite(duration=0.05, max_prime=100, block_size=4096,
+                                    small_files=5, directory=self.cachedir)
+        self.assertEqual(ret['Small files: 5 of 4096']['events'], 5)
+        for result in ret.values():
+            self.assertTrue(result['total_time_s'] > 0)
+        self.assertTrue(ret['Memory: copy blocks of 4096']['mib_per_sec'] > 0)
+        self.assertTrue(ret['Fsync: blocks of 4096']['latency_p95_ms'] > 0)
+
+    def test_latency_stats_empty(self):
+        ret = sysbench._latency_stats([])
+        self.assertEqual(ret['events'], 0)
+        self.assertEqual(ret['latency_avg_ms'], None)
+        self.assertEqual(ret['latency_p95_ms'], None)
+        ret = sysbench.python_suite(duration=0, small_files=0, directory=self.cachedir)
+        self.assertEqual(ret['Small files: 0 of 4096']['events'], 0)
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(SysbenchTestCase, needs_daemon=False)
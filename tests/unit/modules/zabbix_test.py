@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+'''
+Test module for the object cache of the zabbix module, against a mocked
+ZabbixAPI
+'''
+
+# Import python libs
+from __future__ import absolute_import
+
+# Import Salt Testing libs
+from salttesting import TestCase, skipIf
+from salttesting.helpers import ensure_in_syspath
+from salttesting.mock import NO_MOCK, NO_MOCK_REASON, MagicMock, patch
+
+ensure_in_syspath('../../')
+# The module is deployed along with the zapi client of the zapi state
+ensure_in_syspath('../../../states')
+
+from salt.modules import zabbix
+
+zabbix.__context__ = {}
+
+TEMPLATE = {'templateid': '10', 'host': 'Template App', 'name': 'Template App',
+            'applications': [{'applicationid': '20', 'name': 'App', 'hostid': '10'}]}
+ITEMS = [{'itemid': '30', 'name': 'Load', 'key_': 'system.cpu.load', 'hostid': '10',
+          'applications': [{'applicationid': '20'}]},
+         {'itemid': '31', 'name': 'Other', 'key_': 'other', 'hostid': '11',
+          'applications': []}]
+
+
+@skipIf(NO_MOCK, NO_MOCK_REASON)
+class ZabbixCacheTestCase(TestCase):
+    def setUp(self):
+        zabbix.__context__.clear()
+        self.api = MagicMock()
+        self.batch = MagicMock()
+        self.api.batch.return_value.__enter__.return_value = self.batch
+        patcher = patch.object(zabbix, '_zapi', MagicMock(return_value=self.api))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_find_cached(self):
+        self.api.Hostgroup.find.return_value = [{'groupid': '1', 'name': 'Servers'}]
+        self.assertTrue(zabbix._hostgroup('Servers'))
+        self.assertEqual(zabbix._find('Hostgroup', {'name': 'Servers'}),
+                         [{'groupid': '1', 'name': 'Servers'}])
+        self.api.Hostgroup.find.assert_called_once_with({'name': 'Servers'})
+        self.assertFalse(self.api.Hostgroup.create.called)
+
+        # Another filter is another lookup
+        self.api.Hostgroup.find.return_value = []
+        self.assertEqual(zabbix._find('Hostgroup', {'name': 'Other'}), [])
+        self.assertEqual(self.api.Hostgroup.find.call_count, 2)
+
+    def test_create_invalidates(self):
+        self.api.Trigger.find.return_value = []
+        self.api.Trigger.create.return_value = {'triggerids': ['40']}
+        zabbix._find('Trigger', {'description': 'Other'})
+        self.assertTrue(zabbix._trigger('High load', '{Template App:system.cpu.load.last(0)}>5'))
+
+        # The check after the creation is answered by the cache
+        self.assertEqual(self.api.Trigger.find.call_count, 2)
+        self.assertEqual(self.api.Trigger.create.call_count, 1)
+        self.assertEqual(zabbix._find('Trigger', {'description': 'High load'})[0]['triggerid'], '40')
+
+        # Lookups with other filters were dropped, they may match the new trigger
+        zabbix._find('Trigger', {'description': 'Other'})
+        self.assertEqual(self.api.Trigger.find.call_count, 3)
+
+    def test_update_invalidates(self):
+        self.api.Trigger.find.return_value = [{'triggerid': '40', 'description': 'High load',
+                                               'expression': 'old', 'priority': 1, 'status': 0}]
+        self.assertTrue(zabbix._trigger('High load', 'new', priority=4))
+        self.api.Trigger.update.assert_called_once_with({'triggerid': '40', 'expression': 'new',
+                                                         'priority': 4, 'status': 0})
+        self.assertEqual(self.api.Trigger.find.call_count, 1)
+
+        # The cached copy was updated along with the trigger
+        self.assertEqual(zabbix._find('Trigger', {'description': 'High load'})[0]['expression'], 'new')
+        self.assertEqual(self.api.Trigger.find.call_count, 1)
+
+    def test_prefetch_template(self):
+        self.batch.results = [[dict(TEMPLATE)], ITEMS]
+        zabbix._prefetch_template('Template App')
+        zabbix._prefetch_template('Template App')
+        self.assertEqual(self.api.batch.call_count, 1)
+        self.assertEqual(self.batch.add.call_count, 2)
+
+        cache = zabbix.__context__['zabbix.cache']
+        self.assertEqual(cache['prefetched'], set(['Template App']))
+        self.assertEqual(cache['complete'][('Item', '10')], ITEMS[:1])
+
+        # The template, its applications and items are resolved locally
+        self.assertEqual(zabbix._find('Template', {'name': 'Template App'})[0]['templateid'], '10')
+        self.assertEqual(zabbix._find('Application', {'name': 'App', 'hostid': '10'}),
+                         TEMPLATE['applications'])
+        self.assertEqual(zabbix._find('Item', {'key_': 'system.cpu.load', 'hostid': '10',
+                                               'application': '20'}), ITEMS[:1])
+        self.assertEqual(zabbix._find('Item', {'key_': 'system.cpu.load', 'hostid': '10',
+                                               'application': '21'}), [])
+        self.assertFalse(self.api.Template.find.called)
+        self.assertFalse(self.api.Application.find.called)
+        self.assertFalse(self.api.Item.find.called)
+
+    def test_item_on_prefetched_template(self):
+        self.batch.results = [[dict(TEMPLATE)], []]
+        self.api.Item.create.return_value = {'itemids': ['32']}
+        self.assertTrue(zabbix._item('Load', 'system.cpu.load', 'Template App', 'App'))
+        self.assertTrue(zabbix._item('Load', 'system.cpu.load', 'Template App', 'App', delay=30))
+
+        # Created, then updated, without looking anything up
+        self.assertEqual(self.api.Item.create.call_count, 1)
+        self.assertEqual(self.api.Item.create.call_args[0][0]['applications'], ['20'])
+        self.api.Item.update.assert_called_once_with({'itemid': '32', 'type': 0, 'value_type': 0,
+                                                      'data_type': 0, 'delta': 0, 'delay': 30})
+        self.assertFalse(self.api.Item.find.called)
+        self.assertEqual(zabbix.__context__['zabbix.cache']['complete'][('Item', '10')][0]['delay'], 30)
+
+    def test_invalidate(self):
+        self.api.Host.find.return_value = []
+        self.api.Hostgroup.find.return_value = []
+        zabbix._find('Host', {'name': 'a'})
+        zabbix._find('Hostgroup', {'name': 'a'})
+        zabbix._invalidate('Host')
+        zabbix._find('Host', {'name': 'a'})
+        zabbix._find('Hostgroup', {'name': 'a'})
+        self.assertEqual(self.api.Host.find.call_count, 2)
+        self.assertEqual(self.api.Hostgroup.find.call_count, 1)
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(ZabbixCacheTestCase, needs_daemon=False)
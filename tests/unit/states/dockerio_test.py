@@ -6,7 +6,7 @@ from contextlib import contextmanager
 
 # Import Salt Testing libs
 from salttesting import skipIf, TestCase
-from salttesting.mock import NO_MOCK, NO_MOCK_REASON, MagicMock
+from salttesting.mock import NO_MOCK, NO_MOCK_REASON, MagicMock, patch
 
 
 @contextmanager
@@ -108,6 +108,40 @@ class DockerStateTestCase(TestCase):
                                   'changes': {}})
 
 
+@skipIf(NO_MOCK, NO_MOCK_REASON)
+class DockerPulledPrefetchTestCase(TestCase):
+    def test_pulled_prefetch(self):
+        from salt.states import dockerio
+        chunks = [{'state': 'docker', 'fun': 'pulled', 'name': 'ubuntu', 'tag': '14.04',
+                   '__id__': 'ubuntu', '__sls__': 'base'},
+                  {'state': 'docker', 'fun': 'pulled', 'name': 'redis',
+                   '__id__': 'redis', '__sls__': 'base'},
+                  {'state': 'docker', 'fun': 'pulled', 'name': 'present',
+                   '__id__': 'present', '__sls__': 'base'}]
+        images = {'ubuntu:14.04': {'status': True, 'id': 'new-ubuntu'},
+                  'redis:latest': {'status': True, 'id': 'new-redis'}}
+        inspect = MagicMock(side_effect=lambda name: {
+            'status': name == 'present:latest', 'out': {'Id': 'old-present'}})
+        pull_many = MagicMock(return_value={'status': True, 'out': {'images': images}})
+        pull = MagicMock()
+        salt_fixture = {'docker.inspect_image': inspect,
+                        'docker.pull_many': pull_many,
+                        'docker.pull': pull,
+                        'config.option': MagicMock(return_value=None)}
+        dockerio.__opts__ = {'test': False}
+        dockerio.__context__ = {}
+        with provision_state(dockerio, salt_fixture):
+            with patch('salt.utils.gen_state_tag', MagicMock(side_effect=lambda x: x['__id__']),
+                       create=True):
+                dockerio.mod_aggregate(chunks[0], chunks, {})
+            pull_many.assert_called_once_with([{'redis': 'latest'}, {'ubuntu': '14.04'}],
+                                              workers=4, insecure_registry=False)
+            result = dockerio.pulled('redis')
+            self.assertEqual(result['changes'], {'redis': {'old': None, 'new': 'new-redis'}})
+            self.assertTrue(dockerio.pulled('present')['result'])
+        self.assertFalse(pull.called)
+
+
 if __name__ == '__main__':
     from integration import run_tests
-    run_tests(DockerStateTestCase, needs_daemon=False)
+    run_tests(DockerStateTestCase, DockerPulledPrefetchTestCase, needs_daemon=False)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+'''
+Test module for the zapi client, against a stubbed httplib connection
+'''
+
+# Import python libs
+from __future__ import absolute_import
+import httplib
+import json
+import socket
+
+# Import Salt Testing libs
+from salttesting import TestCase, skipIf
+from salttesting.helpers import ensure_in_syspath
+from salttesting.mock import NO_MOCK, NO_MOCK_REASON, patch
+
+ensure_in_syspath('../../')
+
+from salt.states import zapi
+
+SESSION_ERROR = {'code': -32602, 'message': 'Invalid params.',
+                 'data': 'Session terminated, re-login, please.'}
+
+
+class FakeResponse(object):
+    def __init__(self, content, status=200):
+        self.status = status
+        self.reason = 'OK'
+        self.data = json.dumps(content)
+
+    def read(self):
+        return self.data
+
+    def getheader(self, name, default=None):
+        return default
+
+
+class FakeServer(object):
+    '''
+    Answers the requests in turn with the queued answers: an exception is
+    raised, a function is called with the decoded request and returns the
+    response content, and anything else is the response content
+    '''
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.requests = []
+        self.connections = []
+
+    def connection(self, netloc, timeout=None):
+        conn = FakeConnection(self)
+        self.connections.append(conn)
+        return conn
+
+
+class FakeConnection(object):
+    def __init__(self, server):
+        self.server = server
+        self.sock = None
+        self.request_body = None
+
+    def request(self, method, path, body, headers):
+        self.server.requests.append(json.loads(body))
+        self.request_body = body
+        self.sock = object()
+
+    def getresponse(self):
+        answer = self.server.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        if callable(answer):
+            answer = answer(json.loads(self.request_body))
+        return FakeResponse(answer)
+
+    def close(self):
+        self.sock = None
+
+
+def _login(token):
+    return lambda request: {'jsonrpc': '2.0', 'result': token, 'id': request['id']}
+
+
+def _result(result):
+    return lambda request: {'jsonrpc': '2.0', 'result': result, 'id': request['id']}
+
+
+@skipIf(NO_MOCK, NO_MOCK_REASON)
+class ZabbixAPITestCase(TestCase):
+    def setUp(self):
+        # ZabbixAPI is a per-class singleton, start each test with a new one
+        zapi.ZabbixAPI._state.pop(zapi.ZabbixAPI, None)
+        self.api = zapi.ZabbixAPI(url='http://zabbix.example.com/zabbix/', user='admin',
+                                  password='secret', session_ttl=0)
+
+    def _serve(self, *answers):
+        server = FakeServer(*answers)
+        patcher = patch.object(zapi.httplib, 'HTTPConnection', server.connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return server
+
+    def test_retry_reused_connection(self):
+        server = self._serve(_login('token'), httplib.BadStatusLine("''"), _result(['host']))
+        self.api.ensureLogin()
+        self.assertEqual(self.api.call('host.get', {}), ['host'])
+
+        # The closed keep-alive connection was replaced and the request sent again
+        self.assertEqual(len(server.connections), 2)
+        self.assertEqual([x['method'] for x in server.requests], ['user.login', 'host.get', 'host.get'])
+
+    def test_no_retry_fresh_connection(self):
+        server = self._serve(httplib.BadStatusLine("''"))
+        self.assertRaises(httplib.BadStatusLine, self.api.login)
+        self.assertEqual(len(server.requests), 1)
+
+        # Nor after a timeout on a reused connection, the request may have run
+        server = self._serve(_login('token'), socket.timeout('timed out'))
+        self.api.login()
+        self.assertRaises(socket.timeout, self.api.call, 'host.create', {'host': 'a'})
+        self.assertEqual([x['method'] for x in server.requests], ['user.login', 'host.create'])
+
+    def test_batch_results_by_id(self):
+        def _reversed(requests):
+            # Answers out of order
+            return [{'jsonrpc': '2.0', 'result': x['method'], 'id': x['id']} for x in reversed(requests)]
+
+        self._serve(_login('token'), _reversed)
+        self.api.login()
+        with self.api.batch() as batch:
+            batch.add('host.get', {})
+            batch.find('Item', {'key_': 'a'})
+        self.assertEqual(batch.results, ['host.get', 'item.get'])
+
+        self.api.close()
+        # Nothing for the last request
+        self._serve(lambda requests: _reversed(requests[:-1]))
+        requests = [self.api.json_dict(x, {}) for x in ('host.get', 'item.get', 'template.get')]
+        self.assertEqual(self.api.postBatch(requests),
+                         [{'jsonrpc': '2.0', 'result': 'host.get', 'id': requests[0]['id']},
+                          {'jsonrpc': '2.0', 'result': 'item.get', 'id': requests[1]['id']},
+                          {}])
+
+    def test_relogin_on_auth_error(self):
+        server = self._serve(_login('token1'),
+                             lambda request: {'jsonrpc': '2.0', 'error': SESSION_ERROR, 'id': request['id']},
+                             _login('token2'),
+                             _result(['host']))
+        self.api.ensureLogin()
+        self.assertEqual(self.api.call('host.get', {}), ['host'])
+        self.assertEqual(self.api.authToken(), 'token2')
+        self.assertEqual([(x['method'], x['auth']) for x in server.requests],
+                         [('user.login', ''), ('host.get', 'token1'),
+                          ('user.login', ''), ('host.get', 'token2')])
+
+    def test_batch_relogin_on_auth_error(self):
+        server = self._serve(_login('token1'),
+                             lambda requests: [{'jsonrpc': '2.0', 'error': SESSION_ERROR, 'id': x['id']}
+                                               for x in requests],
+                             _login('token2'),
+                             lambda requests: [{'jsonrpc': '2.0', 'result': [], 'id': x['id']}
+                                               for x in requests])
+        self.api.login()
+        with self.api.batch() as batch:
+            batch.add('host.get', {})
+        self.assertEqual(batch.results, [[]])
+        self.assertEqual(server.requests[-1][0]['auth'], 'token2')
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(ZabbixAPITestCase, needs_daemon=False)